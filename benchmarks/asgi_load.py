@@ -0,0 +1,138 @@
+"""Concurrent GET throughput and latency: sync WSGI workers versus ASGI
+
+Seeds a throwaway database, starts gunicorn once with sync workers on
+honeyrae.wsgi and once with uvicorn workers on honeyrae.asgi (with
+ASYNC_VIEWS on), and drives each with the same number of keep-alive
+connections requesting the ticket list and ticket detail routes.
+
+    python benchmarks/asgi_load.py --connections 64 --workers 2 --seconds 15
+
+The response cache is off unless --response-cache is passed, so every
+request reaches the database.
+"""
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+from common import BASE_DIR, benchmark_database, percentile, seed
+
+# pylint: disable=wrong-import-order
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from repairsapi.models import Employee, Ticket
+
+MODES = {
+    'wsgi': ['gunicorn', 'honeyrae.wsgi'],
+    'asgi': ['gunicorn', 'honeyrae.asgi:application', '-c', 'honeyrae/gunicorn_asgi.py'],
+}
+
+
+def database_env(path):
+    """Environment pointing the servers at the benchmark database"""
+    if connection.vendor == 'sqlite':
+        return {'SQLITE_PATH': path}
+    url = urlparse(os.environ['DATABASE_URL'])
+    return {'DATABASE_URL': url._replace(path=f'/{connection.settings_dict["NAME"]}').geturl()}
+
+
+def start_server(mode, port, workers, env):
+    command = MODES[mode] + ['-b', f'127.0.0.1:{port}', '-w', str(workers)]
+    server = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            probe = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            probe.request('GET', '/tickets')
+            probe.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def drive(port, paths, token, stop, timings, errors):
+    client = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Authorization': f'Token {token}'}
+    index = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            client.request('GET', paths[index % len(paths)], headers=headers)
+            response = client.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append('connection')
+            client.close()
+            client = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        timings.append(time.perf_counter() - started)
+        index += 1
+    client.close()
+
+
+def run(mode, args, env, token, paths):
+    server = start_server(mode, args.port, args.workers, env)
+    try:
+        stop = threading.Event()
+        timings, errors = [], []
+        threads = [threading.Thread(target=drive, args=(args.port, paths, token, stop, timings, errors))
+                   for _ in range(args.connections)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return timings, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--tickets', type=int, default=20000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--response-cache', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'load.sqlite3')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+        with benchmark_database():
+            _, employee_ids = seed(args.tickets)
+            staff = Employee.objects.select_related('user').get(pk=employee_ids[0]).user
+            token = Token.objects.create(user=staff).key
+            ticket_ids = list(Ticket.objects.values_list('id', flat=True)[:100])
+            paths = ['/tickets?page_size=50'] + [f'/tickets/{ticket_id}' for ticket_id in ticket_ids[:9]]
+            env = {**os.environ, **database_env(path),
+                   'RESPONSE_CACHE': str(args.response_cache),
+                   'PYTHONPATH': str(BASE_DIR)}
+
+            results = {}
+            for mode in MODES:
+                results[mode] = run(mode, args, {**env, 'ASYNC_VIEWS': str(mode == 'asgi')}, token, paths)
+
+    print(f'{args.connections} connections, {args.workers} workers, {args.seconds:.0f} s per mode '
+          f'on {connection.vendor}')
+    for mode, (timings, errors) in results.items():
+        print(f'  {mode}: {len(timings) / args.seconds:8.1f} req/s  '
+              f'p50 {percentile(timings, 0.5) * 1000:7.1f} ms  '
+              f'p99 {percentile(timings, 0.99) * 1000:7.1f} ms  '
+              f'{len(errors)} errors')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Bulk import versus creating accounts and tickets one row at a time
+
+Builds --customers customer records and --tickets ticket records as
+NDJSON lines, then imports them twice into a throwaway database: with
+BulkImport (batched validation and bulk_create per transaction) and
+the way register_user and fixtures do it, a few INSERTs per row. Both
+runs start from an empty database.
+
+    python benchmarks/bulk_import.py --customers 20000 --tickets 50000
+"""
+import argparse
+import json
+import random
+import time
+from common import PROBLEMS, benchmark_database
+
+# pylint: disable=wrong-import-order
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.authtoken.models import Token
+from repairsapi.imports import BulkImport, read_records
+from repairsapi.models import Customer, Ticket, historical_ticket_dates
+
+
+def records(customers, tickets, seed_value=1):
+    rng = random.Random(seed_value)
+    customer_lines = [json.dumps({
+        'username': f'import-{n}', 'email': f'import-{n}@example.com', 'first_name': 'Imported',
+        'last_name': str(n), 'address': f'{n} Main St'}) for n in range(customers)]
+    ticket_lines = []
+    for n in range(tickets):
+        day = rng.randrange(1, 28)
+        completed = rng.random() < 0.5
+        ticket_lines.append(json.dumps({
+            'customer': f'import-{rng.randrange(customers)}', 'description': f'{rng.choice(PROBLEMS)} ({n})',
+            'priority': rng.choice(['low', 'medium', 'high', 'urgent']),
+            'date_created': f'2023-03-{day:02d}T10:00:00+00:00',
+            'date_completed': f'2023-04-{day:02d}' if completed else None}))
+    return customer_lines, ticket_lines
+
+
+def bulk(customer_lines, ticket_lines):
+    customers = BulkImport('customers', tokens=True).run(read_records(customer_lines, 'ndjson'))
+    tickets = BulkImport('tickets').run(read_records(ticket_lines, 'ndjson'))
+    return customers.created + tickets.created
+
+
+def row_at_a_time(customer_lines, ticket_lines):
+    customer_ids = {}
+    for line in customer_lines:
+        record = json.loads(line)
+        with transaction.atomic():
+            user = User.objects.create(username=record['username'], email=record['email'],
+                                       first_name=record['first_name'], last_name=record['last_name'],
+                                       password=make_password(None))
+            customer_ids[user.username] = Customer.objects.create(user=user, address=record['address']).id
+            Token.objects.create(user=user)
+    with historical_ticket_dates():
+        for line in ticket_lines:
+            record = json.loads(line)
+            Ticket.objects.create(customer_id=customer_ids[record['customer']], description=record['description'],
+                                  priority=record['priority'], date_created=parse_datetime(record['date_created']),
+                                  date_completed=parse_date(record['date_completed'] or ''))
+    return len(customer_lines) + len(ticket_lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--customers', type=int, default=20000)
+    parser.add_argument('--tickets', type=int, default=50000)
+    args = parser.parse_args()
+
+    customer_lines, ticket_lines = records(args.customers, args.tickets)
+    results = []
+    for name, run in (('bulk import', bulk), ('row at a time', row_at_a_time)):
+        with benchmark_database():
+            started = time.perf_counter()
+            rows = run(customer_lines, ticket_lines)
+            results.append((name, rows, time.perf_counter() - started))
+
+    print(f'{args.customers} customers and {args.tickets} tickets on {connection.vendor}')
+    for name, rows, seconds in results:
+        print(f'  {name:<14}  {rows:8d} rows  {seconds:8.2f} s  {rows / seconds:10.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
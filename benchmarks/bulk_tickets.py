@@ -0,0 +1,62 @@
+"""One-by-one PUT /tickets/<id> versus a single POST /tickets/bulk
+
+Reassigns the same set of tickets both ways and reports wall time and
+query counts.
+
+    python benchmarks/bulk_tickets.py --tickets 500
+"""
+import argparse
+import time
+from common import benchmark_database, seed
+
+# pylint: disable=wrong-import-order
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from repairsapi.models import Employee, Ticket
+
+
+def timed(func):
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+    return elapsed, len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=500)
+    args = parser.parse_args()
+
+    with benchmark_database():
+        _, employee_ids = seed(args.tickets, customers=100, employees=10)
+        staff = Employee.objects.select_related('user').get(pk=employee_ids[0]).user
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=staff).key}')
+        ticket_ids = list(Ticket.objects.values_list('id', flat=True)[:args.tickets])
+
+        def one_by_one():
+            for ticket_id in ticket_ids:
+                response = client.put(f'/tickets/{ticket_id}', {'employee': employee_ids[1]}, format='json')
+                assert response.status_code == 200, response.content
+
+        def bulk():
+            operations = [{'op': 'assign', 'id': ticket_id, 'employee': employee_ids[2]}
+                          for ticket_id in ticket_ids]
+            response = client.post('/tickets/bulk', operations, format='json')
+            assert response.status_code == 200, response.content
+
+        single_time, single_queries = timed(one_by_one)
+        bulk_time, bulk_queries = timed(bulk)
+
+    print(f'{len(ticket_ids)} reassignments on {connection.vendor}')
+    print(f'  one-by-one: {single_time * 1000:9.1f} ms  {single_queries:6d} queries  '
+          f'{len(ticket_ids)} requests')
+    print(f'  bulk:       {bulk_time * 1000:9.1f} ms  {bulk_queries:6d} queries  1 request')
+    print(f'  speedup:    {single_time / bulk_time:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Shared setup for the benchmark scripts
+
+Importing this module configures Django from honeyrae.settings, so the
+scripts can be run directly, e.g. `python benchmarks/ticket_indexes.py`.
+Set DATABASE_URL to benchmark against PostgreSQL instead of SQLite.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'honeyrae.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark-only-secret-key')
+
+import django  # pylint: disable=wrong-import-position
+
+django.setup()
+
+# pylint: disable=wrong-import-position
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from repairsapi.models import Customer, Employee, Ticket, historical_ticket_dates
+
+
+PROBLEMS = [
+    'Cracked phone screen', 'Laptop will not boot', 'Printer jams on every page',
+    'Router drops the wifi connection', 'Keyboard keys are sticking', 'Tablet battery drains overnight',
+    'Monitor flickers after warming up', 'Desktop fan is very loud', 'Water damage on the charging port',
+    'Smart TV cannot find any channels', 'Game console overheats', 'Speakers crackle at high volume',
+]
+
+
+@contextmanager
+def benchmark_database():
+    """Run inside a throwaway database built from the migrations"""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed(tickets, customers=1000, employees=50, batch_size=10000, seed_value=1):
+    """Bulk insert a synthetic data set and return (customer ids, employee ids)
+
+    Tickets are spread over the last two years with roughly 20% open,
+    30% in progress and 50% completed.
+    """
+    rng = random.Random(seed_value)
+    password = make_password(None)
+    users = [User(username=f'bench-customer-{i}', first_name='Cus', last_name=str(i), password=password)
+             for i in range(customers)]
+    users += [User(username=f'bench-employee-{i}', first_name='Emp', last_name=str(i), password=password,
+                   is_staff=True) for i in range(employees)]
+    User.objects.bulk_create(users, batch_size=batch_size)
+    user_ids = dict(User.objects.filter(username__startswith='bench-').values_list('username', 'id'))
+
+    Customer.objects.bulk_create(
+        [Customer(user_id=user_ids[f'bench-customer-{i}'], address=f'{i} Main St') for i in range(customers)],
+        batch_size=batch_size)
+    Employee.objects.bulk_create(
+        [Employee(user_id=user_ids[f'bench-employee-{i}'], specialty='General') for i in range(employees)],
+        batch_size=batch_size)
+    customer_ids = list(Customer.objects.values_list('id', flat=True))
+    employee_ids = list(Employee.objects.values_list('id', flat=True))
+
+    priorities = [choice for choice, _ in Ticket.PRIORITY_CHOICES]
+    now = timezone.now()
+    with historical_ticket_dates():
+        for start in range(0, tickets, batch_size):
+            batch = []
+            for number in range(start, min(start + batch_size, tickets)):
+                created = now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+                roll = rng.random()
+                batch.append(Ticket(
+                    customer_id=rng.choice(customer_ids),
+                    employee_id=rng.choice(employee_ids) if roll >= 0.2 else None,
+                    description=f'{rng.choice(PROBLEMS)} (ref {number})',
+                    emergency=rng.random() < 0.05,
+                    priority=rng.choices(priorities, weights=(30, 45, 20, 5))[0],
+                    date_created=created,
+                    date_completed=(created + timedelta(days=rng.randrange(30))).date()
+                    if roll >= 0.5 else None,
+                ))
+            Ticket.objects.bulk_create(batch)
+    return customer_ids, employee_ids
+
+
+def analyze():
+    """Refresh the planner statistics after bulk loading"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(func, repeat=5):
+    """Run func `repeat` times and return (median, best) seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), min(timings)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
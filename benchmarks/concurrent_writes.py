@@ -0,0 +1,142 @@
+"""Concurrent writers and readers: stock connection settings versus tuned
+
+Seeds a database file, then forks --writers processes that each run the
+shape of PUT /tickets/<id> in a transaction (read the ticket, reassign
+it, save) and --readers processes that page through the ticket list.
+Like gunicorn workers, each process handles one "request" at a time
+and lets Django close or keep its connection afterwards.
+
+On SQLite the stock run uses Django's defaults: deferred transactions,
+a rollback journal, no persistent connections. The tuned run uses the
+settings in honeyrae/settings.py: IMMEDIATE transactions, the
+SQLITE_PRAGMAS and CONN_MAX_AGE. On PostgreSQL (DATABASE_URL set) the
+runs compare a new connection per request against the psycopg 3 pool.
+
+    python benchmarks/concurrent_writes.py --writers 8 --readers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from common import benchmark_database, percentile, seed
+
+# pylint: disable=wrong-import-order
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.utils import OperationalError
+from django.test.utils import override_settings
+from repairsapi.models import Ticket
+
+
+def configurations():
+    """(name, settings_dict changes, settings overrides) of the runs to compare"""
+    if connection.vendor == 'sqlite':
+        return [
+            ('stock', {'CONN_MAX_AGE': 0, 'OPTIONS': {}}, {'SQLITE_PRAGMAS': {}}),
+            ('tuned', {'CONN_MAX_AGE': 600, 'OPTIONS': {'transaction_mode': 'IMMEDIATE'}}, {}),
+        ]
+    options = {key: value for key, value in connection.settings_dict['OPTIONS'].items() if key != 'pool'}
+    pool = {'min_size': settings.DATABASE_POOL['MIN_SIZE'], 'max_size': settings.DATABASE_POOL['MAX_SIZE'],
+            'timeout': settings.DATABASE_POOL['TIMEOUT']}
+    return [
+        ('connect per request', {'CONN_MAX_AGE': 0, 'OPTIONS': options}, {}),
+        ('psycopg pool', {'CONN_MAX_AGE': 0, 'OPTIONS': {**options, 'pool': pool}}, {}),
+    ]
+
+
+def writer(ticket_ids, employee_ids, deadline, results):
+    rng = random.Random(os.getpid())
+    latencies, errors = [], 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                ticket = Ticket.objects.get(pk=rng.choice(ticket_ids))
+                ticket.employee_id = rng.choice(employee_ids)
+                ticket.save()
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+        close_old_connections()
+    results.put(('write', latencies, errors))
+
+
+def reader(deadline, results):
+    latencies, errors = [], 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            list(Ticket.objects.order_by('-date_created', '-id').values_list('id', 'description')[:50])
+            latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            errors += 1
+        close_old_connections()
+    results.put(('read', latencies, errors))
+
+
+def run(args, ticket_ids, employee_ids):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    deadline = time.monotonic() + args.seconds
+    connections.close_all()
+    processes = [context.Process(target=writer, args=(ticket_ids, employee_ids, deadline, results))
+                 for _ in range(args.writers)]
+    processes += [context.Process(target=reader, args=(deadline, results)) for _ in range(args.readers)]
+    for process in processes:
+        process.start()
+    totals = {'write': ([], 0), 'read': ([], 0)}
+    for _ in processes:
+        kind, latencies, errors = results.get()
+        totals[kind] = (totals[kind][0] + latencies, totals[kind][1] + errors)
+    for process in processes:
+        process.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--tickets', type=int, default=20000)
+    args = parser.parse_args()
+
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Separate processes need a database file, not an in-memory one
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'writes.sqlite3')
+        with benchmark_database():
+            _, employee_ids = seed(args.tickets, customers=200, employees=20)
+            ticket_ids = list(Ticket.objects.values_list('id', flat=True))
+            original = {key: connection.settings_dict[key] for key in ('CONN_MAX_AGE', 'OPTIONS')}
+            for name, changes, overrides in configurations():
+                connections.close_all()
+                connection.settings_dict.update(changes)
+                if connection.vendor == 'sqlite':
+                    # journal_mode is stored in the file, so reset it for each run
+                    with override_settings(SQLITE_PRAGMAS={}):
+                        with connection.cursor() as cursor:
+                            cursor.execute('PRAGMA journal_mode = DELETE')
+                        connections.close_all()
+                try:
+                    with override_settings(**overrides):
+                        reports.append((name, run(args, ticket_ids, employee_ids)))
+                finally:
+                    connections.close_all()
+                    connection.settings_dict.update(original)
+
+    print(f'{args.writers} writers, {args.readers} readers, {args.seconds:.0f} s per run on {connection.vendor}')
+    for name, totals in reports:
+        writes, write_errors = totals['write']
+        reads, read_errors = totals['read']
+        print(f'  {name}:')
+        print(f'    writes {len(writes) / args.seconds:8.1f}/s  p50 {percentile(writes, 0.5) * 1000:7.1f} ms  '
+              f'p99 {percentile(writes, 0.99) * 1000:7.1f} ms  {write_errors} failed')
+        print(f'    reads  {len(reads) / args.seconds:8.1f}/s  p50 {percentile(reads, 0.5) * 1000:7.1f} ms  '
+              f'p99 {percentile(reads, 0.99) * 1000:7.1f} ms  {read_errors} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Ticket latency and login throughput during a burst of logins
+
+Fires --logins concurrent POST /login requests while another thread
+keeps reading the ticket list, and reports login throughput, how many
+logins were turned away with 503, and ticket list latency compared with
+an idle server. --last-login turns on LOGIN_SIGNAL, which adds the
+last_login UPDATE to every accepted login.
+
+    python benchmarks/login_burst.py --logins 200 --concurrency 32 --iterations 600000
+    python benchmarks/login_burst.py --logins 200 --concurrency 32 --last-login
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from common import benchmark_database, percentile, seed
+
+# pylint: disable=wrong-import-order
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from repairsapi.models import Employee
+
+PASSWORD = 'burst-password'
+
+
+def ticket_latencies(client, stop, url):
+    timings = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.content
+    connections.close_all()
+    return timings
+
+
+def login(username):
+    response = APIClient().post('/login', {'username': username, 'password': PASSWORD}, format='json')
+    connections.close_all()
+    return response.status_code
+
+
+def burst(args, hashing):
+    """Run the login burst next to a ticket reader; returns (codes, seconds, idle, busy timings)"""
+    with benchmark_database(), override_settings(
+            PASSWORD_HASH_ITERATIONS=args.iterations, AUTH_HASHING=hashing, LOGIN_SIGNAL=args.last_login,
+            RESPONSE_CACHE={'ENABLED': False, 'ALIAS': 'responses', 'TIMEOUT': 0}):
+        _, employee_ids = seed(args.tickets, customers=args.logins, employees=5)
+        User.objects.filter(username__startswith='bench-customer-').update(password=make_password(PASSWORD))
+        usernames = list(User.objects.filter(username__startswith='bench-customer-')
+                         .values_list('username', flat=True))
+        user_ids = User.objects.filter(username__startswith='bench-').values_list('id', flat=True)
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user_id=user_id) for user_id in user_ids])
+        staff = Employee.objects.select_related('user').get(pk=employee_ids[0]).user
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=staff).key}')
+        url = '/tickets?page_size=100'
+
+        idle = []
+        for _ in range(50):
+            started = time.perf_counter()
+            client.get(url)
+            idle.append(time.perf_counter() - started)
+
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=args.concurrency + 1) as executor:
+            reader = executor.submit(ticket_latencies, client, stop, url)
+            started = time.perf_counter()
+            codes = list(executor.map(login, usernames))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            busy = reader.result()
+
+    return codes, elapsed, idle, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=None, help='PBKDF2 iterations')
+    parser.add_argument('--workers', type=int, default=None, help='hashing pool threads')
+    parser.add_argument('--queue', type=int, default=8, help='hashing pool queue slots')
+    parser.add_argument('--tickets', type=int, default=5000)
+    parser.add_argument('--last-login', action='store_true', help='record last_login on each login')
+    args = parser.parse_args()
+
+    hashing = {'WORKERS': args.workers, 'QUEUE': args.queue, 'TIMEOUT': 2.0}
+    with tempfile.TemporaryDirectory() as directory:
+        # The last_login writes need the database's own locking, which an
+        # in-memory SQLite test database shared between threads lacks
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'logins.sqlite3')
+        codes, elapsed, idle, busy = burst(args, hashing)
+
+    accepted = codes.count(200)
+    print(f'{len(codes)} logins, {args.concurrency} concurrent, on {connection.vendor}'
+          f'{", recording last_login" if args.last_login else ""}')
+    print(f'  accepted:  {accepted:6d}  ({accepted / elapsed:7.1f} logins/s)')
+    print(f'  rejected:  {codes.count(503):6d}  (503 from admission control)')
+    for label, timings in (('idle', idle), ('burst', busy)):
+        print(f'  tickets {label:5s}  p50 {percentile(timings, 0.5) * 1000:7.1f} ms  '
+              f'p95 {percentile(timings, 0.95) * 1000:7.1f} ms  ({len(timings)} requests)')
+
+
+if __name__ == '__main__':
+    main()
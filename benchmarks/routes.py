@@ -0,0 +1,356 @@
+"""Every route in honeyrae/urls.py at fixed concurrency, with a JSON report
+
+Generates a data set with `manage.py generate_data`. Then each
+scenario below is driven through Django's test client from
+--concurrency threads, --requests times over. The report holds, per
+scenario:
+- throughput
+- latency percentiles
+- SQL queries per request
+- error count
+
+With --baseline, the report is compared against a stored report. The
+script exits with status 1 when a scenario runs more queries, or is
+slower than the baseline by more than --tolerance.
+
+    python benchmarks/routes.py --report report.json --baseline benchmarks/baseline.json
+    python benchmarks/routes.py --save-baseline benchmarks/baseline.json
+
+Timings only compare between runs on the same machine; record a
+baseline there first. Query counts compare anywhere. The admin site
+isn't driven. The harness stops if a route has no scenario, so new
+routes have to be added here.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+from io import StringIO
+from itertools import count
+from common import benchmark_database, percentile
+
+# pylint: disable=wrong-import-order
+import django
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from repairsapi.models import Customer, Employee, Ticket
+
+PASSWORD = 'benchmark-password'
+# Request data sent as is instead of JSON-encoded
+RawBody = namedtuple('RawBody', 'content_type text')
+IMPORT_ROWS = 100
+
+
+class Context:
+    """Ids and tokens the scenarios draw on, shared by the worker threads"""
+
+    def __init__(self):
+        staff = Employee.objects.order_by('id').select_related('user').first().user
+        self.staff_token = Token.objects.get(user=staff).key
+        customers = list(Customer.objects.order_by('id').values_list('id', 'user__username', 'user__auth_token'))
+        self.customer_ids = [row[0] for row in customers]
+        self.customer_usernames = [row[1] for row in customers]
+        self.customer_tokens = [row[2] for row in customers]
+        self.employee_ids = list(Employee.objects.order_by('id').values_list('id', flat=True))
+        self.ticket_ids = list(Ticket.objects.order_by('-date_created').values_list('id', flat=True)[:1000])
+        # Exports stream the last 2000 tickets, so a run doesn't dump the whole table per request
+        self.export_after = max(0, (Ticket.objects.order_by('-id').values_list('id', flat=True).first() or 0) - 2000)
+        self.created = {'ticket': deque(), 'employee': deque()}
+        self.run = f'{time.time_ns():x}'
+
+    def pick(self, values, index):
+        return values[index % len(values)]
+
+
+def created(kind):
+    """after() hook keeping the id of a created row for a later DELETE"""
+    def after(context, response):
+        if response.status_code == 201:
+            context.created[kind].append(response.json()['id'])
+    return after
+
+
+def take_created(kind):
+    def request(context, index):
+        return f'/{kind}s/{context.created[kind].popleft()}', None
+    return request
+
+
+# (route name, method, label, who, request(context, index) -> (path, data), after hook or None).
+# Writes that create rows run before the DELETEs that remove them.
+SCENARIOS = [
+    ('api-root', 'GET', 'root', 'staff', lambda c, i: ('/', None), None),
+    ('register', 'POST', 'customer', 'anonymous', lambda c, i: ('/register', {
+        'account_type': 'customer', 'username': f'bench-{c.run}-{i}', 'email': f'bench-{c.run}-{i}@example.com',
+        'first_name': 'Bench', 'last_name': str(i), 'password': PASSWORD, 'address': f'{i} Load St'}), None),
+    ('login', 'POST', 'customer', 'anonymous', lambda c, i: ('/login', {
+        'username': c.pick(c.customer_usernames, i), 'password': PASSWORD}), None),
+    ('metrics', 'GET', 'scrape', 'staff', lambda c, i: ('/metrics', None), None),
+    ('import', 'POST', f'{IMPORT_ROWS} customers', 'staff', lambda c, i: ('/import/customers', RawBody(
+        'application/x-ndjson', ''.join(json.dumps({
+            'username': f'import-{c.run}-{i}-{n}', 'email': f'import-{c.run}-{i}-{n}@example.com',
+            'first_name': 'Import', 'last_name': str(n), 'address': f'{n} Batch St'}) + '\n'
+            for n in range(IMPORT_ROWS)))), None),
+    ('customer-list', 'GET', 'page', 'staff', lambda c, i: ('/customers?page_size=100', None), None),
+    ('customer-detail', 'GET', 'one', 'staff', lambda c, i: (f'/customers/{c.pick(c.customer_ids, i)}', None), None),
+    ('employee-list', 'GET', 'all', 'staff', lambda c, i: ('/employees', None), None),
+    ('employee-list', 'POST', 'create', 'staff', lambda c, i: ('/employees', {
+        'username': f'bench-emp-{c.run}-{i}', 'email': f'bench-emp-{c.run}-{i}@example.com',
+        'firstName': 'Bench', 'lastName': str(i)}), created('employee')),
+    ('employee-detail', 'GET', 'one', 'staff', lambda c, i: (f'/employees/{c.pick(c.employee_ids, i)}', None), None),
+    ('employee-detail', 'PUT', 'specialty', 'staff', lambda c, i: (
+        f'/employees/{c.pick(c.employee_ids, i)}', {'id': c.pick(c.employee_ids, i), 'specialty': 'Phones'}), None),
+    ('employee-detail', 'DELETE', 'created', 'staff', take_created('employee'), None),
+    ('employee-workload', 'GET', 'all', 'staff', lambda c, i: ('/employees/workload', None), None),
+    ('employee-workload', 'GET', 'suggest', 'staff', lambda c, i: (
+        f'/employees/workload?ticket={c.pick(c.ticket_ids, i)}', None), None),
+    ('ticket-list', 'GET', 'page', 'staff', lambda c, i: ('/tickets?page_size=50', None), None),
+    ('ticket-list', 'GET', 'filtered page', 'staff', lambda c, i: (
+        '/tickets?status=unclaimed&priority=high&page_size=50', None), None),
+    ('ticket-list', 'GET', 'board fields', 'staff', lambda c, i: (
+        '/tickets?fields=id,status,priority,description&page_size=50', None), None),
+    ('ticket-list', 'GET', 'search', 'staff', lambda c, i: ('/tickets?q=screen&page_size=50', None), None),
+    ('ticket-list', 'GET', 'customer', 'customer', lambda c, i: ('/tickets', None), None),
+    ('ticket-list', 'POST', 'create', 'customer', lambda c, i: ('/tickets', {
+        'description': f'Benchmark ticket {i}: phone will not charge', 'priority': 'high'}), created('ticket')),
+    ('ticket-bulk', 'POST', 'assign 20', 'staff', lambda c, i: ('/tickets/bulk', [
+        {'op': 'assign', 'id': c.pick(c.ticket_ids, i * 20 + n), 'employee': c.pick(c.employee_ids, i)}
+        for n in range(20)]), None),
+    ('ticket-stats', 'GET', 'staff', 'staff', lambda c, i: ('/tickets/stats', None), None),
+    ('ticket-stats', 'GET', 'customer', 'customer', lambda c, i: ('/tickets/stats', None), None),
+    ('ticket-export', 'GET', 'csv', 'staff', lambda c, i: (f'/tickets/export?after={c.export_after}', None), None),
+    ('ticket-export', 'GET', 'columnar', 'staff', lambda c, i: (
+        f'/tickets/export?output=columnar&after={c.export_after}', None), None),
+    ('ticket-reports', 'GET', 'month', 'staff', lambda c, i: ('/tickets/reports', None), None),
+    ('ticket-cache-stats', 'GET', 'staff', 'staff', lambda c, i: ('/tickets/cache-stats', None), None),
+    ('ticket-events', 'GET', 'pending', 'staff', lambda c, i: ('/tickets/events?timeout=0', None), None),
+    ('ticket-detail', 'GET', 'one', 'staff', lambda c, i: (f'/tickets/{c.pick(c.ticket_ids, i)}', None), None),
+    ('ticket-detail', 'PUT', 'assign', 'staff', lambda c, i: (
+        f'/tickets/{c.pick(c.ticket_ids, i)}', {'employee': c.pick(c.employee_ids, i)}), None),
+    ('ticket-detail', 'DELETE', 'created', 'staff', take_created('ticket'), None),
+]
+
+
+def routes():
+    """(name, methods) of every non-admin route; methods is None for plain views"""
+    found = {}
+
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                if not pattern.namespace:
+                    walk(pattern.url_patterns)
+                continue
+            actions = getattr(pattern.callback, 'actions', None)
+            methods = found.setdefault(pattern.name, set() if actions else None)
+            if actions and methods is not None:
+                methods.update(method.upper() for method in actions)
+
+    walk(get_resolver().url_patterns)
+    return found
+
+
+def check_coverage():
+    covered = {}
+    for name, method, *_ in SCENARIOS:
+        covered.setdefault(name, set()).add(method)
+    missing = []
+    for name, methods in routes().items():
+        if name not in covered:
+            missing.append(name)
+        elif methods:
+            missing += [f'{method} {name}' for method in sorted(methods - covered[name])]
+    if missing:
+        sys.exit(f'No benchmark scenario for: {", ".join(missing)}')
+
+
+def client_for(who, context, worker):
+    # Server errors are counted in the report instead of raised
+    client = Client(raise_request_exception=False)
+    if who == 'staff':
+        client.defaults['HTTP_AUTHORIZATION'] = f'Token {context.staff_token}'
+    elif who == 'customer':
+        client.defaults['HTTP_AUTHORIZATION'] = f'Token {context.pick(context.customer_tokens, worker)}'
+    return client
+
+
+def run_scenario(scenario, context, concurrency, requests, first=0):
+    _, method, _, who, build, after = scenario
+    counter = count(first)
+    last = first + requests
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(number):
+        client = client_for(who, context, number)
+        try:
+            while (index := next(counter)) < last:
+                path, data = build(context, index)
+                content_type = 'application/json'
+                if isinstance(data, RawBody):
+                    content_type, body = data
+                else:
+                    body = json.dumps(data) if data is not None else ''
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.generic(method, path, body, content_type=content_type)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                if after is not None:
+                    after(context, response)
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_statuses': {str(code): errors.count(code) for code in sorted(set(errors))},
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {name: round(percentile(latencies, fraction) * 1000, 2)
+                       for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))},
+        'queries': {'mean': round(sum(queries) / len(queries), 2) if queries else 0,
+                    'max': max(queries, default=0)},
+    }
+
+
+def scenario_key(scenario):
+    name, method, label, *_ = scenario
+    return f'{method} {name} {label}'
+
+
+def compare(report, baseline, tolerance):
+    """Print the change against the baseline and return the regressed scenarios"""
+    regressions = []
+    changed = [key for key in ('vendor', 'tickets', 'concurrency', 'response_cache')
+               if report['meta'].get(key) != baseline['meta'].get(key)]
+    if changed:
+        print(f'warning: baseline was recorded with different {", ".join(changed)}')
+    print(f'  {"scenario":<42} {"p50 ms":>9} {"was":>9} {"req/s":>8} {"was":>8} {"queries":>8} {"was":>6}')
+    for key, result in report['scenarios'].items():
+        before = baseline['scenarios'].get(key)
+        if before is None:
+            print(f'  {key:<42} (new)')
+            continue
+        p50, was_p50 = result['latency_ms']['p50'], before['latency_ms']['p50']
+        problems = []
+        if result['queries']['mean'] > before['queries']['mean'] + 0.5:
+            problems.append('queries')
+        if p50 > was_p50 * (1 + tolerance) and p50 - was_p50 > 1:
+            problems.append('latency')
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            problems.append('throughput')
+        if result['errors'] > before['errors']:
+            problems.append('errors')
+        flag = f'  REGRESSED: {", ".join(problems)}' if problems else ''
+        print(f'  {key:<42} {p50:9.2f} {was_p50:9.2f} {result["throughput_rps"]:8.1f} '
+              f'{before["throughput_rps"]:8.1f} {result["queries"]["mean"]:8.2f} '
+              f'{before["queries"]["mean"]:6.2f}{flag}')
+        if problems:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=20000)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--employees', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--response-cache', action='store_true')
+    parser.add_argument('--hash-iterations', type=int, default=10000,
+                        help='PBKDF2 iterations while benchmarking; 0 keeps the configured cost')
+    parser.add_argument('--only', nargs='+', default=None, help='Run only scenarios for these route names')
+    parser.add_argument('--report', help='Write the JSON report here')
+    parser.add_argument('--baseline', help='Compare against this stored report')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed fractional slowdown before a scenario counts as regressed')
+    args = parser.parse_args()
+
+    check_coverage()
+    # Failed requests are counted per status; don't log each one
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    scenarios = [scenario for scenario in SCENARIOS if args.only is None or scenario[0] in args.only]
+    overrides = {'RESPONSE_CACHE': {**django.conf.settings.RESPONSE_CACHE, 'ENABLED': args.response_cache}}
+    if args.hash_iterations:
+        overrides['PASSWORD_HASH_ITERATIONS'] = args.hash_iterations
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, override_settings(**overrides):
+        # Worker threads need their own connections to one database,
+        # which an in-memory SQLite test database can't give them
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'routes.sqlite3')
+        with benchmark_database():
+            call_command('generate_data', tickets=args.tickets, customers=args.customers,
+                         employees=args.employees, seed=1, password=PASSWORD, tokens=True, stdout=StringIO())
+            context = Context()
+            for scenario in scenarios:
+                # One untimed request, past the indexes of the timed ones,
+                # warms up per-process caches
+                run_scenario(scenario, context, 1, 1, first=args.requests)
+                results[scenario_key(scenario)] = result = run_scenario(
+                    scenario, context, args.concurrency, args.requests)
+                print(f'{scenario_key(scenario):<44} {result["throughput_rps"]:8.1f} req/s  '
+                      f'p50 {result["latency_ms"]["p50"]:8.2f} ms  p99 {result["latency_ms"]["p99"]:8.2f} ms  '
+                      f'{result["queries"]["mean"]:6.2f} queries  {result["errors"]} errors')
+
+    report = {
+        'meta': {
+            'created': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'tickets': args.tickets,
+            'customers': args.customers,
+            'employees': args.employees,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'response_cache': args.response_cache,
+            'hash_iterations': args.hash_iterations,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': f'{platform.machine()} {os.cpu_count()} CPUs',
+        },
+        'scenarios': results,
+    }
+    for path in (args.report, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+                output.write('\n')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as stored:
+            regressions = compare(report, json.load(stored), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} scenarios regressed')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
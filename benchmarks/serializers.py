@@ -0,0 +1,52 @@
+"""Rows per second: DRF TicketSerializer versus the values_list() fast path
+
+Seeds the largest size once, then renders the first N tickets both ways
+(DRF with its planned select_related query) and reports the best of
+--repeat runs. Both sides include the query and the JSON rendering, and
+the script checks they produce the same bytes.
+
+    python benchmarks/serializers.py --sizes 1000 10000 100000
+"""
+import argparse
+from common import benchmark_database, measure, seed
+
+# pylint: disable=wrong-import-order
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from repairsapi.fast_serializers import fast_serializer
+from repairsapi.models import Ticket
+from repairsapi.views.ticket_view import TicketSerializer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    fast = fast_serializer(TicketSerializer)
+    renderer = JSONRenderer()
+    results = []
+    with benchmark_database():
+        seed(max(args.sizes))
+        ordered = Ticket.objects.order_by('-date_created', '-id')
+        for size in args.sizes:
+            def drf():
+                return renderer.render(TicketSerializer(TicketSerializer.plan(ordered)[:size], many=True).data)
+
+            def fast_path():
+                return fast.render_list(fast.values(ordered[:size])[0])
+
+            assert drf() == fast_path(), f'output differs at {size} rows'
+            _, drf_best = measure(drf, args.repeat)
+            _, fast_best = measure(fast_path, args.repeat)
+            results.append((size, drf_best, fast_best))
+
+    print(f'TicketSerializer on {connection.vendor}, best of {args.repeat}')
+    print(f'  {"rows":>7}  {"DRF rows/s":>12}  {"fast rows/s":>12}  {"speedup":>7}')
+    for size, drf_best, fast_best in results:
+        print(f'  {size:7d}  {size / drf_best:12.0f}  {size / fast_best:12.0f}  {drf_best / fast_best:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Worker boot time and per-request overhead, full versus API_ONLY settings
+
+Each run boots a fresh interpreter the way a gunicorn worker does
+without --preload: import honeyrae.wsgi (settings, django.setup() and
+the middleware chain), then load the URLconf. Runs go under
+`-X importtime`, and the modules that took longest to import in the
+last run of each profile are listed. Each run then sends --requests
+unauthenticated GET /tickets through the WSGI application, answered
+with a 401 by the middleware and DRF alone, to time what every request
+pays before a view does any work.
+
+    python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+PROFILES = [('full', 'False'), ('API_ONLY', 'True')]
+
+# Runs in the child interpreter; prints one JSON line
+CHILD = '''
+import io, json, sys, time
+started = time.perf_counter()
+import honeyrae.wsgi
+booted = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+routed = time.perf_counter()
+modules = len(sys.modules)
+
+environ = {{'REQUEST_METHOD': 'GET', 'PATH_INFO': '/tickets', 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'wsgi.url_scheme': 'http'}}
+
+def get():
+    response = honeyrae.wsgi.application(dict(environ, **{{'wsgi.input': io.BytesIO()}}),
+                                         lambda status, headers: None)
+    b''.join(response)
+    response.close()
+
+get()
+requests = {requests}
+timer = time.perf_counter()
+for _ in range(requests):
+    get()
+print(json.dumps({{'boot': booted - started, 'urls': routed - booted, 'modules': modules,
+                  'request': (time.perf_counter() - timer) / requests}}))
+'''
+
+
+def imports(stderr, depth=1):
+    """[(cumulative seconds, module)] from -X importtime output, down to `depth` levels
+
+    Everything the app imports sits under honeyrae.wsgi or honeyrae.urls,
+    so the level below those says where boot time goes.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split(':', 1)[1].split('|')
+        if (len(name) - len(name.lstrip()) - 1) // 2 <= depth:
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return rows
+
+
+def run(api_only, requests):
+    env = dict(os.environ, API_ONLY=api_only, DJANGO_SETTINGS_MODULE='honeyrae.settings',
+               SECRET_KEY=os.getenv('SECRET_KEY', 'benchmark-only-secret-key'), REPAIRSAPI_LOG_LEVEL='ERROR')
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD.format(requests=requests)],
+                           cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(child.stdout.strip().splitlines()[-1]), child.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    results = {}
+    for name, api_only in PROFILES:
+        runs = [run(api_only, args.requests) for _ in range(args.runs)]
+        results[name] = ([result for result, _ in runs], imports(runs[-1][1]))
+
+    print(f'Median of {args.runs} fresh interpreters')
+    print(f'  {"settings":<9}  {"boot ms":>8}  {"urls ms":>8}  {"ready ms":>8}  {"modules":>7}  {"request us":>10}')
+    for name, (runs, _) in results.items():
+        print(f'  {name:<9}  {statistics.median(r["boot"] for r in runs) * 1000:8.1f}  '
+              f'{statistics.median(r["urls"] for r in runs) * 1000:8.1f}  '
+              f'{statistics.median(r["boot"] + r["urls"] for r in runs) * 1000:8.1f}  '
+              f'{statistics.median(r["modules"] for r in runs):7.0f}  '
+              f'{statistics.median(r["request"] for r in runs) * 1e6:10.1f}')
+    for name, (_, rows) in results.items():
+        print(f'Slowest imports, {name}:')
+        for seconds, module in sorted(rows, reverse=True)[:args.top]:
+            print(f'  {seconds * 1000:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
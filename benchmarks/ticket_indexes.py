@@ -0,0 +1,102 @@
+"""Query plans and latency of the ticket filters with and without indexes
+
+Seeds a throwaway database, then runs each TicketView filter path with
+the Ticket.Meta indexes dropped and again with them in place,
+printing EXPLAIN output and median/best latency for both.
+
+    python benchmarks/ticket_indexes.py --tickets 1000000
+    DATABASE_URL=postgres://... python benchmarks/ticket_indexes.py
+"""
+import argparse
+import json
+import time
+from common import analyze, benchmark_database, measure, seed
+
+# pylint: disable=wrong-import-order
+from django.db import connection
+from django.db.models import Count, Q
+from repairsapi.models import Ticket
+
+PAGE = 100
+
+
+def access_paths(customer_id):
+    """The querysets TicketView issues for each filter, keyed by name"""
+    tickets = Ticket.objects.order_by('-date_created', '-id')
+    return {
+        'all newest page': tickets,
+        'status=unclaimed': tickets.filter(status=Ticket.STATUS_OPEN),
+        'status=in-progress': tickets.filter(status=Ticket.STATUS_IN_PROGRESS),
+        'status=done': tickets.filter(status=Ticket.STATUS_COMPLETED),
+        'priority=urgent': tickets.filter(priority='urgent'),
+        'customer scope': tickets.filter(customer_id=customer_id),
+    }
+
+
+def stats_query():
+    return Ticket.objects.aggregate(
+        urgent=Count('id', filter=Q(priority='urgent', status__in=Ticket.ACTIVE_STATUSES)),
+        high=Count('id', filter=Q(priority='high', status__in=Ticket.ACTIVE_STATUSES)),
+    )
+
+
+def run_paths(customer_id, repeat):
+    results = {}
+    for name, queryset in access_paths(customer_id).items():
+        page = queryset[:PAGE]
+        median, best = measure(lambda page=page: list(page.all()), repeat)
+        results[name] = {'median_ms': median * 1000, 'best_ms': best * 1000, 'plan': page.explain()}
+    median, best = measure(stats_query, repeat)
+    results['open priority counts'] = {
+        'median_ms': median * 1000, 'best_ms': best * 1000,
+        'plan': Ticket.objects.filter(
+            status__in=Ticket.ACTIVE_STATUSES, priority='urgent').order_by().explain(),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    indexes = Ticket._meta.indexes
+    with benchmark_database():
+        started = time.perf_counter()
+        customer_ids, _ = seed(args.tickets)
+        print(f'Seeded {args.tickets} tickets on {connection.vendor} '
+              f'in {time.perf_counter() - started:.1f}s')
+
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(Ticket, index)
+        analyze()
+        before = run_paths(customer_ids[0], args.repeat)
+
+        started = time.perf_counter()
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Ticket, index)
+        analyze()
+        print(f'Built {len(indexes)} indexes in {time.perf_counter() - started:.1f}s\n')
+        after = run_paths(customer_ids[0], args.repeat)
+
+    for name in before:
+        print(f'== {name}')
+        print(f'   before: {before[name]["median_ms"]:9.2f} ms median  '
+              f'{before[name]["best_ms"]:9.2f} ms best')
+        print(f'   after:  {after[name]["median_ms"]:9.2f} ms median  '
+              f'{after[name]["best_ms"]:9.2f} ms best')
+        print('   plan before:\n      ' + before[name]['plan'].replace('\n', '\n      '))
+        print('   plan after:\n      ' + after[name]['plan'].replace('\n', '\n      '))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'vendor': connection.vendor, 'tickets': args.tickets,
+                       'before': before, 'after': after}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
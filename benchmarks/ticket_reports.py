@@ -0,0 +1,58 @@
+"""Ticket reports from the daily rollups versus from the ticket rows
+
+Seeds --tickets rows, fills the rollup table in one pass as
+`manage.py ticket_rollups --all` does, then times the same reports
+both ways: rollup_report() reading the rollup rows, and
+live_report() folding every ticket row the way clients had to from
+/tickets. The rollup side should stay flat as --tickets grows.
+
+    python benchmarks/ticket_reports.py --tickets 1000000
+"""
+import argparse
+import datetime
+import time
+from common import analyze, benchmark_database, measure, seed
+
+# pylint: disable=wrong-import-order
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from repairsapi.reports import live_report, refresh_rollups, rollup_report
+
+RANGES = [('last 7 days', 7), ('last 30 days', 30), ('last year', 365), ('last two years', 730)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with benchmark_database():
+        # Seed without the write-time upkeep, then build the table in one pass
+        with override_settings(TICKET_ROLLUPS=False):
+            seed(args.tickets)
+        started = time.perf_counter()
+        rows = refresh_rollups()
+        refresh_seconds = time.perf_counter() - started
+        analyze()
+        end = timezone.localdate()
+        for name, days in RANGES:
+            start = end - datetime.timedelta(days=days - 1)
+            if rollup_report(start, end) != live_report(start, end):
+                raise SystemExit(f'{name}: the rollup report differs from the live one')
+            rollup_median, _ = measure(lambda: rollup_report(start, end), args.repeat)
+            live_median, _ = measure(lambda: live_report(start, end), args.repeat)
+            results.append((name, rollup_median, live_median))
+
+    print(f'Reports over {args.tickets} tickets on {connection.vendor}, median of {args.repeat}; '
+          f'{rows} rollup rows built in {refresh_seconds:.2f} s')
+    print(f'  {"range":<16}  {"rollups ms":>10}  {"ticket rows ms":>14}  {"speedup":>7}')
+    for name, rollup_median, live_median in results:
+        print(f'  {name:<16}  {rollup_median * 1000:10.2f}  {live_median * 1000:14.2f}  '
+              f'{live_median / rollup_median:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Full-text search on the index versus description__icontains
+
+Seeds --tickets rows, then times the first page of results for a few
+queries both ways: search_tickets() (FTS5 on SQLite, the GIN tsvector
+index on PostgreSQL) ranked best first, and an unranked icontains scan
+in list order. Rare terms show the difference best: icontains has to
+read every row to find them.
+
+    python benchmarks/ticket_search.py --tickets 1000000
+"""
+import argparse
+from common import analyze, benchmark_database, measure, seed
+
+# pylint: disable=wrong-import-order
+from django.db import connection
+from django.db.models import Q
+from repairsapi.models import Ticket
+from repairsapi.search import search_terms, search_tickets
+
+QUERIES = ['screen', 'battery drains', 'overheats console', 'ref 4242', 'nothing matches this']
+PAGE_SIZE = 100
+
+
+def icontains(text):
+    condition = Q()
+    for term in search_terms(text):
+        condition &= Q(description__icontains=term)
+    return Ticket.objects.filter(condition).order_by('-date_created', '-id')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with benchmark_database():
+        seed(args.tickets)
+        analyze()
+        for text in QUERIES:
+            indexed = search_tickets(Ticket.objects.all(), text)
+            scanned = icontains(text)
+            matches = indexed.count()
+            indexed_median, _ = measure(lambda: list(indexed.values_list('id')[:PAGE_SIZE]), args.repeat)
+            scanned_median, _ = measure(lambda: list(scanned.values_list('id')[:PAGE_SIZE]), args.repeat)
+            results.append((text, matches, indexed_median, scanned_median))
+
+    print(f'First page of {PAGE_SIZE} from {args.tickets} tickets on {connection.vendor}, '
+          f'median of {args.repeat}')
+    print(f'  {"query":<22}  {"matches":>8}  {"index ms":>9}  {"icontains ms":>12}  {"speedup":>7}')
+    for text, matches, indexed_median, scanned_median in results:
+        print(f'  {text:<22}  {matches:8d}  {indexed_median * 1000:9.2f}  {scanned_median * 1000:12.2f}  '
+              f'{scanned_median / indexed_median:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
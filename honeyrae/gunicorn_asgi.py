@@ -0,0 +1,15 @@
+"""gunicorn settings for serving honeyrae.asgi with uvicorn workers
+
+    ASYNC_VIEWS=True gunicorn honeyrae.asgi:application -c honeyrae/gunicorn_asgi.py
+
+Each worker is a single uvicorn event loop, so size WEB_CONCURRENCY to
+the CPU count rather than to the number of concurrent requests.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+worker_class = 'uvicorn_worker.UvicornWorker'
+keepalive = 5
+errorlog = '-'
@@ -0,0 +1,57 @@
+"""gunicorn settings for serving honeyrae.wsgi with threaded workers
+
+    API_ONLY=True PRELOAD_APP=True gunicorn honeyrae.wsgi -c honeyrae/gunicorn_wsgi.py
+
+With PRELOAD_APP=True (or --preload) the master imports the app once and
+forks the workers from it, so a worker starts without importing Django
+and shares the master's memory until it writes to it. Before forking,
+the master loads the URLconf and translations that workers would load
+on their first request, closes any database connection it opened, and
+freezes the garbage collector's view of everything loaded so far, so
+collections in the workers don't write to (and copy) those pages.
+
+Each worker serves WEB_THREADS requests at once from a thread pool
+(gthread). Password hashing for logins is capped at part of those
+threads (settings.AUTH_HASHING), so a login burst can't take them all;
+a sync worker only ever has one request in flight, which leaves that
+cap nothing to do. Requests that are meant to take long, such as
+/tickets/events streams, close after
+EVENT_FEED['SYNC_MAX_STREAM_SECONDS'], below WEB_TIMEOUT, after which
+the master kills a sync worker stuck in a request.
+"""
+import gc
+import os
+
+preload_app = os.getenv('PRELOAD_APP', 'False') == 'True'
+errorlog = '-'
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+
+if preload_app:
+    # Collections while the app loads would leave freed holes between
+    # the objects the workers share
+    gc.disable()
+
+
+def when_ready(server):
+    """Finish loading the preloaded app in the master, just before the first fork"""
+    if not server.cfg.preload_app:
+        return
+    # pylint: disable=import-outside-toplevel
+    from django.conf import settings
+    from django.db import connections
+    from django.urls import get_resolver
+    from django.utils import translation
+
+    get_resolver().url_patterns  # pylint: disable=expression-not-assigned
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+    # A connection opened here would be shared by every worker
+    connections.close_all()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        gc.enable()
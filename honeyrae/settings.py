@@ -13,7 +13,6 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from dotenv import load_dotenv
 from pathlib import Path
 import os
-import django_on_heroku
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -34,6 +33,26 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
+# API-only workers (API_ONLY=True) leave out what only browsers use: the
+# admin, sessions, messages, static files, the browsable API and the
+# middleware behind them. Token-authenticated JSON requests don't go
+# through any of it, and each worker boots faster without it.
+API_ONLY = os.getenv('API_ONLY', 'False') == 'True'
+BROWSER_APPS = (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)
+BROWSER_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+)
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -46,15 +65,159 @@ INSTALLED_APPS = [
     'corsheaders',
     'repairsapi',
 ]
+if API_ONLY:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in BROWSER_APPS]
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'repairsapi.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
+if API_ONLY:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = ['rest_framework.renderers.JSONRenderer']
+
+# Token -> principal cache used by CachedTokenAuthentication. Other
+# workers only see a deleted token or a changed user once their own copy
+# expires, so TTL stays at a few seconds. SHARED_CACHE names an entry in
+# CACHES that workers share, where invalidation reaches every worker, so
+# its copies can live SHARED_TTL seconds; leave it unset to keep the
+# cache in-process only.
+TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': int(os.getenv('TOKEN_AUTH_CACHE_SIZE', '10000')),
+    'TTL': int(os.getenv('TOKEN_AUTH_CACHE_TTL', '5')),
+    'SHARED_CACHE': os.getenv('TOKEN_AUTH_SHARED_CACHE') or None,
+    'SHARED_TTL': int(os.getenv('TOKEN_AUTH_SHARED_CACHE_TTL', '300')),
+}
+
+# Cache backends. `responses` holds serialized ticket lists; point
+# RESPONSE_CACHE_BACKEND/LOCATION at a shared backend (e.g. Redis or
+# Memcached) to share entries between workers.
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': RESPONSE_CACHE_BACKEND,
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))},
+    },
+}
+
+# Ticket list response cache. Entries are dropped by write signals, so
+# TIMEOUT only bounds how long an unused entry takes up space. Those
+# signals only reach the cache of the process that wrote, so the cache
+# is off by default unless `responses` is shared by every process;
+# RESPONSE_CACHE=True turns it on anyway, e.g. for a single process.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+RESPONSE_CACHE = {
+    'ENABLED': os.getenv('RESPONSE_CACHE', str(RESPONSE_CACHE_BACKEND not in PROCESS_LOCAL_CACHES)) == 'True',
+    'ALIAS': 'responses',
+    'TIMEOUT': int(os.getenv('RESPONSE_CACHE_TIMEOUT', '600')),
+}
+
+# Serve GET requests for tickets, customers and employees from the async
+# ViewSets. Only useful under an ASGI server; see README.md.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+# Per-route request histograms served at /metrics (staff tokens only).
+# Requests slower than SLOW_REQUEST_SECONDS are logged with their SQL;
+# leave it unset to turn the log off.
+REQUEST_METRICS = {
+    'ENABLED': os.getenv('REQUEST_METRICS', 'True') == 'True',
+    'SLOW_REQUEST_SECONDS': float(os.getenv('SLOW_REQUEST_SECONDS', '0')) or None,
+}
+
+# Ticket change feed at /tickets/events, off unless EVENT_FEED=True. It
+# is meant for ASGI workers with ASYNC_VIEWS on, where an open stream
+# doesn't hold a thread; a WSGI request thread is tied up for the whole
+# stream, so streams it serves close after SYNC_MAX_STREAM_SECONDS,
+# below the gunicorn worker timeout (WEB_TIMEOUT in
+# honeyrae/gunicorn_wsgi.py) that a plain sync worker would hit.
+# OutboxBroker keeps RETENTION_SECONDS of events in the database for
+# every process that writes tickets, polled every POLL_INTERVAL seconds
+# and, except on SQLite, read SETTLE_SECONDS behind so out-of-order
+# commits aren't skipped. MemoryBroker (repairsapi.events.MemoryBroker)
+# keeps the last BUFFER events in the worker's memory, so it only suits
+# a single process; it refuses to start when WORKERS (WEB_CONCURRENCY)
+# is above 1. Streams send a keep-alive comment after HEARTBEAT_SECONDS
+# of quiet and close after MAX_STREAM_SECONDS.
+EVENT_FEED = {
+    'ENABLED': os.getenv('EVENT_FEED', 'False') == 'True',
+    'BROKER': os.getenv('EVENT_BROKER', 'repairsapi.events.OutboxBroker'),
+    'WORKERS': int(os.getenv('WEB_CONCURRENCY', '1')),
+    'BUFFER': int(os.getenv('EVENT_BUFFER', '10000')),
+    'RETENTION_SECONDS': int(os.getenv('EVENT_RETENTION_SECONDS', str(24 * 60 * 60))),
+    'POLL_INTERVAL': float(os.getenv('EVENT_POLL_INTERVAL', '1')),
+    'SETTLE_SECONDS': float(os.getenv('EVENT_SETTLE_SECONDS', '1')),
+    'HEARTBEAT_SECONDS': float(os.getenv('EVENT_HEARTBEAT_SECONDS', '15')),
+    'MAX_STREAM_SECONDS': float(os.getenv('EVENT_MAX_STREAM_SECONDS', '300')),
+    'SYNC_MAX_STREAM_SECONDS': float(os.getenv('EVENT_SYNC_MAX_STREAM_SECONDS', '20')),
+}
+
+# Background jobs (repairsapi.jobs), run by `manage.py run_jobs`. A
+# worker claims BATCH_SIZE jobs at a time for LEASE_SECONDS and polls
+# every POLL_INTERVAL seconds when the queue is empty. Failed jobs are
+# retried after BACKOFF_SECONDS, doubling up to MAX_BACKOFF_SECONDS,
+# until MAX_ATTEMPTS. Writes only queue jobs with JOBS=True; turn it on
+# together with scaling the Procfile's `worker` process (Heroku starts
+# it at 0 dynos), or the jobs table grows without anyone draining it.
+JOBS = {
+    'ENABLED': os.getenv('JOBS', 'False') == 'True',
+    'BATCH_SIZE': int(os.getenv('JOBS_BATCH_SIZE', '50')),
+    'LEASE_SECONDS': int(os.getenv('JOBS_LEASE_SECONDS', '300')),
+    'POLL_INTERVAL': float(os.getenv('JOBS_POLL_INTERVAL', '1')),
+    'MAX_ATTEMPTS': int(os.getenv('JOBS_MAX_ATTEMPTS', '8')),
+    'BACKOFF_SECONDS': float(os.getenv('JOBS_BACKOFF_SECONDS', '5')),
+    'MAX_BACKOFF_SECONDS': float(os.getenv('JOBS_MAX_BACKOFF_SECONDS', '3600')),
+}
+
+# Customer emails are sent by the job worker; without an SMTP setup
+# they are printed to its console
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'Honey Rae Repairs <no-reply@honeyrae.local>')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'repairsapi': {
+            'handlers': ['console'],
+            'level': os.getenv('REPAIRSAPI_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+# Rows fetched per database round trip by ?stream=ndjson list exports,
+# and rows per compressed chunk of /tickets/export
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '2000'))
+
+# Records validated and written per transaction by bulk imports
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+
+# Serve /tickets/stats from the materialized counter table. Run
+# `manage.py ticket_counters rebuild` after turning this on for an
+# existing database.
+TICKET_COUNTERS = os.getenv('TICKET_COUNTERS', 'False') == 'True'
+
+# Serve /employees/workload from the per-employee workload table. As
+# with TICKET_COUNTERS, run `manage.py ticket_counters rebuild` if it
+# was ever off while tickets changed.
+WORKLOAD_COUNTERS = os.getenv('WORKLOAD_COUNTERS', 'True') == 'True'
+
+# Serve /tickets/reports from the daily rollup table, which its
+# migration fills from the existing tickets. Run
+# `manage.py ticket_rollups --all` after it was off while tickets changed.
+TICKET_ROLLUPS = os.getenv('TICKET_ROLLUPS', 'True') == 'True'
 
 CORS_ORIGIN_WHITELIST = (
     'http://localhost:3000',
@@ -87,6 +250,7 @@ CORS_ALLOW_HEADERS = [
 ]
 
 MIDDLEWARE = [
+    'repairsapi.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -96,6 +260,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+if API_ONLY:
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in BROWSER_MIDDLEWARE]
 
 ROOT_URLCONF = 'honeyrae.urls'
 
@@ -136,10 +302,74 @@ else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', '600')),
+            'OPTIONS': {
+                # Take the write lock when a transaction starts. A deferred
+                # transaction that reads and then writes fails straight
+                # away with "database is locked" when another connection
+                # holds the lock, without waiting out the busy timeout.
+                'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+            },
         }
     }
 
+# PRAGMAs run on every new SQLite connection (repairsapi.db_tuning). WAL
+# lets readers run alongside the writer, and with WAL synchronous=NORMAL
+# only syncs at checkpoints. Set a variable to an empty string to leave
+# SQLite's default.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL') or None,
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL') or None,
+    'busy_timeout': os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000') or None,
+    'mmap_size': os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)) or None,
+}
+
+# PostgreSQL connection pool (psycopg 3, Django 5.1+). Each worker process
+# keeps between MIN_SIZE and MAX_SIZE open connections and waits up to
+# TIMEOUT seconds for a free one.
+DATABASE_POOL = {
+    'ENABLED': os.getenv('DATABASE_POOL', 'False') == 'True',
+    'MIN_SIZE': int(os.getenv('DATABASE_POOL_MIN_SIZE', '2')),
+    'MAX_SIZE': int(os.getenv('DATABASE_POOL_MAX_SIZE', '10')),
+    'TIMEOUT': float(os.getenv('DATABASE_POOL_TIMEOUT', '10')),
+}
+
+
+
+# Password hashing. PASSWORD_HASH_ITERATIONS sets the PBKDF2 cost for
+# this deployment (unset keeps Django's default); existing hashes are
+# re-encoded at the new cost on their next login.
+PASSWORD_HASHERS = [
+    'repairsapi.hashing.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '0')) or None
+
+# Login and registration hash passwords in a bounded pool. The
+# Procfile's gunicorn workers each serve WEB_THREADS requests at once
+# (honeyrae/gunicorn_wsgi.py), and by default at most half of those
+# hash at a time (WORKERS + QUEUE), so a login burst leaves the rest
+# serving tickets. Requests beyond that wait up to TIMEOUT seconds for a
+# slot and then get a 503.
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))
+AUTH_HASHING = {
+    'WORKERS': int(os.getenv('AUTH_HASHING_WORKERS', '0')) or max(1, WEB_THREADS // 4),
+    'QUEUE': int(os.getenv('AUTH_HASHING_QUEUE', str(WEB_THREADS // 4))),
+    'TIMEOUT': float(os.getenv('AUTH_HASHING_TIMEOUT', '2')),
+}
+
+# Password logins (POST /login and the admin) check the password in that
+# pool; the backend is a ModelBackend otherwise
+AUTHENTICATION_BACKENDS = ['repairsapi.hashing.HashingPoolBackend']
+
+# Send user_logged_in on POST /login, which records last_login with an
+# UPDATE on auth_user per login. Off by default, as those writes queue
+# for the database's write lock during a login burst.
+LOGIN_SIGNAL = os.getenv('LOGIN_SIGNAL', 'False') == 'True'
 
 
 # Password validation
@@ -187,4 +417,29 @@ STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-django_on_heroku.settings(locals())
\ No newline at end of file
+if API_ONLY:
+    # What django_on_heroku sets that API workers need, without importing
+    # it (it pulls in django.test) or adding its static files middleware.
+    # LOGGING stays as configured above.
+    ALLOWED_HOSTS = ['*']
+    if os.getenv('DATABASE_URL'):
+        DATABASES['default'] = dj_database_url.config(
+            conn_max_age=int(os.getenv('CONN_MAX_AGE', '600')), ssl_require=True)
+else:
+    import django_on_heroku
+    django_on_heroku.settings(locals())
+
+# django_on_heroku rebuilds DATABASES from DATABASE_URL, so the pool is
+# added after it. Pooled connections replace persistent ones.
+if DATABASE_POOL['ENABLED'] and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': DATABASE_POOL['MIN_SIZE'],
+        'max_size': DATABASE_POOL['MAX_SIZE'],
+        'timeout': DATABASE_POOL['TIMEOUT'],
+    }
+
+# Async views run queries from a thread pool, so don't keep connections
+# open between requests (django_on_heroku sets a max age above)
+if ASYNC_VIEWS:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
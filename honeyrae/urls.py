@@ -14,20 +14,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
+from django.conf import settings
 from django.conf.urls import include
 from django.urls import path
-from repairsapi.views import register_user, login_user
+from repairsapi.views import import_records, register_user, login_user, request_metrics
 from rest_framework import routers
-from repairsapi.views import CustomerView, EmployeeView, TicketView
+from repairsapi.views import CustomerView, EmployeeView, TicketView, async_urls
 
 router = routers.DefaultRouter(trailing_slash=False)
 router.register(r'customers', CustomerView, 'customer')
 router.register(r'employees', EmployeeView, 'employee')
 router.register(r'tickets', TicketView, 'ticket')
+
+# Under an ASGI server, ASYNC_VIEWS answers reads from the async ViewSets
+api_urls = async_urls(router.urls) if settings.ASYNC_VIEWS else router.urls
+
+# API-only workers (settings.API_ONLY) don't install or import the admin
+admin_urls = []
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+    admin_urls.append(path('admin/', admin.site.urls))
+
 urlpatterns = [
-    path('register', register_user),
-    path('login', login_user),
-    path('admin/', admin.site.urls),
-    path('', include(router.urls)),
+    path('register', register_user, name='register'),
+    path('login', login_user, name='login'),
+    path('metrics', request_metrics, name='metrics'),
+    path('import/<str:kind>', import_records, name='import'),
+    *admin_urls,
+    path('', include(api_urls)),
 ]
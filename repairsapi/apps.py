@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class RepairsapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'repairsapi'
+
+    def ready(self):
+        # Connect the signal receivers that maintain derived ticket data,
+        # and the connection hooks before any connection is opened
+        from repairsapi import db_tuning, metrics, signals  # pylint: disable=import-outside-toplevel,unused-import
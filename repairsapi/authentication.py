@@ -0,0 +1,286 @@
+"""Token authentication backed by an in-process principal cache"""
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+
+# What a token resolves to; small enough to cache for every active session
+PrincipalData = namedtuple('PrincipalData', [
+    'user_id', 'username', 'is_staff', 'customer_id', 'employee_id'])
+
+
+class Principal:
+    """request.auth for token-authenticated requests
+
+    Carries the ids views need (customer_id, employee_id) so they don't
+    have to look them up again, plus an unsaved User built from the
+    cached fields for code that reads request.auth.user. That User only
+    has id, username and is_staff set and is_active True: is_superuser
+    is always False, and names, email, password and last_login are
+    empty. Code that needs any of those must load the User.
+    """
+    __slots__ = ('key', 'user', 'customer_id', 'employee_id')
+
+    def __init__(self, key, data):
+        self.key = key
+        self.user = User(id=data.user_id, username=data.username,
+                         is_staff=data.is_staff, is_active=True)
+        self.customer_id = data.customer_id
+        self.employee_id = data.employee_id
+
+    @property
+    def is_staff(self):
+        return self.user.is_staff
+
+
+class PrincipalCache:
+    """Bounded LRU of token key -> PrincipalData with a time to live
+
+    Invalidation only reaches this process's entries and the shared
+    cache, so a local entry lives at most `ttl` seconds, a few by
+    default: that is how long another worker can go on accepting a
+    deleted token or a revoked is_staff. Entries are optionally mirrored
+    to a shared Django cache for `shared_ttl` seconds, so workers can
+    refill their local entries without the database.
+
+    A principal loaded after a miss is only stored if nothing was
+    invalidated while it was being loaded. Shared entries carry the
+    token's generation, a random value that invalidation replaces, so
+    an entry loaded before an invalidation is never read back, even if
+    it is written after it.
+    """
+
+    def __init__(self, max_entries, ttl, shared_cache=None, shared_ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = caches[shared_cache] if shared_cache else None
+        self.shared_ttl = shared_ttl or ttl
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+        self.lock = threading.Lock()
+        # Bumped by every invalidation in this process
+        self.invalidations = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.TOKEN_AUTH_CACHE
+        return cls(options['MAX_ENTRIES'], options['TTL'], options.get('SHARED_CACHE'),
+                   options.get('SHARED_TTL'))
+
+    @staticmethod
+    def shared_key(key):
+        return f'token-principal:{key}'
+
+    @staticmethod
+    def generation_key(key):
+        return f'token-generation:{key}'
+
+    def get(self, key):
+        return self.lookup(key)[0]
+
+    def lookup(self, key):
+        """Cached data for a token key, and the stamp to set() what a miss loads
+
+        Returns:
+            tuple -- (PrincipalData or None, stamp)
+        """
+        now = time.monotonic()
+        with self.lock:
+            invalidations = self.invalidations
+            entry = self.entries.get(key)
+            if entry is not None:
+                data, expires = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    return data, None
+                self._discard(key)
+
+        if self.shared is None:
+            return None, (invalidations, None)
+        stored = self.shared.get_many([self.shared_key(key), self.generation_key(key)])
+        generation = self.generation(key, stored.get(self.generation_key(key)))
+        entry = stored.get(self.shared_key(key))
+        if entry is not None and entry[0] == generation:
+            data = PrincipalData(*entry[1])
+            self._store(key, data, invalidations)
+            return data, None
+        return None, (invalidations, generation)
+
+    def generation(self, key, stored=None):
+        """The token's current generation in the shared cache, creating one if it has none"""
+        if stored is not None:
+            return stored
+        generation = uuid.uuid4().hex
+        if not self.shared.add(self.generation_key(key), generation, self.shared_ttl):
+            generation = self.shared.get(self.generation_key(key), generation)
+        return generation
+
+    def set(self, key, data, stamp=None):
+        """Cache data loaded after lookup() returned stamp; without one it is taken to be current"""
+        if stamp is None:
+            stamp = (self.invalidations, self.generation(key) if self.shared is not None else None)
+        invalidations, generation = stamp
+        self._store(key, data, invalidations)
+        if generation is not None:
+            self.shared.set(self.shared_key(key), (generation, tuple(data)), self.shared_ttl)
+
+    def _store(self, key, data, invalidations):
+        with self.lock:
+            if invalidations != self.invalidations:
+                return
+            self._discard(key)
+            self.entries[key] = (data, time.monotonic() + self.ttl)
+            self.keys_by_user.setdefault(data.user_id, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._discard(next(iter(self.entries)))
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.keys_by_user.get(entry[0].user_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_user[entry[0].user_id]
+
+    def invalidate(self, *keys):
+        """Drop cached principals for the given token keys, now and once the transaction commits
+
+        The second pass covers principals loaded from the old rows while
+        the write was uncommitted.
+        """
+        self._invalidate(keys)
+        transaction.on_commit(lambda: self._invalidate(keys))
+
+    def _invalidate(self, keys):
+        with self.lock:
+            self.invalidations += 1
+            for key in keys:
+                self._discard(key)
+        if self.shared is not None:
+            self.shared.set_many({self.generation_key(key): uuid.uuid4().hex for key in keys}, self.shared_ttl)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached principal belonging to a user"""
+        with self.lock:
+            keys = set(self.keys_by_user.get(user_id, ()))
+        if self.shared is not None:
+            keys.update(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+        if keys:
+            self.invalidate(*keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_user.clear()
+
+
+_principal_cache = None
+
+
+def principal_cache():
+    """The process-wide PrincipalCache, built from settings on first use"""
+    global _principal_cache  # pylint: disable=global-statement
+    if _principal_cache is None:
+        _principal_cache = PrincipalCache.from_settings()
+    return _principal_cache
+
+
+@receiver(setting_changed)
+def reset_principal_cache(setting, **kwargs):
+    global _principal_cache  # pylint: disable=global-statement
+    if setting in ('TOKEN_AUTH_CACHE', 'CACHES'):
+        _principal_cache = None
+
+
+def token_query():
+    return Token.objects.select_related('user__customer', 'user__employee')
+
+
+def load_principal(key):
+    """Resolve a token key to PrincipalData with a single joined query"""
+    try:
+        token = token_query().get(key=key)
+    except Token.DoesNotExist as ex:
+        raise AuthenticationFailed(_('Invalid token.')) from ex
+    return principal_data(token)
+
+
+async def aload_principal(key):
+    """load_principal() on the async ORM"""
+    try:
+        token = await token_query().aget(key=key)
+    except Token.DoesNotExist as ex:
+        raise AuthenticationFailed(_('Invalid token.')) from ex
+    return principal_data(token)
+
+
+def principal_data(token):
+    user = token.user
+    if not user.is_active:
+        raise AuthenticationFailed(_('User inactive or deleted.'))
+
+    customer = getattr(user, 'customer', None)
+    employee = getattr(user, 'employee', None)
+    return PrincipalData(
+        user_id=user.id,
+        username=user.username,
+        is_staff=user.is_staff,
+        customer_id=customer.id if customer else None,
+        employee_id=employee.id if employee else None,
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that skips the database for recently seen tokens
+
+    request.user is an unsaved User carrying only the id, username and
+    is_staff flag (is_superuser is always False; see Principal), and
+    request.auth is a Principal.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = principal_cache()
+        data, stamp = cache.lookup(key)
+        if data is None:
+            data = load_principal(key)
+            cache.set(key, data, stamp)
+        principal = Principal(key, data)
+        return principal.user, principal
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views, loading unknown tokens with the async ORM"""
+        key = self.token_key(request)
+        if key is None:
+            return None
+        cache = principal_cache()
+        data, stamp = cache.lookup(key)
+        if data is None:
+            data = await aload_principal(key)
+            cache.set(key, data, stamp)
+        principal = Principal(key, data)
+        return principal.user, principal
+
+    def token_key(self, request):
+        """The key from an `Authorization: Token <key>` header, or None"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            return auth[1].decode()
+        except UnicodeError as ex:
+            raise AuthenticationFailed(
+                _('Invalid token header. Token string should not contain invalid characters.')) from ex
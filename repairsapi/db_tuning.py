@@ -0,0 +1,23 @@
+"""Per-connection database tuning"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def sqlite_pragmas():
+    """PRAGMA statements from settings.SQLITE_PRAGMAS, skipping unset ones"""
+    return [f'PRAGMA {name} = {value}' for name, value in settings.SQLITE_PRAGMAS.items()
+            if value is not None]
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to each new SQLite connection
+
+    The statements go straight to the sqlite3 connection, so they don't
+    show up in query logs or request metrics.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    for statement in sqlite_pragmas():
+        connection.connection.execute(statement).close()
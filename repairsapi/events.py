@@ -0,0 +1,341 @@
+"""Ticket change events for the server-push feed at /tickets/events
+
+Every tickets_changed batch becomes created, updated, assigned,
+completed and deleted events handed to the broker named in
+settings.EVENT_FEED. OutboxBroker stores them in the TicketEvent table
+inside the writing transaction, so clients connected to any worker see
+events written by every process. MemoryBroker keeps recent events in the
+worker's memory, which only works when one process writes tickets and
+serves the feed.
+
+Clients receive Server-Sent Events and resume after a reconnect with
+the Last-Event-ID header. When a broker can't resume from an id (it was
+pruned, or came from before a restart) the stream opens with a
+`resync` event, telling the client to refetch its lists.
+"""
+import asyncio
+import json
+import secrets
+import threading
+import time
+from collections import deque, namedtuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models import Max, Min
+from django.http import StreamingHttpResponse
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from repairsapi.models import TicketEvent
+
+EVENT_KINDS = ('created', 'updated', 'assigned', 'completed', 'deleted')
+# Reconnection delay suggested to EventSource clients
+RETRY_MILLISECONDS = 3000
+# Most events read from the broker per round trip
+READ_LIMIT = 500
+
+# `position` orders events within a broker; `id` is what clients resume from
+Event = namedtuple('Event', ['position', 'id', 'kind', 'customer_id', 'data'])
+
+
+def event_kind(before, after):
+    if before is None:
+        return 'created'
+    if after is None:
+        return 'deleted'
+    if after.date_completed and not before.date_completed:
+        return 'completed'
+    if after.employee_id and after.employee_id != before.employee_id:
+        return 'assigned'
+    return 'updated'
+
+
+def ticket_events(changes):
+    """(kind, customer id, data) for each (before, after) TicketState change"""
+    events = []
+    for before, after in changes:
+        state = after or before
+        events.append((event_kind(before, after), state.customer_id, {
+            'ticket': state.id,
+            'customer': state.customer_id,
+            'employee': state.employee_id,
+            'status': state.status,
+            'priority': state.priority,
+            'emergency': state.emergency,
+            'date_completed': state.date_completed.isoformat() if state.date_completed else None,
+        }))
+    return events
+
+
+class MemoryBroker:
+    """The most recent events of this worker process, in a ring buffer
+
+    Events are added when the writing transaction commits. Ids are
+    `<boot>-<n>`, so a client resuming with an id from before a restart
+    is told to resync instead of silently missing events.
+    """
+
+    def __init__(self, buffer):
+        self.events = deque(maxlen=buffer)
+        self.boot = secrets.token_hex(4)
+        self.last = 0
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_settings(cls, options):
+        if options['WORKERS'] > 1:
+            raise ImproperlyConfigured(
+                'MemoryBroker only sees events of its own worker; '
+                'use repairsapi.events.OutboxBroker with more than one')
+        return cls(options['BUFFER'])
+
+    def publish(self, events):
+        if events:
+            transaction.on_commit(lambda: self.append(events))
+
+    def append(self, events):
+        with self.condition:
+            for kind, customer_id, data in events:
+                self.last += 1
+                self.events.append(Event(self.last, f'{self.boot}-{self.last}', kind, customer_id, data))
+            self.condition.notify_all()
+
+    def current(self):
+        return self.last
+
+    def position(self, event_id):
+        """Position just after event_id, or None if it can't be resumed from"""
+        boot, _, number = event_id.partition('-')
+        if boot != self.boot or not number.isdigit():
+            return None
+        with self.condition:
+            oldest = self.last - len(self.events)
+            number = int(number)
+            return number if oldest <= number <= self.last else None
+
+    def event_id(self, position):
+        return f'{self.boot}-{position}'
+
+    def read(self, position, customer_id=None):
+        """Events after `position` a caller may see, and the position read up to
+
+        Arguments:
+            customer_id -- Only this customer's events; None for staff
+        """
+        with self.condition:
+            skip = len(self.events) - (self.last - position)
+            events = [self.events[index] for index in range(max(skip, 0), len(self.events))][:READ_LIMIT]
+        if not events:
+            return [], position
+        return [event for event in events if customer_id is None or event.customer_id == customer_id], \
+            events[-1].position
+
+    def wait(self, position, timeout):
+        """Block until an event after `position` is published or timeout passes"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.last > position, timeout)
+
+
+class OutboxBroker:
+    """Events in the TicketEvent table, shared by every worker
+
+    Events are inserted in the transaction that made the change, so they
+    exist exactly when it commits. Readers poll the table. On databases
+    that commit concurrent writers out of id order, events younger than
+    SETTLE_SECONDS aren't read yet, so a reader never moves its cursor
+    past an id that is still uncommitted. SQLite commits one writer at a
+    time and doesn't wait.
+    """
+
+    def __init__(self, retention, poll_interval, settle, prune_every=1000):
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.prune_every = prune_every
+        self.published = 0
+
+    @classmethod
+    def from_settings(cls, options):
+        return cls(options['RETENTION_SECONDS'], options['POLL_INTERVAL'], options['SETTLE_SECONDS'])
+
+    def publish(self, events):
+        TicketEvent.objects.bulk_create([
+            TicketEvent(kind=kind, ticket_id=data['ticket'], customer_id=customer_id, data=data)
+            for kind, customer_id, data in events])
+        self.published += len(events)
+        if self.published >= self.prune_every:
+            self.published = 0
+            self.prune()
+
+    def prune(self):
+        """Delete events older than the retention period"""
+        cutoff = timezone.now() - timezone.timedelta(seconds=self.retention)
+        return TicketEvent.objects.filter(created_at__lt=cutoff).delete()[0]
+
+    def current(self):
+        return TicketEvent.objects.aggregate(last=Max('id'))['last'] or 0
+
+    def position(self, event_id):
+        if not event_id.isdigit():
+            return None
+        number = int(event_id)
+        bounds = TicketEvent.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['last'] is None:
+            return None if number else 0
+        return number if bounds['first'] - 1 <= number <= bounds['last'] else None
+
+    def event_id(self, position):
+        return str(position)
+
+    def read(self, position, customer_id=None):
+        events = TicketEvent.objects.filter(id__gt=position).order_by('id')
+        if customer_id is not None:
+            events = events.filter(customer_id=customer_id)
+        if self.settle and connections[events.db].vendor != 'sqlite':
+            events = events.filter(created_at__lte=timezone.now() - timezone.timedelta(seconds=self.settle))
+        rows = list(events.values_list('id', 'kind', 'customer_id', 'data')[:READ_LIMIT])
+        if not rows:
+            return [], position
+        return [Event(row[0], str(row[0]), *row[1:]) for row in rows], rows[-1][0]
+
+    def wait(self, position, timeout):
+        time.sleep(min(self.poll_interval, timeout))
+
+
+_event_broker = None
+_broker_lock = threading.Lock()
+
+
+def event_broker():
+    """The process-wide broker from settings.EVENT_FEED, or None when the feed is off"""
+    global _event_broker  # pylint: disable=global-statement
+    options = settings.EVENT_FEED
+    if not options['ENABLED']:
+        return None
+    if _event_broker is None:
+        with _broker_lock:
+            if _event_broker is None:
+                _event_broker = import_string(options['BROKER']).from_settings(options)
+    return _event_broker
+
+
+@receiver(setting_changed)
+def reset_event_broker(setting, **kwargs):
+    global _event_broker  # pylint: disable=global-statement
+    if setting == 'EVENT_FEED':
+        _event_broker = None
+
+
+def format_event(event):
+    data = json.dumps({'id': event.id, 'type': event.kind, **event.data}, cls=JSONEncoder,
+                      separators=(',', ':'))
+    return f'id: {event.id}\nevent: ticket.{event.kind}\ndata: {data}\n\n'
+
+
+class EventFeed:
+    """One client's subscription: where it resumes and what it may see
+
+    Arguments:
+        broker -- The event broker
+        last_event_id -- The client's Last-Event-ID, or None to start now
+        customer_id -- Only this customer's events; None for staff
+        seconds -- How long to stream before closing; clients reconnect
+    """
+
+    def __init__(self, broker, last_event_id, customer_id, seconds):
+        self.broker = broker
+        self.customer_id = customer_id
+        self.seconds = seconds
+        self.heartbeat = settings.EVENT_FEED['HEARTBEAT_SECONDS']
+        self.poll_interval = settings.EVENT_FEED['POLL_INTERVAL']
+        self.position = broker.position(last_event_id) if last_event_id else broker.current()
+        self.resync = self.position is None
+        if self.resync:
+            self.position = broker.current()
+
+    def opening(self):
+        """retry, a resync event if needed, and the id to resume from
+
+        The id-only message sets the client's last event id without
+        dispatching anything, so a reconnect resumes from here even if
+        no event arrives first.
+        """
+        text = f'retry: {RETRY_MILLISECONDS}\n\n'
+        if self.resync:
+            text += 'event: resync\ndata: {}\n\n'
+        return text + f'id: {self.broker.event_id(self.position)}\n\n'
+
+    def take(self):
+        events, self.position = self.broker.read(self.position, self.customer_id)
+        return ''.join(map(format_event, events))
+
+    def stream(self):
+        """Server-Sent Events text for a WSGI StreamingHttpResponse"""
+        yield self.opening()
+        deadline = time.monotonic() + self.seconds
+        quiet_since = time.monotonic()
+        while True:
+            text = self.take()
+            if text:
+                quiet_since = time.monotonic()
+                yield text
+                continue
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if now - quiet_since >= self.heartbeat:
+                quiet_since = now
+                yield ': keep-alive\n\n'
+            self.broker.wait(self.position, min(deadline - now, self.heartbeat))
+
+    async def astream(self):
+        """stream() for ASGI servers; waits on the event loop between reads"""
+        yield self.opening()
+        take = sync_to_async(self.take)
+        deadline = time.monotonic() + self.seconds
+        quiet_since = time.monotonic()
+        while True:
+            text = await take()
+            if text:
+                quiet_since = time.monotonic()
+                yield text
+                continue
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if now - quiet_since >= self.heartbeat:
+                quiet_since = now
+                yield ': keep-alive\n\n'
+            await asyncio.sleep(min(deadline - now, self.poll_interval))
+
+
+def event_stream_response(stream):
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def stream_seconds(request, limit):
+    """Stream duration: `timeout` from the query, at most `limit`"""
+    try:
+        return max(0.0, min(float(request.query_params.get('timeout', limit)), limit))
+    except ValueError:
+        return limit
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF negotiate text/event-stream; only error bodies go through it"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        body = json.dumps(data, cls=JSONEncoder, separators=(',', ':'))
+        return f'event: error\ndata: {body}\n\n'.encode()
@@ -0,0 +1,148 @@
+"""Ticket exports: gzip-compressed CSV or columnar chunks in primary key order
+
+An export reads tickets with their customer and employee names through
+one chunked iterator (a server-side cursor on PostgreSQL), so memory
+stays bounded by the chunk size. Rows come in id order and every chunk
+is flushed as a complete gzip block, so a cut-off download still
+decompresses to whole rows and `after=<last id>` picks up from there.
+Under ASGI, achunks() reads the same chunks one at a time in a thread,
+as Django would otherwise collect a sync iterator into a list first.
+The resumed part is a separate gzip member without the header, which
+can be appended to the first: concatenated members are one gzip file.
+
+The columnar format is gzipped JSON lines: a header naming the
+columns, then one object per chunk holding a list per column. Names,
+priorities and statuses repeat a lot, so those lists are dictionary
+encoded as {"dictionary": [...], "indexes": [...]}.
+"""
+import csv
+import io
+import json
+import logging
+import time
+import zlib
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from repairsapi.models import Ticket
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ('id', 'customer_id', 'customer_name', 'employee_id', 'employee_name', 'description',
+                  'priority', 'emergency', 'status', 'date_created', 'date_completed')
+DICTIONARY_COLUMNS = frozenset(['customer_name', 'employee_name', 'priority', 'status'])
+COLUMNAR_FORMAT = 'honeyrae-columns'
+# format -> file extension
+EXPORT_FORMATS = {'csv': 'csv.gz', 'columnar': 'jsonl.gz'}
+GZIP_LEVEL = 6
+
+
+def export_queryset(after=0):
+    return Ticket.objects.filter(pk__gt=after).order_by('pk').values_list(
+        'id', 'customer_id', 'customer__user__first_name', 'customer__user__last_name', 'employee_id',
+        'employee__user__first_name', 'employee__user__last_name', 'description', 'priority', 'emergency',
+        'status', 'date_created', 'date_completed')
+
+
+def export_row(row):
+    """An EXPORT_COLUMNS tuple from an export_queryset() row"""
+    (pk, customer_id, customer_first, customer_last, employee_id, employee_first, employee_last,
+     description, priority, emergency, status, date_created, date_completed) = row
+    return (pk, customer_id, f'{customer_first} {customer_last}', employee_id,
+            f'{employee_first} {employee_last}' if employee_id else None, description, priority,
+            emergency, status, date_created.isoformat(), date_completed.isoformat() if date_completed else None)
+
+
+def csv_chunk(rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def dictionary_encode(values):
+    dictionary = {}
+    indexes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+    return {'dictionary': list(dictionary), 'indexes': indexes}
+
+
+def columnar_chunk(rows, header):
+    lines = []
+    if header:
+        lines.append(json.dumps({'format': COLUMNAR_FORMAT, 'version': 1, 'columns': EXPORT_COLUMNS}))
+    if rows:
+        columns = [dictionary_encode(values) if name in DICTIONARY_COLUMNS else list(values)
+                   for name, values in zip(EXPORT_COLUMNS, zip(*rows))]
+        lines.append(json.dumps({'rows': len(rows), 'last_id': rows[-1][0], 'columns': columns},
+                                ensure_ascii=False, separators=(',', ':')))
+    return ''.join(line + '\n' for line in lines)
+
+
+class TicketExport:
+    """One export run: gzip chunks of tickets after an id, with its progress
+
+    `rows` and `last_id` follow the chunks as they are produced, so
+    callers can report them or resume from `last_id`.
+    """
+
+    def __init__(self, export_format='csv', after=0, chunk_size=None):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}'")
+        self.export_format = export_format
+        self.after = after
+        self.chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+        self.rows = 0
+        self.last_id = after
+        self.started = None
+
+    @property
+    def filename(self):
+        return f'tickets-after-{self.after}.{EXPORT_FORMATS[self.export_format]}'
+
+    def rate(self):
+        """Rows per second so far"""
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.rows / elapsed if elapsed else 0.0
+
+    def chunks(self):
+        """Yield the compressed export, one flushed gzip block per chunk of rows"""
+        self.started = time.perf_counter()
+        encode = csv_chunk if self.export_format == 'csv' else columnar_chunk
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        # The header only starts a fresh export, so resumed parts can be appended
+        header = not self.after
+        rows = export_queryset(self.after).iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = [export_row(row) for row in islice(rows, self.chunk_size)]
+            if chunk:
+                self.rows += len(chunk)
+                self.last_id = chunk[-1][0]
+            if chunk or header:
+                yield compressor.compress(encode(chunk, header).encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            header = False
+            if len(chunk) < self.chunk_size:
+                break
+        yield compressor.flush()
+        logger.info('Exported %d tickets as %s after id %d up to id %d (%.0f rows/s)',
+                    self.rows, self.export_format, self.after, self.last_id, self.rate())
+
+    async def achunks(self):
+        """chunks() for ASGI responses, produced one at a time in a thread"""
+        chunks = self.chunks()
+        next_chunk = sync_to_async(next)
+        try:
+            while (chunk := await next_chunk(chunks, None)) is not None:
+                yield chunk
+        finally:
+            await sync_to_async(chunks.close)()
+
+
+def export_response(export, chunks):
+    """StreamingHttpResponse downloading an export's chunks (or achunks) as a file"""
+    response = StreamingHttpResponse(chunks, content_type='application/gzip')
+    response['Content-Disposition'] = f'attachment; filename="{export.filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,204 @@
+"""Read-only JSON encoding straight from .values_list() rows
+
+A FastSerializer is compiled once per serializer class. It reads the
+serializer's fields to find the columns it needs and generates a
+function that turns one row tuple into the JSON text the serializer and
+DRF's JSONRenderer would have produced, without building model
+instances or going through per-field to_representation dispatch.
+"""
+import json
+from functools import lru_cache
+from json.encoder import encode_basestring
+from types import SimpleNamespace
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class FastPathUnsupported(Exception):
+    """The serializer has a field the fast path can't reproduce exactly"""
+
+
+def _dumps(value):
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_value(value):
+    """JSON for a plain value, as DRF's JSONRenderer writes it"""
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, int):
+        return int.__repr__(value)
+    return _dumps(value)
+
+
+def encode_integer(value):
+    return 'null' if value is None else int.__repr__(int(value))
+
+
+def encode_boolean(value):
+    if value is None:
+        return 'null'
+    return 'true' if value else 'false'
+
+
+def encode_string(value):
+    return 'null' if value is None else encode_basestring(str(value))
+
+
+def represented(field):
+    """Encoder that defers to the DRF field, for formats like dates"""
+    to_representation = field.to_representation
+
+    def encode(value):
+        return 'null' if value is None else encode_value(to_representation(value))
+    return encode
+
+
+def _field_encoder(field):
+    if isinstance(field, serializers.BooleanField):
+        return encode_boolean
+    if isinstance(field, (serializers.IntegerField, serializers.PrimaryKeyRelatedField)):
+        return encode_integer
+    if isinstance(field, serializers.ChoiceField):
+        return represented(field)
+    if isinstance(field, serializers.CharField):
+        return encode_string
+    if isinstance(field, (serializers.DateTimeField, serializers.DateField)):
+        return represented(field)
+    if type(field) is serializers.ReadOnlyField:  # pylint: disable=unidiomatic-typecheck
+        return encode_value
+    raise FastPathUnsupported(f'{type(field).__name__} is not supported')
+
+
+def _namespace_builder(tree):
+    """Function building nested namespaces from a row for a property to read"""
+    items = [(name, _namespace_builder(sub) if isinstance(sub, dict) else sub)
+             for name, sub in tree.items()]
+
+    def build(row):
+        return SimpleNamespace(**{name: sub(row) if callable(sub) else row[sub] for name, sub in items})
+    return build
+
+
+class _Compiler:
+    """Turns a serializer's fields into one row-encoding expression"""
+
+    def __init__(self):
+        self.columns = {}
+        self.namespace = {}
+
+    def column(self, path):
+        return self.columns.setdefault(path, len(self.columns))
+
+    def bind(self, value):
+        name = f'_f{len(self.namespace)}'
+        self.namespace[name] = value
+        return name
+
+    def value_expression(self, model, field, prefix):
+        source = field.source
+        try:
+            model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return self.property_expression(model, source, prefix)
+        encoder = self.bind(_field_encoder(field))
+        return f'{encoder}(r[{self.column(prefix + source)}])'
+
+    def property_expression(self, model, source, prefix):
+        prop = getattr(model, source, None)
+        required = getattr(getattr(prop, 'fget', None), 'required_fields', None)
+        if required is None:
+            raise FastPathUnsupported(f'{model.__name__}.{source} does not declare its fields')
+        tree = {}
+        for path in required:
+            *parents, leaf = path.split('__')
+            node = tree
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = self.column(prefix + path)
+        builder = _namespace_builder(tree)
+        fget = prop.fget
+        compute = self.bind(lambda row: encode_value(fget(builder(row))))
+        return f'{compute}(r)'
+
+    def object_expression(self, serializer, prefix=''):
+        model = serializer.Meta.model
+        parts = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            key = encode_basestring(name) + ':'
+            if isinstance(field, serializers.BaseSerializer):
+                if isinstance(field, serializers.ListSerializer) or '.' in field.source:
+                    raise FastPathUnsupported(f'{name} is not a single related object')
+                nested_prefix = f'{prefix}{field.source}__'
+                related = model._meta.get_field(field.source).related_model
+                pk = self.column(f'{nested_prefix}{related._meta.pk.name}')
+                nested = self.object_expression(field, nested_prefix)
+                expression = f"('null' if r[{pk}] is None else {nested})"
+            elif '.' in field.source or field.source == '*':
+                raise FastPathUnsupported(f'{name} has a dotted source')
+            else:
+                expression = self.value_expression(model, field, prefix)
+            parts.append((key, expression))
+
+        if not parts:
+            return "'{}'"
+        pieces = [repr('{' + parts[0][0]), parts[0][1]]
+        for key, expression in parts[1:]:
+            pieces += [repr(',' + key), expression]
+        pieces.append("'}'")
+        return ' + '.join(pieces)
+
+
+class FastSerializer:
+    """Row tuple -> JSON text encoder compiled from a ModelSerializer
+
+    `columns` are the values_list() paths each row must hold, in order;
+    `encode(row)` returns the JSON object for one row.
+    """
+
+    def __init__(self, serializer_class):
+        compiler = _Compiler()
+        expression = compiler.object_expression(serializer_class())
+        source = f'def encode(r):\n    return {expression}\n'
+        exec(compile(source, f'<fast serializer {serializer_class.__name__}>', 'exec'),  # pylint: disable=exec-used
+             compiler.namespace)
+        self.encode = compiler.namespace['encode']
+        self.columns = list(compiler.columns)
+        self.source = source
+
+    def values(self, queryset, extra=()):
+        """values_list() with this serializer's columns, then `extra` paths
+
+        Returns:
+            tuple -- (queryset of rows, {extra path: index in each row})
+        """
+        columns = self.columns + [path for path in extra if path not in self.columns]
+        indexes = {path: columns.index(path) for path in extra}
+        return queryset.values_list(*columns), indexes
+
+    def render_list(self, rows):
+        """A JSON array of rows as DRF's JSONRenderer would send it"""
+        return render_json('[' + ','.join(map(self.encode, rows)) + ']')
+
+
+def render_json(text):
+    # JSONRenderer escapes the two line terminators that JavaScript doesn't allow in strings
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+@lru_cache(maxsize=1024)
+def fast_serializer(serializer_class):
+    """The compiled FastSerializer for a class, or None if it can't have one"""
+    try:
+        return FastSerializer(serializer_class)
+    except FastPathUnsupported:
+        return None
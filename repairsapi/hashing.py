@@ -0,0 +1,140 @@
+"""Password hashing: per-deployment cost and a bounded hashing pool"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import (PBKDF2PasswordHasher, check_password, get_hasher,
+                                         identify_hasher, make_password)
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with the iteration count taken from settings
+
+    Stored hashes keep Django's pbkdf2_sha256 format, so hashes made with
+    another count still verify and are re-encoded on the next login.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
+
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing pool has no room for another request"""
+
+
+class HashingPool:
+    """Bounded thread pool for password hashing with admission control
+
+    hashlib releases the GIL while it runs PBKDF2, so hashes run in
+    parallel with each other and with the request threads. At most
+    `workers + queue` hashes are admitted at once; a request that can't
+    get a slot within `timeout` seconds is turned away instead of
+    holding a thread for a hash that would finish late anyway. This only
+    bounds anything when a process serves several requests at once, as
+    the Procfile's threaded gunicorn workers do (see
+    honeyrae/gunicorn_wsgi.py); a sync worker never has more than one
+    hash waiting.
+    """
+
+    def __init__(self, workers, queue, timeout):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.AUTH_HASHING
+        return cls(options['WORKERS'] or os.cpu_count() or 1, options['QUEUE'], options['TIMEOUT'])
+
+    def run(self, func, *args):
+        """Run func(*args) in the pool and wait for its result"""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HashingOverloaded()
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_hashing_pool = None
+_hashing_pool_lock = threading.Lock()
+
+
+def hashing_pool():
+    """The process-wide HashingPool, built from settings on first use"""
+    global _hashing_pool  # pylint: disable=global-statement
+    with _hashing_pool_lock:
+        if _hashing_pool is None:
+            _hashing_pool = HashingPool.from_settings()
+        return _hashing_pool
+
+
+@receiver(setting_changed)
+def reset_hashing_pool(setting, **kwargs):
+    global _hashing_pool  # pylint: disable=global-statement
+    if setting == 'AUTH_HASHING' and _hashing_pool is not None:
+        _hashing_pool.shutdown()
+        _hashing_pool = None
+
+
+def _verify(password, encoded):
+    if encoded is None:
+        # Hash anyway so unknown usernames take as long as wrong passwords
+        make_password(password)
+        return False, None
+    if not check_password(password, encoded):
+        return False, None
+    hasher = get_hasher()
+    if identify_hasher(encoded).algorithm != hasher.algorithm or hasher.must_update(encoded):
+        return True, make_password(password)
+    return True, None
+
+
+def verify_password(password, encoded):
+    """Check a password against a stored hash in the hashing pool
+
+    No database access happens in the pool; callers save any upgraded
+    hash themselves.
+
+    Returns:
+        tuple -- (password matches, re-encoded hash to store or None)
+    """
+    return hashing_pool().run(_verify, password, encoded)
+
+
+def hash_password(password):
+    """make_password() in the hashing pool"""
+    return hashing_pool().run(make_password, password)
+
+
+class HashingPoolBackend(ModelBackend):
+    """ModelBackend that checks passwords in the hashing pool
+
+    authenticate() with this backend raises HashingOverloaded when the
+    pool is full. The user comes with their token, which login hands
+    back, and a hash made at another cost is re-encoded and saved.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user_model = get_user_model()
+        if username is None:
+            username = kwargs.get(user_model.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = user_model._default_manager.select_related('auth_token').filter(
+            **{user_model.USERNAME_FIELD: username}).first()
+        valid, upgraded = verify_password(password, user.password if user else None)
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if upgraded is not None:
+            user.password = upgraded
+            user.save(update_fields=['password'])
+        return user
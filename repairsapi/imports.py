@@ -0,0 +1,301 @@
+"""Bulk imports of customers, employees and tickets from CSV or NDJSON
+
+Records are read one at a time from a stream of lines and handled in
+batches. Each batch is validated with a few IN queries (taken usernames
+and emails, or the customers and employees tickets refer to), and its
+valid rows are written with bulk_create in one transaction. Invalid
+rows are reported by line number and skipped; the rest of the import
+carries on.
+
+Users get the `password_hash` they come with (any format Django's
+hashers recognize) or an unusable password, so nothing is hashed
+during the import. Tickets refer to customers and employees by
+username and keep their `date_created`.
+"""
+import csv
+import json
+import time
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.authtoken.models import Token
+from repairsapi.models import Customer, Employee, Ticket, historical_ticket_dates
+
+IMPORT_KINDS = ('customers', 'employees', 'tickets')
+IMPORT_FORMATS = ('csv', 'ndjson')
+# Errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+PRIORITIES = {choice for choice, _ in Ticket.PRIORITY_CHOICES}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'n', 'f'}
+
+
+class InvalidRecord(Exception):
+    """A record that can't be imported, with the reason as its message"""
+
+
+def read_records(lines, import_format):
+    """(line number, record dict or InvalidRecord) for each record in text lines"""
+    if import_format == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            if None in record:
+                yield reader.line_num, InvalidRecord('Row has more values than the header has columns')
+            else:
+                yield reader.line_num, record
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, InvalidRecord('Line is not valid JSON')
+            continue
+        yield number, record if isinstance(record, dict) else InvalidRecord('Line is not a JSON object')
+
+
+def text(record, name, required=True, max_length=None):
+    value = record.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise InvalidRecord(f'{name} is required')
+    if max_length is not None and len(value) > max_length:
+        raise InvalidRecord(f'{name} is longer than {max_length} characters')
+    return value
+
+
+def parsed(record, name, parse, expected):
+    """An optional value read with one of Django's dateparse functions"""
+    value = text(record, name, required=False)
+    if not value:
+        return None
+    try:
+        result = parse(value)
+    except ValueError:
+        result = None
+    if result is None:
+        raise InvalidRecord(f'{name} must be {expected}')
+    return result
+
+
+def flag(record, name):
+    value = record.get(name, False)
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value not in TRUE_VALUES | FALSE_VALUES:
+        raise InvalidRecord(f'{name} must be true or false')
+    return value in TRUE_VALUES
+
+
+class UserImporter:
+    """Validates and writes customers or employees with their users"""
+
+    username_validator = UnicodeUsernameValidator()
+
+    def __init__(self, model, profile_field, tokens=False):
+        self.model = model
+        self.profile_field = profile_field
+        self.tokens = tokens
+
+    def clean(self, record):
+        username = User.normalize_username(text(record, 'username', max_length=150))
+        if len(username) < 3:
+            raise InvalidRecord('username must be at least 3 characters')
+        try:
+            self.username_validator(username)
+            email = User.objects.normalize_email(text(record, 'email', max_length=254))
+            validate_email(email)
+        except ValidationError as error:
+            raise InvalidRecord(error.messages[0]) from error
+        password = text(record, 'password_hash', required=False)
+        if password:
+            try:
+                identify_hasher(password)
+            except ValueError as error:
+                raise InvalidRecord('password_hash is not a hash Django recognizes') from error
+        return {
+            'username': username,
+            'email': email,
+            'first_name': text(record, 'first_name', max_length=150),
+            'last_name': text(record, 'last_name', max_length=150),
+            'password': password or make_password(None),
+            self.profile_field: text(record, self.profile_field, max_length=155),
+        }
+
+    def check_batch(self, rows):
+        """Reject usernames and emails that are taken or repeated in the batch"""
+        usernames = {row['username'] for _, row in rows}
+        emails = {row['email'] for _, row in rows}
+        taken = set()
+        for username, email in User.objects.filter(Q(username__in=usernames) | Q(email__in=emails)) \
+                .values_list('username', 'email'):
+            taken.update((('username', username), ('email', email)))
+        for _, row in rows:
+            for name in ('username', 'email'):
+                if (name, row[name]) in taken:
+                    yield row, f'An account with that {name} already exists'
+                    break
+                taken.add((name, row[name]))
+
+    def write(self, rows):
+        profile = self.profile_field
+        User.objects.bulk_create([User(is_staff=self.model is Employee, **{
+            name: value for name, value in row.items() if name != profile}) for row in rows])
+        user_ids = dict(User.objects.filter(username__in=[row['username'] for row in rows])
+                        .values_list('username', 'id'))
+        self.model.objects.bulk_create(
+            [self.model(user_id=user_ids[row['username']], **{profile: row[profile]}) for row in rows])
+        if self.tokens:
+            Token.objects.bulk_create([Token(key=Token.generate_key(), user_id=user_ids[row['username']])
+                                       for row in rows])
+
+
+class TicketImporter:
+    """Validates and writes tickets, keeping their creation dates"""
+
+    def __init__(self):
+        self.customers = {}
+        self.employees = {}
+
+    def clean(self, record):
+        priority = text(record, 'priority', required=False) or Ticket.PRIORITY_MEDIUM
+        if priority not in PRIORITIES:
+            raise InvalidRecord(f'Invalid priority {priority!r}')
+        date_created = parsed(record, 'date_created', parse_datetime, 'an ISO 8601 date and time')
+        if date_created is not None and timezone.is_naive(date_created):
+            date_created = timezone.make_aware(date_created)
+        date_completed = parsed(record, 'date_completed', parse_date, 'YYYY-MM-DD')
+        return {
+            'customer': text(record, 'customer'),
+            'employee': text(record, 'employee', required=False),
+            'description': text(record, 'description', max_length=500),
+            'priority': priority,
+            'emergency': flag(record, 'emergency'),
+            'date_created': date_created,
+            'date_completed': date_completed,
+        }
+
+    def check_batch(self, rows):
+        """Reject tickets whose customer or employee username doesn't exist"""
+        usernames = {row['customer'] for _, row in rows}
+        self.customers = dict(Customer.objects.filter(user__username__in=usernames)
+                              .values_list('user__username', 'id'))
+        usernames = {row['employee'] for _, row in rows if row['employee']}
+        self.employees = dict(Employee.objects.filter(user__username__in=usernames)
+                              .values_list('user__username', 'id')) if usernames else {}
+        for _, row in rows:
+            if row['customer'] not in self.customers:
+                yield row, f"Customer {row['customer']!r} not found"
+            elif row['employee'] and row['employee'] not in self.employees:
+                yield row, f"Employee {row['employee']!r} not found"
+
+    def write(self, rows):
+        now = timezone.now()
+        with historical_ticket_dates():
+            Ticket.objects.bulk_create([Ticket(
+                customer_id=self.customers[row['customer']],
+                employee_id=self.employees.get(row['employee']),
+                description=row['description'],
+                priority=row['priority'],
+                emergency=row['emergency'],
+                date_created=row['date_created'] or now,
+                date_completed=row['date_completed'],
+            ) for row in rows])
+
+
+# kind -> importer factory taking the `tokens` option
+IMPORTERS = {
+    'customers': lambda tokens: UserImporter(Customer, 'address', tokens),
+    'employees': lambda tokens: UserImporter(Employee, 'specialty', tokens),
+    'tickets': lambda tokens: TicketImporter(),
+}
+
+
+class BulkImport:
+    """One import run over a stream of records, with its progress
+
+    `rows`, `created` and `failed` follow the batches as they are
+    committed; `errors` keeps the first MAX_REPORTED_ERRORS failures as
+    {'line': n, 'error': reason}.
+    """
+
+    def __init__(self, kind, batch_size=None, tokens=False):
+        if kind not in IMPORTERS:
+            raise ValueError(f"Unknown import kind '{kind}'")
+        self.kind = kind
+        self.importer = IMPORTERS[kind](tokens)
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.rows = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+        self.started = None
+
+    def rate(self):
+        """Rows per second so far"""
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.rows / elapsed if elapsed else 0.0
+
+    def fail(self, line, error):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': error})
+
+    def batches(self, records):
+        """Import (line number, record) pairs a batch at a time, yielding after each commit"""
+        self.started = time.perf_counter()
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return
+            self.import_batch(batch)
+            self.rows += len(batch)
+            yield self
+
+    def run(self, records):
+        for _ in self.batches(records):
+            pass
+        return self
+
+    def import_batch(self, batch):
+        failures = []
+        rows = []
+        for line, record in batch:
+            try:
+                if isinstance(record, InvalidRecord):
+                    raise record
+                rows.append((line, self.importer.clean(record)))
+            except InvalidRecord as error:
+                failures.append((line, str(error)))
+
+        if rows:
+            rejected = {id(row): error for row, error in self.importer.check_batch(rows)}
+            failures += [(line, rejected[id(row)]) for line, row in rows if id(row) in rejected]
+            rows = [(line, row) for line, row in rows if id(row) not in rejected]
+        if rows:
+            try:
+                with transaction.atomic():
+                    self.importer.write([row for _, row in rows])
+                self.created += len(rows)
+            except IntegrityError:
+                # Another writer took a username in the meantime; nothing of the batch was kept
+                failures += [(line, 'Not imported: the batch conflicted with another write, import it again')
+                             for line, _ in rows]
+        for line, error in sorted(failures):
+            self.fail(line, error)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return {'kind': self.kind, 'rows': self.rows, 'created': self.created, 'failed': self.failed,
+                'seconds': round(elapsed, 3), 'rows_per_second': round(self.rate(), 1), 'errors': self.errors}
@@ -0,0 +1,189 @@
+"""Background jobs: a transactional outbox in the Job table
+
+Request code calls enqueue() inside the transaction of its write, and
+`manage.py run_jobs` claims ready jobs in batches and runs the handler
+registered for each kind with @job. Jobs run at least once: a worker
+that dies mid-batch leaves its lease to expire, and the batch is run
+again, so handlers must tolerate repeats.
+
+On PostgreSQL workers claim with SELECT ... FOR UPDATE SKIP LOCKED, so
+they never wait on one another's rows. SQLite has no row locks; there
+the claim is one UPDATE in an IMMEDIATE transaction, which SQLite runs
+one writer at a time.
+"""
+import logging
+import random
+import secrets
+import time
+import traceback
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from repairsapi.metrics import PREFIX, format_number
+from repairsapi.models import Job
+
+logger = logging.getLogger(__name__)
+
+# kind -> handler of every registered job
+JOBS = {}
+# Characters of a traceback kept in Job.last_error
+MAX_ERROR_LENGTH = 4000
+
+
+def job(kind):
+    """Register the decorated function as the handler for `kind` jobs
+
+    The handler is called with the job's payload as keyword arguments.
+    """
+    def register(handler):
+        JOBS[kind] = handler
+        return handler
+    return register
+
+
+def enqueue(kind, delay=0, **payload):
+    """Add a job to the outbox, in the caller's transaction
+
+    Arguments:
+        kind -- A kind registered with @job
+        delay -- Seconds to wait before the job may run
+        payload -- JSON-serializable keyword arguments for the handler
+    """
+    created = enqueue_many(kind, [payload], delay)
+    return created[0] if created else None
+
+
+def enqueue_many(kind, payloads, delay=0):
+    """enqueue() for a batch of payloads, in one INSERT
+
+    Does nothing when settings.JOBS['ENABLED'] is off.
+    """
+    if kind not in JOBS:
+        raise LookupError(f'No handler registered for {kind!r} jobs')
+    if not settings.JOBS['ENABLED']:
+        return []
+    run_after = timezone.now() + timezone.timedelta(seconds=delay)
+    return Job.objects.bulk_create(
+        [Job(kind=kind, payload=payload, run_after=run_after) for payload in payloads])
+
+
+def ready_jobs(now):
+    return Job.objects.filter(failed_at__isnull=True, run_after__lte=now).filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+
+
+def claim_jobs(worker, batch_size, lease_seconds, using='default'):
+    """Lease up to batch_size ready jobs to this worker, oldest first
+
+    Jobs whose previous lease has run out are ready again.
+    """
+    now = timezone.now()
+    claim = f'{worker}:{secrets.token_hex(4)}'
+    ready = ready_jobs(now).using(using).order_by('run_after', 'id')
+    with transaction.atomic(using=using):
+        if connections[using].features.has_select_for_update_skip_locked:
+            ids = list(ready.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+        else:
+            ids = ready.values('id')[:batch_size]
+        ready_jobs(now).using(using).filter(id__in=ids).update(
+            claimed_by=claim, claimed_until=now + timezone.timedelta(seconds=lease_seconds))
+    return list(Job.objects.using(using).filter(claimed_by=claim).order_by('run_after', 'id'))
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, in seconds, after `attempts` failures"""
+    options = settings.JOBS
+    delay = min(options['BACKOFF_SECONDS'] * 2 ** (attempts - 1), options['MAX_BACKOFF_SECONDS'])
+    return delay * random.uniform(0.5, 1)
+
+
+def run_job(claimed):
+    """Run a claimed job; delete it, or schedule its retry
+
+    Returns:
+        str -- 'done', 'retried' or 'failed'
+    """
+    handler = JOBS.get(claimed.kind)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for {claimed.kind!r} jobs')
+        handler(**claimed.payload)
+    except Exception:  # pylint: disable=broad-except
+        return record_failure(claimed)
+    Job.objects.filter(pk=claimed.pk, claimed_by=claimed.claimed_by).delete()
+    return 'done'
+
+
+def record_failure(claimed):
+    attempts = claimed.attempts + 1
+    now = timezone.now()
+    changes = {'attempts': attempts, 'claimed_by': None, 'claimed_until': None,
+               'last_error': traceback_text()}
+    if attempts >= settings.JOBS['MAX_ATTEMPTS']:
+        changes['failed_at'] = now
+        outcome = 'failed'
+        logger.error('Job %s #%s failed for good after %s attempts', claimed.kind, claimed.pk, attempts,
+                     exc_info=True)
+    else:
+        changes['run_after'] = now + timezone.timedelta(seconds=retry_delay(attempts))
+        outcome = 'retried'
+        logger.warning('Job %s #%s failed, attempt %s', claimed.kind, claimed.pk, attempts, exc_info=True)
+    Job.objects.filter(pk=claimed.pk, claimed_by=claimed.claimed_by).update(**changes)
+    return outcome
+
+
+def traceback_text():
+    return traceback.format_exc()[-MAX_ERROR_LENGTH:]
+
+
+def queue_stats():
+    """Pending and failed job counts and the age of the oldest pending job"""
+    now = timezone.now()
+    pending = Job.objects.filter(failed_at__isnull=True).aggregate(
+        count=Count('id'), oldest=Min('run_after', filter=Q(run_after__lte=now)))
+    return {
+        'pending': pending['count'],
+        'failed': Job.objects.filter(failed_at__isnull=False).count(),
+        'oldest_seconds': (now - pending['oldest']).total_seconds() if pending['oldest'] else 0.0,
+    }
+
+
+def render_queue_metrics():
+    """queue_stats() as Prometheus gauges, for GET /metrics"""
+    stats = queue_stats()
+    lines = []
+    for name, help_text, value in (
+            ('jobs_pending', 'Background jobs waiting to run', stats['pending']),
+            ('jobs_failed', 'Background jobs that used up their attempts', stats['failed']),
+            ('jobs_oldest_pending_seconds', 'Time the oldest runnable job has waited', stats['oldest_seconds'])):
+        lines += [f'# HELP {PREFIX}{name} {help_text}', f'# TYPE {PREFIX}{name} gauge',
+                  f'{PREFIX}{name} {format_number(value)}']
+    return '\n'.join(lines) + '\n'
+
+
+class WorkerStats:
+    """Jobs run by one worker, by kind and outcome, with their run time"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counts = {}
+        self.seconds = {}
+
+    def observe(self, kind, outcome, seconds):
+        self.counts[kind, outcome] = self.counts.get((kind, outcome), 0) + 1
+        self.seconds[kind] = self.seconds.get(kind, 0.0) + seconds
+
+    def total(self, outcome=None):
+        return sum(count for (_, seen), count in self.counts.items() if outcome in (None, seen))
+
+    def summary(self):
+        """One line of throughput and outcomes since the worker started"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        done = self.total('done')
+        parts = [f'{done} done ({done / elapsed:.1f}/s)', f'{self.total("retried")} retried',
+                 f'{self.total("failed")} failed']
+        for kind, seconds in sorted(self.seconds.items()):
+            runs = sum(count for (seen, _), count in self.counts.items() if seen == kind)
+            parts.append(f'{kind} {seconds / runs * 1000:.1f} ms avg')
+        return ', '.join(parts)
@@ -0,0 +1,43 @@
+"""Export every ticket to a gzip-compressed CSV or columnar file"""
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from repairsapi.export import EXPORT_FORMATS, TicketExport
+
+
+class Command(BaseCommand):
+    help = ('Stream tickets with customer and employee names to a gzip-compressed file in id order; '
+            'resume a cut-off export with --after and --append')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="File to write, or '-' for stdout")
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--after', type=int, default=0, help='Only export tickets with a larger id')
+        parser.add_argument('--append', action='store_true',
+                            help='Add to the output file instead of replacing it, to resume with --after')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--progress-interval', type=float, default=10,
+                            help='Seconds between progress lines; 0 turns them off')
+
+    def handle(self, *args, **options):
+        if options['append'] and not options['after']:
+            raise CommandError('--append resumes an export, so it needs --after')
+        export = TicketExport(options['export_format'], options['after'], options['chunk_size'])
+        if options['output'] == '-':
+            self.write(export, sys.stdout.buffer, options['progress_interval'])
+        else:
+            with open(options['output'], 'ab' if options['append'] else 'wb') as output:
+                self.write(export, output, options['progress_interval'])
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {export.rows} tickets up to id {export.last_id} ({export.rate():.0f} rows/s)'))
+
+    def write(self, export, output, progress_interval):
+        reported = time.monotonic()
+        for chunk in export.chunks():
+            output.write(chunk)
+            if progress_interval and time.monotonic() - reported >= progress_interval:
+                reported = time.monotonic()
+                # The chunk is flushed whole, so the file can be resumed from here
+                output.flush()
+                self.stderr.write(f'{export.rows} tickets up to id {export.last_id} '
+                                  f'({export.rate():.0f} rows/s); resume with --after {export.last_id}')
@@ -0,0 +1,136 @@
+"""Bulk-generate synthetic customers, employees and tickets for load tests"""
+import random
+import secrets
+import time
+from itertools import accumulate
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from faker import Faker
+from rest_framework.authtoken.models import Token
+from repairsapi.models import Customer, Employee, Ticket, historical_ticket_dates
+
+DEVICES = [
+    'phone', 'laptop', 'desktop', 'tablet', 'printer', 'router', 'monitor', 'smart TV',
+    'game console', 'smartwatch', 'speaker', 'camera',
+]
+PROBLEMS = [
+    'screen is cracked', 'will not turn on', 'battery drains overnight', 'overheats after an hour',
+    'keeps restarting', 'has water damage', 'charging port is loose', 'makes a grinding noise',
+    'cannot connect to wifi', 'keys are sticking', 'display flickers', 'runs very slowly',
+]
+SPECIALTIES = ['Phones', 'Laptops', 'Desktops', 'Networking', 'Printers', 'Displays', 'Consoles', 'General']
+
+# Share of tickets that are open, in progress and completed
+STATUSES = (Ticket.STATUS_OPEN, Ticket.STATUS_IN_PROGRESS, Ticket.STATUS_COMPLETED)
+STATUS_WEIGHTS = (20, 30, 50)
+# Weights of Ticket.PRIORITY_CHOICES, low to urgent
+PRIORITY_WEIGHTS = (30, 45, 20, 5)
+EMERGENCY_RATE = 0.05
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate realistic customers, employees and tickets with faker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--employees', type=int, default=50)
+        parser.add_argument('--tickets', type=int, default=10000)
+        parser.add_argument('--days', type=int, default=730,
+                            help='Spread ticket creation dates over this many past days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None, help='Seed for a reproducible data set')
+        parser.add_argument('--password', default=None,
+                            help='Password for every generated user (default: unusable)')
+        parser.add_argument('--tokens', action='store_true', help='Create an API token for every user')
+
+    def handle(self, *args, **options):
+        if options['customers'] < 1 or options['employees'] < 0 or options['tickets'] < 0:
+            raise CommandError('Need at least one customer and no negative counts')
+
+        started = time.perf_counter()
+        rng = random.Random(options['seed'])
+        fake = Faker()
+        fake.seed_instance(options['seed'])
+        batch_size = options['batch_size']
+
+        # Usernames get a per-run prefix so the command can be run again
+        # against the same database, even with the same seed
+        run = secrets.token_hex(4)
+        password = make_password(options['password'])
+        with transaction.atomic():
+            customer_users = self.create_users(fake, run, 'c', options['customers'], password, False, batch_size)
+            employee_users = self.create_users(fake, run, 'e', options['employees'], password, True, batch_size)
+            customer_ids = self.create_accounts(
+                Customer, [Customer(user_id=user_id, address=fake.street_address()) for user_id in customer_users],
+                batch_size)
+            employee_ids = self.create_accounts(
+                Employee, [Employee(user_id=user_id, specialty=rng.choice(SPECIALTIES))
+                           for user_id in employee_users], batch_size)
+            if options['tokens']:
+                Token.objects.bulk_create(
+                    [Token(key=Token.generate_key(), user_id=user_id)
+                     for user_id in customer_users + employee_users], batch_size=batch_size)
+
+        self.create_tickets(fake, rng, customer_ids, employee_ids, options['tickets'], options['days'], batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(customer_ids)} customers, {len(employee_ids)} employees and '
+            f'{options["tickets"]} tickets in {time.perf_counter() - started:.1f}s'))
+
+    @staticmethod
+    def create_users(fake, run, kind, count, password, is_staff, batch_size):
+        """Bulk insert users and return their ids in creation order"""
+        prefix = f'gen-{run}-{kind}'
+        users = []
+        for number in range(count):
+            first_name, last_name = fake.first_name(), fake.last_name()
+            users.append(User(
+                username=f'{prefix}{number}', email=f'{prefix}{number}@{fake.free_email_domain()}',
+                first_name=first_name, last_name=last_name, password=password, is_staff=is_staff))
+        User.objects.bulk_create(users, batch_size=batch_size)
+        ids = dict(User.objects.filter(username__startswith=prefix).values_list('username', 'id'))
+        return [ids[f'{prefix}{number}'] for number in range(count)]
+
+    @staticmethod
+    def create_accounts(model, accounts, batch_size):
+        model.objects.bulk_create(accounts, batch_size=batch_size)
+        user_ids = [account.user_id for account in accounts]
+        ids = dict(model.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+        return [ids[user_id] for user_id in user_ids]
+
+    @staticmethod
+    def create_tickets(fake, rng, customer_ids, employee_ids, count, days, batch_size):
+        """Bulk insert tickets, one transaction and one change signal per batch
+
+        Customers file tickets with Zipf-like frequency, so a few of them
+        have long ticket lists as in production.
+        """
+        priorities = [choice for choice, _ in Ticket.PRIORITY_CHOICES]
+        customer_weights = list(accumulate(1 / (rank + 1) for rank in range(len(customer_ids))))
+        now = timezone.now()
+        with historical_ticket_dates():
+            for start in range(0, count, batch_size):
+                batch = []
+                for _ in range(min(batch_size, count - start)):
+                    age = timedelta(minutes=rng.randrange(max(days, 1) * 24 * 60))
+                    created = now - age
+                    status = rng.choices(STATUSES, weights=STATUS_WEIGHTS)[0]
+                    if not employee_ids:
+                        status = Ticket.STATUS_OPEN
+                    completed = None
+                    if status == Ticket.STATUS_COMPLETED:
+                        completed = min(created + timedelta(days=rng.randrange(1, 30)), now).date()
+                    batch.append(Ticket(
+                        customer_id=rng.choices(customer_ids, cum_weights=customer_weights)[0],
+                        employee_id=rng.choice(employee_ids) if status != Ticket.STATUS_OPEN else None,
+                        description=f'My {rng.choice(DEVICES)} {rng.choice(PROBLEMS)}. {fake.sentence()}',
+                        emergency=rng.random() < EMERGENCY_RATE,
+                        priority=rng.choices(priorities, weights=PRIORITY_WEIGHTS)[0],
+                        date_created=created,
+                        date_completed=completed,
+                    ))
+                with transaction.atomic():
+                    Ticket.objects.bulk_create(batch)
@@ -0,0 +1,49 @@
+"""Bulk import customers, employees or tickets from a CSV or NDJSON file"""
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from repairsapi.imports import IMPORT_FORMATS, IMPORT_KINDS, BulkImport, read_records
+
+
+class Command(BaseCommand):
+    help = ('Import customers, employees or tickets from CSV or NDJSON in batched bulk inserts; '
+            'invalid rows are reported and skipped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=IMPORT_KINDS)
+        parser.add_argument('input', help="File to read, or '-' for stdin")
+        parser.add_argument('--format', dest='import_format', choices=IMPORT_FORMATS, default=None,
+                            help='Default: from the file extension (.csv, or NDJSON otherwise)')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--tokens', action='store_true', help='Create an API token for every imported user')
+        parser.add_argument('--progress-interval', type=float, default=10,
+                            help='Seconds between progress lines; 0 turns them off')
+
+    def handle(self, *args, **options):
+        import_format = options['import_format'] or ('csv' if options['input'].endswith('.csv') else 'ndjson')
+        bulk_import = BulkImport(options['kind'], options['batch_size'], options['tokens'])
+        if options['input'] == '-':
+            self.run(bulk_import, sys.stdin, import_format, options['progress_interval'])
+        else:
+            try:
+                with open(options['input'], encoding='utf-8-sig', newline='') as lines:
+                    self.run(bulk_import, lines, import_format, options['progress_interval'])
+            except OSError as error:
+                raise CommandError(error) from error
+
+        for error in bulk_import.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        report = bulk_import.report()
+        summary = (f"Imported {report['created']} of {report['rows']} {report['kind']} in {report['seconds']:.1f}s "
+                   f"({report['rows_per_second']:.0f} rows/s)")
+        if report['failed']:
+            raise CommandError(f"{summary}; {report['failed']} rows failed")
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def run(self, bulk_import, lines, import_format, progress_interval):
+        reported = time.monotonic()
+        for progress in bulk_import.batches(read_records(lines, import_format)):
+            if progress_interval and time.monotonic() - reported >= progress_interval:
+                reported = time.monotonic()
+                self.stderr.write(f'{progress.rows} rows, {progress.created} imported, {progress.failed} failed '
+                                  f'({progress.rate():.0f} rows/s)')
@@ -0,0 +1,54 @@
+"""Run queued background jobs until stopped"""
+import os
+import signal
+import socket
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from repairsapi.jobs import WorkerStats, claim_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Claim and run background jobs from the outbox; several workers can run side by side'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run until the queue is empty, then exit')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=None)
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='Seconds between throughput lines; 0 turns them off')
+        parser.add_argument('--worker', default=f'{socket.gethostname()}:{os.getpid()}',
+                            help='Name recorded on claimed jobs')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.JOBS['BATCH_SIZE']
+        poll_interval = options['poll_interval'] or settings.JOBS['POLL_INTERVAL']
+        stats, stopping = WorkerStats(), []
+        # Finish the batch in hand on SIGTERM/SIGINT instead of dropping it
+        previous = {signum: signal.signal(signum, lambda *_: stopping.append(True))
+                    for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self.work(options, batch_size, poll_interval, stats, stopping)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'Stopped: {stats.summary()}'))
+
+    def work(self, options, batch_size, poll_interval, stats, stopping):
+        reported = time.monotonic()
+        while not stopping:
+            claimed = claim_jobs(options['worker'], batch_size, settings.JOBS['LEASE_SECONDS'])
+            for job in claimed:
+                started = time.perf_counter()
+                outcome = run_job(job)
+                stats.observe(job.kind, outcome, time.perf_counter() - started)
+            if not claimed:
+                if options['once']:
+                    return
+                # Drop a connection that broke or outlived CONN_MAX_AGE while idle
+                close_old_connections()
+                time.sleep(poll_interval)
+            if options['stats_interval'] and time.monotonic() - reported >= options['stats_interval']:
+                reported = time.monotonic()
+                self.stdout.write(stats.summary())
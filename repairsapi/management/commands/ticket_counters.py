@@ -0,0 +1,30 @@
+"""Rebuild or verify the materialized ticket counters and employee workloads"""
+from django.core.management.base import BaseCommand, CommandError
+from repairsapi.stats import rebuild_counters, verify_counters
+from repairsapi.workload import rebuild_workloads, verify_workloads
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the ticket counter and employee workload tables from the tickets, '
+            'or verify them against them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['rebuild', 'verify'])
+
+    def handle(self, *args, **options):
+        if options['action'] == 'rebuild':
+            written = rebuild_counters()
+            workloads = rebuild_workloads()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} counter rows and {workloads} workload rows'))
+            return
+
+        mismatches = verify_counters()
+        for scope, (stored, live) in sorted(mismatches.items()):
+            self.stdout.write(f'scope {scope}: stored {stored} live {live}')
+        workload_mismatches = verify_workloads()
+        for employee, (stored, live) in sorted(workload_mismatches.items()):
+            self.stdout.write(f'employee {employee}: stored {stored} live {live}')
+        if mismatches or workload_mismatches:
+            raise CommandError(f'{len(mismatches)} counter rows and {len(workload_mismatches)} workload rows '
+                               'disagree with the tickets table')
+        self.stdout.write(self.style.SUCCESS('Counters and workloads match the tickets table'))
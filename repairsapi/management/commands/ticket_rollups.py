@@ -0,0 +1,33 @@
+"""Refresh or verify the daily ticket rollups behind /tickets/reports"""
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from repairsapi.reports import REFRESH_DAYS, refresh_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = ('Recompute the daily ticket rollups of recent days (or all of them) from the tickets, '
+            'or verify every rollup against them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help=f'First day to recompute (default: the last {REFRESH_DAYS} days)')
+        parser.add_argument('--all', action='store_true', help='Recompute every day')
+        parser.add_argument('--verify', action='store_true', help='Compare instead of recomputing')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = verify_rollups()
+            for (day, priority), (stored, live) in sorted(mismatches.items()):
+                self.stdout.write(f'{day} {priority}: stored {stored} live {live}')
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} rollup rows disagree with the tickets table')
+            self.stdout.write(self.style.SUCCESS('Rollups match the tickets table'))
+            return
+
+        since = None
+        if not options['all']:
+            since = options['since'] or timezone.localdate() - datetime.timedelta(days=REFRESH_DAYS - 1)
+        written = refresh_rollups(since)
+        scope = 'every day' if since is None else f'days since {since}'
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup rows for {scope}'))
@@ -0,0 +1,276 @@
+"""Per-route request metrics, exported in the Prometheus text format
+
+RequestMetricsMiddleware times every request and, through a database
+execute wrapper installed on each connection, counts its queries and
+the time spent in them. Serialization time covers serializers, the
+values_list() fast path and response rendering, minus any queries run
+while they work. Samples are folded into histograms per route (the URL
+name, e.g. `ticket-list`) and method, which GET /metrics returns.
+
+The histograms live in the worker process; with several workers each
+one reports its own, as Prometheus' multi-target scraping expects.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('repairsapi.slow_requests')
+
+# Queries kept for the slow-request log of a single request
+MAX_LOGGED_QUERIES = 100
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name -> (help text, buckets) of every per-route histogram
+HISTOGRAMS = {
+    'request_duration_seconds': ('Wall time from the first middleware to the response', TIME_BUCKETS),
+    'db_queries': ('SQL queries run by a request', QUERY_BUCKETS),
+    'db_duration_seconds': ('Time spent waiting on SQL queries', TIME_BUCKETS),
+    'serialization_seconds': ('Time spent serializing and rendering response bodies', TIME_BUCKETS),
+    'response_bytes': ('Size of non-streaming response bodies', BYTE_BUCKETS),
+}
+PREFIX = 'honeyrae_'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a sum and a count"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """(le label, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield format_number(bound), total
+        yield '+Inf', self.count
+
+
+class RequestSample:
+    """What one request spent, filled in while it runs"""
+    __slots__ = ('queries', 'db_time', 'serialization_time', 'depth', 'sql', 'render_started')
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.depth = 0
+        self.sql = [] if capture_sql else None
+        self.render_started = None
+
+
+class MetricsRegistry:
+    """Histograms per (route, method) plus a response counter per status"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.responses = {}
+
+    def observe(self, route, method, status_code, duration, sample, size):
+        key = (route, method)
+        with self.lock:
+            histograms = self.routes.get(key)
+            if histograms is None:
+                histograms = self.routes[key] = {
+                    name: Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()}
+            histograms['request_duration_seconds'].observe(duration)
+            histograms['db_queries'].observe(sample.queries)
+            histograms['db_duration_seconds'].observe(sample.db_time)
+            histograms['serialization_seconds'].observe(sample.serialization_time)
+            if size is not None:
+                histograms['response_bytes'].observe(size)
+            status_key = (route, method, str(status_code))
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+
+    def render(self):
+        """The registry in the Prometheus text exposition format"""
+        lines = [
+            f'# HELP {PREFIX}responses_total Responses sent, by route, method and status',
+            f'# TYPE {PREFIX}responses_total counter',
+        ]
+        with self.lock:
+            for (route, method, status_code), count in sorted(self.responses.items()):
+                labels = format_labels(route=route, method=method, status=status_code)
+                lines.append(f'{PREFIX}responses_total{{{labels}}} {count}')
+            for name, (help_text, _) in HISTOGRAMS.items():
+                metric = PREFIX + name
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+                for (route, method), histograms in sorted(self.routes.items()):
+                    histogram = histograms[name]
+                    labels = format_labels(route=route, method=method)
+                    for bound, count in histogram.samples():
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{{labels}}} {format_number(histogram.sum)}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.responses.clear()
+
+
+registry = MetricsRegistry()
+_current = ContextVar('request_metrics', default=None)
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(**labels):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in labels.items())
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query to the current request"""
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        sample.queries += 1
+        sample.db_time += elapsed
+        if sample.sql is not None and len(sample.sql) < MAX_LOGGED_QUERIES:
+            sample.sql.append((elapsed, sql))
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializing():
+    """Count the enclosed work as serialization time of the current request
+
+    Nested blocks count once, and queries run inside the block (a lazy
+    queryset being read) are left to the database time.
+    """
+    sample = _current.get()
+    if sample is None or sample.depth:
+        if sample is not None:
+            sample.depth += 1
+        try:
+            yield
+        finally:
+            if sample is not None:
+                sample.depth -= 1
+        return
+
+    sample.depth += 1
+    db_time = sample.db_time
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.depth -= 1
+        sample.serialization_time += time.perf_counter() - started - (sample.db_time - db_time)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match is not None else None) or 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    """Record wall, database and serialization time for every request
+
+    Put it first in MIDDLEWARE so the wall time covers the rest of the
+    stack. Requests slower than REQUEST_METRICS['SLOW_REQUEST_SECONDS']
+    are logged to `repairsapi.slow_requests` with the SQL they ran.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.REQUEST_METRICS['ENABLED']:
+            return self.get_response(request)
+        sample, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, sample, started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.REQUEST_METRICS['ENABLED']:
+            return await self.get_response(request)
+        sample, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, sample, started)
+        return response
+
+    def process_template_response(self, request, response):
+        """Time the rendering that follows for DRF Responses"""
+        sample = _current.get()
+        if sample is not None and not response.is_rendered:
+            sample.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.rendered(sample))
+        return response
+
+    @staticmethod
+    def rendered(sample):
+        sample.serialization_time += time.perf_counter() - sample.render_started
+
+    @staticmethod
+    def start():
+        sample = RequestSample(capture_sql=settings.REQUEST_METRICS['SLOW_REQUEST_SECONDS'] is not None)
+        return sample, _current.set(sample), time.perf_counter()
+
+    @staticmethod
+    def finish(request, response, sample, started):
+        duration = time.perf_counter() - started
+        route = route_name(request)
+        size = None if response.streaming else len(response.content)
+        registry.observe(route, request.method, response.status_code, duration, sample, size)
+
+        threshold = settings.REQUEST_METRICS['SLOW_REQUEST_SECONDS']
+        if threshold is not None and duration >= threshold:
+            queries = '\n'.join(f'  {elapsed * 1000:8.2f} ms  {sql}' for elapsed, sql in sample.sql)
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, serialization %.1f ms\n%s',
+                request.method, request.get_full_path(), route, duration * 1000, sample.queries,
+                sample.db_time * 1000, sample.serialization_time * 1000, queries)
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairsapi', '0002_alter_ticket_options_ticket_date_created_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.PositiveBigIntegerField(unique=True)),
+                ('total', models.IntegerField(default=0)),
+                ('open', models.IntegerField(default=0)),
+                ('in_progress', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('urgent', models.IntegerField(default=0)),
+                ('high_priority', models.IntegerField(default=0)),
+                ('emergency', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
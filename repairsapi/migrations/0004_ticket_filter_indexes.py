@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairsapi', '0003_ticketcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['-date_created', '-id'], name='ticket_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['customer', '-date_created', '-id'], name='ticket_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['priority', '-date_created', '-id'], name='ticket_priority_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('date_completed__isnull', True), ('employee__isnull', True)), fields=['-date_created', '-id'], name='ticket_unclaimed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('date_completed__isnull', True), ('employee__isnull', False)), fields=['-date_created', '-id'], name='ticket_in_progress_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('date_completed__isnull', True)), fields=['priority'], name='ticket_open_priority_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:03
+
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    Ticket = apps.get_model('repairsapi', 'Ticket')
+    Ticket.objects.filter(date_completed__isnull=False).update(status='completed')
+    Ticket.objects.filter(date_completed__isnull=True, employee__isnull=False).update(status='in_progress')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairsapi', '0004_ticket_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='ticket_unclaimed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='ticket_in_progress_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ticket',
+            name='ticket_open_priority_idx',
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('open', 'Open'), ('in_progress', 'In progress'), ('completed', 'Completed')], default='open', editable=False, max_length=11),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['status', '-date_created', '-id'], name='ticket_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('status__in', ['open', 'in_progress'])), fields=['priority'], name='ticket_active_priority_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairsapi', '0009_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeWorkload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('employee', models.PositiveBigIntegerField(unique=True)),
+                ('active', models.IntegerField(default=0)),
+                ('low', models.IntegerField(default=0)),
+                ('medium', models.IntegerField(default=0)),
+                ('high', models.IntegerField(default=0)),
+                ('urgent', models.IntegerField(default=0)),
+                ('emergency', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:52
+
+from collections import Counter, defaultdict
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_rollups(apps, schema_editor):
+    """Fold the existing tickets into the new rollup rows"""
+    Ticket = apps.get_model('repairsapi', 'Ticket')
+    TicketRollup = apps.get_model('repairsapi', 'TicketRollup')
+    using = schema_editor.connection.alias
+    rollups = defaultdict(Counter)
+    tickets = Ticket.objects.using(using).order_by().values_list('priority', 'date_created', 'date_completed')
+    for priority, date_created, date_completed in tickets.iterator(chunk_size=2000):
+        created = timezone.localtime(date_created).date() if timezone.is_aware(date_created) else date_created.date()
+        rollups[created, priority]['created'] += 1
+        if date_completed is not None:
+            rollups[date_completed, priority]['completed'] += 1
+            rollups[date_completed, priority]['completion_days'] += (date_completed - created).days
+    TicketRollup.objects.using(using).bulk_create(
+        [TicketRollup(day=day, priority=priority, **totals) for (day, priority), totals in rollups.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairsapi', '0010_employee_workload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('priority', models.CharField(max_length=10)),
+                ('created', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('completion_days', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'priority'), name='ticket_rollup_day_priority')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:01
+
+import repairsapi.models.ticket
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairsapi', '0011_ticket_rollup'),
+    ]
+
+    # Only the field class changes; the column stays the same, so don't
+    # let SQLite rebuild the ticket table for it
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='ticket',
+                    name='date_created',
+                    field=repairsapi.models.ticket.CreationTimeField(auto_now_add=True),
+                ),
+            ],
+        ),
+    ]
@@ -1,3 +1,10 @@
 from .customer import Customer
 from .employee import Employee
-from .ticket import Ticket
\ No newline at end of file
+from .employee_workload import EmployeeWorkload
+from .job import Job
+from .ticket import (StaleTicket, Ticket, TicketState, batched_ticket_changes, historical_ticket_dates,
+                     send_ticket_changes, tickets_changed)
+from .ticket_counter import TicketCounter
+from .ticket_event import TicketEvent
+from .ticket_rollup import TicketRollup
+from .ticket_search import TicketSearchEntry
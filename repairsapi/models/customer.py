@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from repairsapi.query_plan import requires_fields
 
 
 class Customer(models.Model):
@@ -7,7 +8,9 @@ class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     # Additional address field to capture from the client
     address = models.CharField(max_length=155)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     @property
+    @requires_fields('user__first_name', 'user__last_name')
     def full_name(self):
         return f'{self.user.first_name} {self.user.last_name}'
\ No newline at end of file
@@ -1,11 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import User
+from repairsapi.query_plan import requires_fields
 
 
 class Employee(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     specialty = models.CharField(max_length=155)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     @property
+    @requires_fields('user__first_name', 'user__last_name')
     def full_name(self):
         return f'{self.user.first_name} {self.user.last_name}'
\ No newline at end of file
@@ -0,0 +1,22 @@
+from django.db import models
+
+
+class EmployeeWorkload(models.Model):
+    """Materialized counts of one employee's unfinished tickets
+
+    The row for employee 0 counts the open tickets nobody is assigned
+    to. Rows are kept current by the ticket change signals when
+    settings.WORKLOAD_COUNTERS is on.
+    """
+    UNASSIGNED = 0
+
+    employee = models.PositiveBigIntegerField(unique=True)
+    active = models.IntegerField(default=0)
+    low = models.IntegerField(default=0)
+    medium = models.IntegerField(default=0)
+    high = models.IntegerField(default=0)
+    urgent = models.IntegerField(default=0)
+    emergency = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Workload of employee {self.employee}"
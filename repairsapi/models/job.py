@@ -0,0 +1,33 @@
+from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """A side effect of a write, run later by `manage.py run_jobs`
+
+    Rows are inserted in the transaction of the write that needs them,
+    so a job exists exactly when the write commits. A worker claims a
+    row by setting claimed_by and a lease in claimed_until; if the
+    worker dies the lease runs out and another worker picks it up.
+    Finished jobs are deleted; jobs that used up their attempts keep
+    their last error and a failed_at time.
+    """
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_by = models.CharField(max_length=100, null=True, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Jobs still to run, in the order workers claim them
+            models.Index(fields=['run_after', 'id'], name='job_ready_idx', condition=Q(failed_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"Job {self.kind} #{self.pk}"
@@ -1,4 +1,195 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
 from django.db import models
+from django.db.models.lookups import IsNull
+from django.dispatch import Signal
+from django.utils import timezone
+
+
+# Sent with changes=[(before, after), ...] of TicketState snapshots every
+# time tickets are written. `before` is None for new tickets and `after`
+# is None for deleted ones. Bulk write paths send one signal per batch.
+tickets_changed = Signal()
+
+_change_batch = ContextVar('ticket_change_batch', default=None)
+
+
+def send_ticket_changes(changes):
+    """Send tickets_changed, or add to the open batch if there is one"""
+    batch = _change_batch.get()
+    if batch is not None:
+        batch.extend(changes)
+    elif changes:
+        tickets_changed.send(sender=Ticket, changes=list(changes))
+
+
+@contextmanager
+def batched_ticket_changes():
+    """Collect the ticket changes made in the block into one signal
+
+    The signal is sent when the block exits normally; nested blocks join
+    the outermost batch.
+    """
+    if _change_batch.get() is not None:
+        yield
+        return
+    changes = []
+    reset = _change_batch.set(changes)
+    try:
+        yield
+    finally:
+        _change_batch.reset(reset)
+    send_ticket_changes(changes)
+
+
+_keep_created_dates = ContextVar('keep_ticket_created_dates', default=False)
+
+
+@contextmanager
+def historical_ticket_dates():
+    """Keep the date_created set on tickets inserted in the block
+
+    Outside the block date_created is always stamped with the time of
+    the insert, like any auto_now_add field.
+    """
+    reset = _keep_created_dates.set(True)
+    try:
+        yield
+    finally:
+        _keep_created_dates.reset(reset)
+
+
+class CreationTimeField(models.DateTimeField):
+    """auto_now_add DateTimeField that historical_ticket_dates() can override"""
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if add and value is not None and _keep_created_dates.get():
+            return value
+        return super().pre_save(model_instance, add)
+
+
+class StaleTicket(Exception):
+    """A ticket changed since it was read, so the write was not applied"""
+
+
+def ticket_status(date_completed, employee_id):
+    """Status of a ticket with the given completion date and assignee"""
+    if date_completed:
+        return Ticket.STATUS_COMPLETED
+    elif employee_id:
+        return Ticket.STATUS_IN_PROGRESS
+    else:
+        return Ticket.STATUS_OPEN
+
+
+class TicketState(namedtuple('TicketState', [
+        'id', 'customer_id', 'employee_id', 'status', 'priority', 'emergency',
+        'date_created', 'date_completed'])):
+    """Snapshot of the ticket columns that derived data is computed from"""
+    __slots__ = ()
+
+
+class TicketQuerySet(models.QuerySet):
+    """QuerySet whose bulk write paths keep derived ticket data in sync
+
+    Besides maintaining the stored status, updated_at and version,
+    bulk_create, bulk_update, update and delete each send a single
+    tickets_changed signal for the rows they touched, since the per-row
+    model signals don't fire.
+    """
+
+    def states(self):
+        """TicketState snapshots of the matching rows"""
+        rows = self.order_by().values_list(*TicketState._fields)
+        return [TicketState(*row) for row in rows]
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for ticket in objs:
+            ticket.sync_status()
+        created = super().bulk_create(objs, *args, **kwargs)
+
+        changes = []
+        for ticket in created:
+            if ticket.pk is not None:
+                ticket._loaded_state = ticket.snapshot()
+                changes.append((None, ticket._loaded_state))
+        send_ticket_changes(changes)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        if Ticket.STATUS_INPUTS.intersection(fields) and 'status' not in fields:
+            for ticket in objs:
+                ticket.sync_status()
+            fields.append('status')
+        if 'updated_at' not in fields:
+            now = timezone.now()
+            for ticket in objs:
+                ticket.updated_at = now
+            fields.append('updated_at')
+
+        # Django runs bulk_update as QuerySet.update() calls, which send
+        # the change signal
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        for ticket in objs:
+            ticket._loaded_state = ticket.snapshot()
+            # update() bumped the stored version
+            ticket.version = ticket._loaded_version = ticket.version + 1
+        return rows
+
+    def update(self, **kwargs):
+        # Rows read back after the write unless their new state follows
+        # from the old one and the values set
+        values = self.state_values(kwargs)
+        if Ticket.STATUS_INPUTS.intersection(kwargs) and 'status' not in kwargs:
+            kwargs['status'] = Ticket.status_expression(
+                date_completed=kwargs.get('date_completed', models.F('date_completed')),
+                employee=kwargs.get('employee', kwargs.get('employee_id', models.F('employee'))),
+            )
+        kwargs.setdefault('updated_at', timezone.now())
+        kwargs.setdefault('version', models.F('version') + 1)
+
+        if not tickets_changed.has_listeners(Ticket):
+            return super().update(**kwargs)
+
+        before = {state.id: state for state in self.states()}
+        rows = super().update(**kwargs)
+        if before:
+            if values is not None and rows == len(before):
+                after = [self.updated_state(state, values) for state in before.values()]
+            else:
+                after = self.model.objects.filter(pk__in=before).states()
+            send_ticket_changes([(before[state.id], state) for state in after])
+        return rows
+
+    def state_values(self, kwargs):
+        """The TicketState fields update(**kwargs) sets, or None if any is an SQL expression"""
+        values = {}
+        for name, value in kwargs.items():
+            field = self.model._meta.get_field(name)
+            if field.attname not in TicketState._fields:
+                continue
+            if hasattr(value, 'resolve_expression'):
+                return None
+            if isinstance(value, models.Model):
+                value = value.pk
+            values[field.attname] = None if value is None else field.to_python(value)
+        return values
+
+    @staticmethod
+    def updated_state(state, values):
+        state = state._replace(**values)
+        if 'status' in values:
+            return state
+        return state._replace(status=ticket_status(state.date_completed, state.employee_id))
+
+    def delete(self):
+        with batched_ticket_changes():
+            return super().delete()
 
 
 class Ticket(models.Model):
@@ -17,26 +208,136 @@ class Ticket(models.Model):
         (PRIORITY_URGENT, 'Urgent'),
     ]
 
+    # Status choices, derived from date_completed and employee on save
+    STATUS_OPEN = 'open'
+    STATUS_IN_PROGRESS = 'in_progress'
+    STATUS_COMPLETED = 'completed'
+
+    STATUS_CHOICES = [
+        (STATUS_OPEN, 'Open'),
+        (STATUS_IN_PROGRESS, 'In progress'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+    ACTIVE_STATUSES = (STATUS_OPEN, STATUS_IN_PROGRESS)
+    # Fields whose values decide the status
+    STATUS_INPUTS = frozenset(['date_completed', 'employee', 'employee_id'])
+
     customer = models.ForeignKey("Customer", on_delete=models.CASCADE, related_name='submitted_tickets')
     employee = models.ForeignKey("Employee", null=True, blank=True, on_delete=models.CASCADE, related_name='assigned_tickets')
     description = models.CharField(max_length=500)
     emergency = models.BooleanField(default=False)
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default=PRIORITY_MEDIUM)
-    date_created = models.DateTimeField(auto_now_add=True)
+    date_created = CreationTimeField(auto_now_add=True)
     date_completed = models.DateField(null=True, blank=True, auto_now=False, auto_now_add=False)
+    status = models.CharField(max_length=11, choices=STATUS_CHOICES, default=STATUS_OPEN, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Bumped by every write. Saves of a ticket read at an older version
+    # raise StaleTicket instead of overwriting the newer row.
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = TicketQuerySet.as_manager()
+    # Version the ticket was read or last saved at; None for new tickets
+    _loaded_version = None
 
     class Meta:
         ordering = ['-date_created']
+        indexes = [
+            # Default ordering and keyset pagination over every ticket
+            models.Index(fields=['-date_created', '-id'], name='ticket_created_idx'),
+            # Customer-scoped lists, newest first
+            models.Index(fields=['customer', '-date_created', '-id'], name='ticket_customer_created_idx'),
+            # ?priority= filter, newest first
+            models.Index(fields=['priority', '-date_created', '-id'], name='ticket_priority_created_idx'),
+            # ?status= filter and status counts, newest first
+            models.Index(fields=['status', '-date_created', '-id'], name='ticket_status_created_idx'),
+            # MAX(updated_at) version stamps for customer-scoped requests
+            models.Index(fields=['customer', 'updated_at'], name='ticket_customer_updated_idx'),
+            # Open urgent/high counts on the dashboard
+            models.Index(fields=['priority'], name='ticket_active_priority_idx',
+                         condition=models.Q(status__in=['open', 'in_progress'])),
+        ]
+
+    @staticmethod
+    def status_expression(date_completed=models.F('date_completed'), employee=models.F('employee')):
+        """SQL expression for the status given new date_completed/employee values
+
+        Either argument may be a plain value or an expression, matching
+        what QuerySet.update() accepts for those columns.
+        """
+        whens = []
+        default = Ticket.STATUS_OPEN
+        for value, result in ((date_completed, Ticket.STATUS_COMPLETED),
+                              (employee, Ticket.STATUS_IN_PROGRESS)):
+            if hasattr(value, 'resolve_expression'):
+                whens.append(models.When(IsNull(value, False), then=models.Value(result)))
+            elif value is not None:
+                default = result
+                break
+        if not whens:
+            return models.Value(default)
+        return models.Case(*whens, default=models.Value(default))
+
+    def sync_status(self):
+        """Recompute the stored status from date_completed and employee"""
+        self.status = ticket_status(self.date_completed, self.employee_id)
+
+    def save(self, *args, **kwargs):
+        """Save the ticket, refusing to overwrite a newer version of it
+
+        Raises:
+            StaleTicket -- The row's version moved on since this ticket was read
+        """
+        self.sync_status()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {*update_fields, 'updated_at', 'version'}
+            if self.STATUS_INPUTS.intersection(update_fields):
+                update_fields.add('status')
+            kwargs['update_fields'] = update_fields
+        read_version = self._loaded_version
+        if read_version is not None:
+            self.version = read_version + 1
+        try:
+            super().save(*args, **kwargs)
+        except StaleTicket:
+            self.version = read_version
+            raise
+        self._loaded_version = self.version
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update, *args, **kwargs):
+        # Compare-and-swap: only update the row if it still has the version read
+        if self._loaded_version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update,
+                                      *args, **kwargs)
+        current = base_qs.filter(version=self._loaded_version)
+        updated = super()._do_update(current, using, pk_val, values, update_fields, forced_update,
+                                     *args, **kwargs)
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise StaleTicket(f'Ticket {pk_val} changed since version {self._loaded_version} was read')
+        return updated
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored state so change signals can compute deltas
+        instance._loaded_state = instance.snapshot()
+        instance._loaded_version = None if 'version' in instance.get_deferred_fields() else instance.version
+        return instance
 
-    @property
-    def status(self):
-        """Computed status based on employee assignment and completion"""
-        if self.date_completed:
-            return 'completed'
-        elif self.employee:
-            return 'in_progress'
-        else:
-            return 'open'
+    def snapshot(self):
+        """Return the current TicketState, or None if any of it is deferred"""
+        if self.get_deferred_fields().intersection(TicketState._fields):
+            return None
+        return TicketState(
+            id=self.id,
+            customer_id=self.customer_id,
+            employee_id=self.employee_id,
+            status=self.status,
+            priority=self.priority,
+            emergency=bool(self.emergency),
+            date_created=self.date_created,
+            date_completed=self._meta.get_field('date_completed').to_python(self.date_completed),
+        )
 
     def __str__(self):
         return f"Ticket #{self.id}: {self.description[:50]}"
\ No newline at end of file
@@ -0,0 +1,23 @@
+from django.db import models
+
+
+class TicketCounter(models.Model):
+    """Materialized ticket statistics for one scope
+
+    Scope 0 holds the totals across all tickets; any other scope is the
+    id of the customer whose tickets are counted. Rows are kept current
+    by the ticket change signals when settings.TICKET_COUNTERS is on.
+    """
+    GLOBAL_SCOPE = 0
+
+    scope = models.PositiveBigIntegerField(unique=True)
+    total = models.IntegerField(default=0)
+    open = models.IntegerField(default=0)
+    in_progress = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    urgent = models.IntegerField(default=0)
+    high_priority = models.IntegerField(default=0)
+    emergency = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Ticket counters for scope {self.scope}"
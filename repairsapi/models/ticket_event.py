@@ -0,0 +1,24 @@
+from django.db import models
+
+
+class TicketEvent(models.Model):
+    """A ticket change in the event feed outbox
+
+    Written in the same transaction as the change when the feed uses
+    repairsapi.events.OutboxBroker, so every worker can stream it. The
+    ticket id is a plain column because events outlive deleted tickets.
+    """
+    kind = models.CharField(max_length=10)
+    ticket_id = models.BigIntegerField()
+    customer_id = models.BigIntegerField()
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # A customer's events after a cursor
+            models.Index(fields=['customer_id', 'id'], name='ticket_event_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ticket {self.ticket_id} {self.kind}"
@@ -0,0 +1,25 @@
+from django.db import models
+
+
+class TicketRollup(models.Model):
+    """Daily ticket totals for one priority
+
+    `created` counts the tickets created on `day`, and `completed` those
+    completed on it, with `completion_days` summing how many days each
+    of those took. Rows are kept current by the ticket change signals
+    when settings.TICKET_ROLLUPS is on, and refreshed by
+    `manage.py ticket_rollups`.
+    """
+    day = models.DateField()
+    priority = models.CharField(max_length=10)
+    created = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    completion_days = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'priority'], name='ticket_rollup_day_priority'),
+        ]
+
+    def __str__(self):
+        return f"{self.priority} tickets on {self.day}"
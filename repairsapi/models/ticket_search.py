@@ -0,0 +1,34 @@
+from django.db import models
+from .ticket import Ticket
+
+
+class SearchField(models.TextField):
+    """Text column of an FTS5 table, filterable with the `match` lookup"""
+
+
+@SearchField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class TicketSearchEntry(models.Model):
+    """A row of the SQLite FTS5 index over ticket descriptions
+
+    The virtual table and the triggers that fill it are created by
+    repairsapi.search, not by Django, and only on SQLite. `rank` is
+    FTS5's bm25 score, lower is better, and is only defined in queries
+    that filter with `description__match`.
+    """
+    ticket = models.OneToOneField(Ticket, on_delete=models.DO_NOTHING, primary_key=True,
+                                  db_column='rowid', db_constraint=False, related_name='search_entry')
+    description = SearchField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'repairsapi_ticket_fts'
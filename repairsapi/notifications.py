@@ -0,0 +1,36 @@
+"""Emails sent by background jobs after account and ticket writes"""
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from repairsapi.jobs import job
+from repairsapi.models import Ticket
+
+# Ticket event kinds (see repairsapi.events.event_kind) the customer is emailed about
+NOTIFIED_KINDS = ('assigned', 'completed')
+
+
+@job('welcome_email')
+def send_welcome_email(user):
+    account = User.objects.filter(pk=user).values('email', 'first_name', 'is_staff').first()
+    if account is None or not account['email']:
+        return
+    role = 'Your employee account is ready.' if account['is_staff'] else \
+        'You can now submit repair tickets and follow their progress.'
+    send_mail('Welcome to Honey Rae Repairs', f'Hi {account["first_name"]},\n\n{role}\n',
+              None, [account['email']])
+
+
+@job('ticket_notification')
+def send_ticket_notification(ticket, kind):
+    """Tell a ticket's customer it was assigned or completed"""
+    found = Ticket.objects.filter(pk=ticket).values(
+        'description', 'customer__user__email', 'customer__user__first_name',
+        'employee__user__first_name', 'employee__user__last_name').first()
+    if found is None or not found['customer__user__email']:
+        return
+    if kind == 'completed':
+        subject, news = f'Ticket #{ticket} is complete', 'Your repair is done.'
+    else:
+        technician = f'{found["employee__user__first_name"]} {found["employee__user__last_name"]}'.strip()
+        subject, news = f'Ticket #{ticket} was assigned', f'{technician or "A technician"} is on it.'
+    send_mail(subject, f'Hi {found["customer__user__first_name"]},\n\n{news}\n\n"{found["description"]}"\n',
+              None, [found['customer__user__email']])
@@ -0,0 +1,290 @@
+"""Keyset pagination and NDJSON streaming for list endpoints"""
+import base64
+import binascii
+import json
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
+from repairsapi.fast_serializers import encode_value, fast_serializer, render_json
+from repairsapi.metrics import serializing
+from repairsapi.query_plan import plan_queryset
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over a unique, indexed ordering
+
+    Each cursor holds the ordering values of the last row on the page, so
+    the next page is a range scan starting right after it instead of an
+    OFFSET that re-reads every earlier row. Pagination is opt-in: without
+    `cursor` or `page_size` the whole list is returned as before, unless
+    the paginator is `required`.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering, required=False):
+        self.ordering = tuple(ordering)
+        self.required = required
+        self.next_values = None
+        self.request = None
+        self.limit = None
+
+    def is_requested(self, request):
+        """Whether the response should be paginated"""
+        return (self.required
+                or self.cursor_query_param in request.query_params
+                or self.page_size_query_param in request.query_params)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, values):
+        payload = json.dumps(values, cls=JSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, queryset, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, ValueError) as ex:
+            raise NotFound(self.invalid_cursor_message) from ex
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        fields = [ordering_field(queryset, name.lstrip('-')) for name in self.ordering]
+        try:
+            return [field.to_python(value) for field, value in zip(fields, values)]
+        except Exception as ex:
+            raise NotFound(self.invalid_cursor_message) from ex
+
+    def keyset_filter(self, values):
+        """Q selecting rows strictly after `values` in the ordering"""
+        condition = Q()
+        for index, name in enumerate(self.ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            equal = {self.ordering[i].lstrip('-'): values[i] for i in range(index)}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[index]})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None, key=None):
+        """Rows of the requested page, or None when pagination wasn't asked for
+
+        `key` returns a row's ordering values; by default they are read
+        as attributes of model instances.
+        """
+        if not self.is_requested(request):
+            return None
+        return self.take_page(list(self.page_query(queryset, request)), key)
+
+    async def apaginate_queryset(self, queryset, request, key=None):
+        """paginate_queryset() on the async ORM"""
+        if not self.is_requested(request):
+            return None
+        return self.take_page([row async for row in self.page_query(queryset, request)], key)
+
+    def page_query(self, queryset, request):
+        """The rows of the requested page plus one to tell if there are more"""
+        self.request = request
+        self.limit = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.keyset_filter(self.decode_cursor(queryset, cursor)))
+        return queryset[:self.limit + 1]
+
+    def take_page(self, rows, key=None):
+        page = rows[:self.limit]
+        if len(rows) > self.limit:
+            last = page[-1]
+            if key is not None:
+                self.next_values = key(last)
+            else:
+                self.next_values = [getattr(last, name.lstrip('-')) for name in self.ordering]
+        return page
+
+    def get_next_link(self):
+        """Path and query of the next page, relative so cached pages suit any host"""
+        if self.next_values is None:
+            return None
+        url = self.request.get_full_path()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_values))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        }, status=status.HTTP_200_OK)
+
+    def get_encoded_response(self, rows):
+        """get_paginated_response() for rows already encoded as JSON text"""
+        with serializing():
+            body = '{"next":' + encode_value(self.get_next_link()) + ',"results":[' + ','.join(rows) + ']}'
+            return json_response(render_json(body))
+
+
+def json_response(content):
+    return HttpResponse(content, content_type=JSONRenderer.media_type, status=status.HTTP_200_OK)
+
+
+def fast_path(request, serializer_class):
+    """FastSerializer when the response will be plain JSON, else None
+
+    Other renderers (the browsable API, or JSON with an indent) go
+    through DRF as usual.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    if type(renderer) is not JSONRenderer:  # pylint: disable=unidiomatic-typecheck
+        return None
+    if 'indent' in (request.accepted_media_type or ''):
+        return None
+    return fast_serializer(serializer_class)
+
+
+def ordering_fields(ordering):
+    return [name.lstrip('-') for name in ordering]
+
+
+def ordering_field(queryset, name):
+    """Model field or annotation output field an ordering name sorts by"""
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+def stream_ndjson(queryset, serializer_class, chunk_size=None):
+    """Stream a queryset as newline-delimited JSON, one row per line
+
+    Rows are read with a chunked iterator and written out a chunk at a
+    time, so memory stays flat no matter how large the export is.
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    encode, queryset = ndjson_encoder(queryset, serializer_class)
+
+    def lines():
+        chunk = []
+        for row in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(encode(row))
+            if len(chunk) >= chunk_size:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+def astream_ndjson(queryset, serializer_class, chunk_size=None):
+    """stream_ndjson() over the async ORM, for ASGI servers"""
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    encode, queryset = ndjson_encoder(queryset, serializer_class)
+
+    async def lines():
+        # aiterator() runs values_list() queries on the event loop thread
+        # (ValuesListIterable.__iter__ isn't a generator), so pull chunks
+        # from the sync iterator in a thread instead
+        rows = queryset.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = await sync_to_async(lambda: list(islice(rows, chunk_size)))()
+            if chunk:
+                yield '\n'.join(map(encode, chunk)) + '\n'
+            if len(chunk) < chunk_size:
+                break
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+def ndjson_encoder(queryset, serializer_class):
+    """Line encoder and the queryset to feed it, fast path when possible"""
+    fast = fast_serializer(serializer_class)
+    if fast is not None:
+        return fast.encode, fast.values(queryset)[0]
+
+    serializer = serializer_class()
+
+    def encode(instance):
+        return json.dumps(serializer.to_representation(instance), cls=JSONEncoder,
+                          ensure_ascii=False, separators=(',', ':'))
+    return encode, plan_queryset(queryset, serializer_class)
+
+
+def list_response(request, queryset, serializer_class, ordering, paginate=False):
+    """Respond to a list request with a full, paginated or streamed body
+
+    Plain JSON bodies are encoded straight from values_list() rows by
+    the serializer's FastSerializer; the output is the same bytes.
+
+    Arguments:
+        request -- The DRF request, whose query params pick the mode
+        queryset -- Rows to return, already filtered for the caller
+        serializer_class -- PlannedModelSerializer used for each row
+        ordering -- Unique ordering used for cursors and streams
+        paginate -- Paginate even when the client didn't ask to
+    """
+    if request.query_params.get('stream') == 'ndjson':
+        return stream_ndjson(queryset.order_by(*ordering), serializer_class)
+
+    paginator = KeysetPagination(ordering, required=paginate)
+    fast = fast_path(request, serializer_class)
+    if fast is not None:
+        fields = ordering_fields(ordering)
+        rows, indexes = fast.values(queryset, extra=fields)
+        page = paginator.paginate_queryset(
+            rows, request, key=lambda row: [row[indexes[field]] for field in fields])
+        if page is None:
+            with serializing():
+                return json_response(fast.render_list(rows))
+        return paginator.get_encoded_response(map(fast.encode, page))
+
+    queryset = plan_queryset(queryset, serializer_class)
+    page = paginator.paginate_queryset(queryset, request)
+    if page is None:
+        serialized = serializer_class(queryset, many=True)
+        return Response(serialized.data, status=status.HTTP_200_OK)
+
+    serialized = serializer_class(page, many=True)
+    return paginator.get_paginated_response(serialized.data)
+
+
+async def alist_response(request, queryset, serializer_class, ordering, paginate=False):
+    """list_response() for async views, reading rows with the async ORM"""
+    if request.query_params.get('stream') == 'ndjson':
+        return astream_ndjson(queryset.order_by(*ordering), serializer_class)
+
+    paginator = KeysetPagination(ordering, required=paginate)
+    fast = fast_path(request, serializer_class)
+    if fast is not None:
+        fields = ordering_fields(ordering)
+        rows, indexes = fast.values(queryset, extra=fields)
+        page = await paginator.apaginate_queryset(
+            rows, request, key=lambda row: [row[indexes[field]] for field in fields])
+        if page is None:
+            rows = [row async for row in rows]
+            with serializing():
+                return json_response(fast.render_list(rows))
+        return paginator.get_encoded_response(map(fast.encode, page))
+
+    queryset = plan_queryset(queryset, serializer_class)
+    page = await paginator.apaginate_queryset(queryset, request)
+    if page is None:
+        serialized = serializer_class([row async for row in queryset], many=True)
+        return Response(serialized.data, status=status.HTTP_200_OK)
+
+    serialized = serializer_class(page, many=True)
+    return paginator.get_paginated_response(serialized.data)
@@ -0,0 +1,113 @@
+"""Sparse fieldsets: ?fields= and ?expand= for serializer output
+
+`fields` lists the top-level fields to return, with `relation.field`
+picking fields of a nested object. `expand` lists the relations to
+return as nested objects; the others are returned as their primary
+key. Without `expand` every relation stays nested, so responses without
+either parameter keep their full shape.
+
+A projection is a generated subclass of the serializer, cached per
+selection, so the query planner and the values_list() fast path size
+their query to it like any other serializer: a relation that isn't
+expanded costs no join, and an unselected field no column.
+"""
+from functools import lru_cache
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+# Distinct projections kept; their classes are also cached by
+# plan_for_serializer and fast_serializer
+MAX_PROJECTIONS = 256
+
+
+def nested_fields(serializer_class):
+    """{name: field} of the single nested objects a serializer renders"""
+    return {name: field for name, field in serializer_class().fields.items()
+            if isinstance(field, serializers.BaseSerializer)
+            and not isinstance(field, serializers.ListSerializer)}
+
+
+def split_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_selection(serializer_class, fields, expand):
+    """Validated, canonical (fields, expand) from the raw query values
+
+    Returns:
+        tuple -- (tuple of (name, tuple of nested names or None)) or None,
+            frozenset of relation names or None
+    """
+    declared = serializer_class().fields
+    nested = nested_fields(serializer_class)
+
+    selected = None
+    if fields:
+        picked = {}
+        for name in split_names(fields):
+            name, _, child = name.partition('.')
+            if name not in declared:
+                raise ParseError(f"Unknown field '{name}'")
+            if not child:
+                picked[name] = None
+                continue
+            if name not in nested:
+                raise ParseError(f"'{name}' has no fields to select")
+            if child not in nested[name].fields:
+                raise ParseError(f"Unknown field '{name}.{child}'")
+            if name not in picked or picked[name] is not None:
+                picked[name] = picked.get(name) or set()
+                picked[name].add(child)
+        # Keep the declared order, so equal selections share a projection
+        selected = tuple((name, None if picked[name] is None else
+                          tuple(child for child in nested[name].fields if child in picked[name]))
+                         for name in declared if name in picked)
+
+    expanded = None
+    if expand is not None:
+        expanded = frozenset(split_names(expand))
+        unknown = expanded - set(nested)
+        if unknown:
+            raise ParseError(f"Can't expand '{sorted(unknown)[0]}'")
+        # Picking fields of a relation expands it
+        expanded |= {name for name, children in selected or () if children}
+    return selected, expanded
+
+
+def request_serializer(request, serializer_class):
+    """The serializer for a request's ?fields= and ?expand=, or serializer_class"""
+    fields = request.query_params.get(FIELDS_PARAM)
+    expand = request.query_params.get(EXPAND_PARAM)
+    if not fields and expand is None:
+        return serializer_class
+    return projected_serializer(serializer_class, *parse_selection(serializer_class, fields, expand))
+
+
+@lru_cache(maxsize=MAX_PROJECTIONS)
+def projected_serializer(serializer_class, fields=None, expand=None):
+    """Subclass of serializer_class rendering a parse_selection() selection
+
+    Unselected declared fields are removed, relations that aren't
+    expanded become primary keys, and relations with picked fields
+    nest a projection of their own serializer.
+    """
+    declared = serializer_class().fields
+    nested = nested_fields(serializer_class)
+    picked = dict(fields) if fields is not None else dict.fromkeys(declared)
+
+    attrs = {'__module__': serializer_class.__module__}
+    for name, field in declared.items():
+        if name not in picked:
+            if name in serializer_class._declared_fields:
+                attrs[name] = None
+        elif name in nested and expand is not None and name not in expand:
+            source = {} if field.source == name else {'source': field.source}
+            attrs[name] = serializers.PrimaryKeyRelatedField(read_only=True, **source)
+        elif picked[name] is not None:
+            child = projected_serializer(type(field), tuple((child, None) for child in picked[name]))
+            attrs[name] = child(*field._args, **field._kwargs)
+    attrs['Meta'] = type('Meta', (serializer_class.Meta,), {'fields': tuple(name for name in declared
+                                                                            if name in picked)})
+    return type(f'{serializer_class.__name__}Projection', (serializer_class,), attrs)
@@ -0,0 +1,186 @@
+"""Query planning for serializers
+
+Works out the select_related/prefetch_related/only() graph a serializer
+needs from its declared fields, so list endpoints load every row they
+render in a constant number of queries.
+"""
+from functools import lru_cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, QuerySet
+from django.db.models.manager import BaseManager
+from rest_framework import serializers
+from repairsapi.metrics import serializing
+
+
+def requires_fields(*paths):
+    """Declare the model fields a computed property reads
+
+    Used underneath @property so the planner can load the columns and
+    joins that the property touches, e.g.
+
+        @property
+        @requires_fields('user__first_name', 'user__last_name')
+        def full_name(self):
+            ...
+    """
+    def decorator(func):
+        func.required_fields = paths
+        return func
+    return decorator
+
+
+class QueryPlan:
+    """Joins, prefetches and columns needed to render a serializer"""
+
+    def __init__(self):
+        self.select_related = set()
+        self.prefetch_related = {}
+        self.only = set()
+        # Cleared when a field reads something the planner can't see,
+        # in which case every column is loaded
+        self.restrict_columns = True
+
+    def apply(self, queryset):
+        """Return queryset with this plan applied"""
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related.values())
+        if self.restrict_columns and self.only:
+            queryset = queryset.only(*sorted(self.only))
+        return queryset
+
+
+def _add_model_path(plan, model, path, prefix=''):
+    """Add a model attribute path such as 'user__first_name' to the plan"""
+    parts = path.split('__')
+    for index, part in enumerate(parts):
+        last = index == len(parts) - 1
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            attribute = getattr(model, part, None)
+            required = getattr(getattr(attribute, 'fget', None), 'required_fields', None)
+            if required is None:
+                plan.restrict_columns = False
+                return
+            for required_path in required:
+                _add_model_path(plan, model, required_path, prefix)
+            return
+
+        if not field.is_relation:
+            plan.only.add(prefix + part)
+            return
+
+        if field.many_to_many or field.one_to_many or not field.concrete:
+            plan.prefetch_related.setdefault(prefix + part, prefix + part)
+            plan.restrict_columns = False
+            return
+
+        # Forward foreign key or one-to-one: keep the key column and
+        # join the related row only when something beyond it is read
+        plan.only.add(prefix + part)
+        if last:
+            return
+        plan.select_related.add(prefix + part)
+        prefix = f'{prefix}{part}__'
+        model = field.related_model
+
+
+def _add_serializer_fields(plan, model, fields, prefix=''):
+    for field in fields.values():
+        if field.write_only:
+            continue
+
+        if field.source == '*':
+            if isinstance(field, serializers.BaseSerializer):
+                _add_serializer_fields(plan, model, field.fields, prefix)
+            else:
+                plan.restrict_columns = False
+            continue
+
+        path = '__'.join(field.source_attrs)
+
+        if isinstance(field, serializers.ListSerializer):
+            related_model = field.child.Meta.model
+            child_plan = build_plan(related_model, field.child.fields)
+            lookup = prefix + path
+            plan.prefetch_related[lookup] = Prefetch(
+                lookup, queryset=child_plan.apply(related_model._default_manager.all()))
+            continue
+
+        if isinstance(field, serializers.ManyRelatedField):
+            plan.prefetch_related.setdefault(prefix + path, prefix + path)
+            continue
+
+        if isinstance(field, serializers.BaseSerializer):
+            _add_model_path(plan, model, path, prefix)
+            plan.select_related.add(prefix + path)
+            related_model = model._meta.get_field(path).related_model
+            _add_serializer_fields(plan, related_model, field.fields, f'{prefix}{path}__')
+            continue
+
+        _add_model_path(plan, model, path, prefix)
+
+
+def build_plan(model, fields):
+    """Build a QueryPlan for rendering `fields` from instances of `model`"""
+    plan = QueryPlan()
+    _add_serializer_fields(plan, model, fields)
+    if plan.restrict_columns:
+        plan.only.add(model._meta.pk.name)
+    return plan
+
+
+@lru_cache(maxsize=1024)
+def plan_for_serializer(serializer_class):
+    """Return the cached QueryPlan for a ModelSerializer class
+
+    Bounded, as ?fields= projections each have a class of their own.
+    """
+    return build_plan(serializer_class.Meta.model, serializer_class().fields)
+
+
+def plan_queryset(queryset, serializer_class):
+    """Apply the serializer's query plan to a queryset or manager"""
+    if isinstance(queryset, BaseManager):
+        queryset = queryset.all()
+    return plan_for_serializer(serializer_class).apply(queryset)
+
+
+class PlannedListSerializer(serializers.ListSerializer):
+    """List serializer that plans an unevaluated queryset before rendering"""
+
+    def to_representation(self, data):
+        if isinstance(data, BaseManager):
+            data = data.all()
+        if (isinstance(data, QuerySet) and data._result_cache is None
+                and not data.query.is_sliced):
+            data = plan_queryset(data, type(self.child))
+        with serializing():
+            return super().to_representation(data)
+
+
+class PlannedModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer that loads related rows with a planned query
+
+    Serializing a queryset with many=True applies the plan automatically;
+    single-row lookups go through `plan()` before fetching.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = cls.__dict__.get('Meta')
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = PlannedListSerializer
+
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+    @classmethod
+    def plan(cls, queryset=None):
+        """Return queryset (default: all rows) with this serializer's plan"""
+        if queryset is None:
+            queryset = cls.Meta.model.objects.all()
+        return plan_queryset(queryset, cls)
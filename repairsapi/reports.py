@@ -0,0 +1,245 @@
+"""Ticket reports: daily created/completed series from the rollup table
+
+Every ticket adds to two TicketRollup rows of its priority: `created`
+on the day it was created and, once completed, `completed` and
+`completion_days` on the day it was completed. The ticket change
+signals move those contributions when a ticket's priority, dates or
+existence change, so the table always equals a fold over the current
+tickets, and a report for any range reads a few rows per day instead
+of every ticket.
+"""
+import datetime
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from repairsapi.models import Ticket, TicketRollup
+
+ROLLUP_FIELDS = ('created', 'completed', 'completion_days')
+PRIORITIES = tuple(priority for priority, _ in Ticket.PRIORITY_CHOICES)
+DEFAULT_REPORT_DAYS = 30
+MAX_REPORT_DAYS = 731
+# Days `manage.py ticket_rollups` recomputes without --since or --all
+REFRESH_DAYS = 2
+# Changes touching more (day, priority) rows than this, like imports of
+# old tickets, update them ROLLUP_BATCH_SIZE at a time instead of one by one
+BULK_ROLLUP_KEYS = 20
+ROLLUP_BATCH_SIZE = 500
+
+
+def rollups_enabled():
+    return getattr(settings, 'TICKET_ROLLUPS', False)
+
+
+def created_day(value):
+    """The local calendar day of a date_created timestamp"""
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def day_start(day):
+    """The aware datetime a local calendar day starts at"""
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def ticket_rollup_deltas(priority, date_created, date_completed, sign=1):
+    """[((day, priority), {field: amount})] one ticket adds to the rollups"""
+    created = created_day(date_created)
+    deltas = [((created, priority), {'created': sign})]
+    if date_completed is not None:
+        deltas.append(((date_completed, priority), {
+            'completed': sign, 'completion_days': sign * (date_completed - created).days}))
+    return deltas
+
+
+def rollup_deltas(changes):
+    """Per-(day, priority) deltas for a list of (before, after) TicketStates"""
+    deltas = defaultdict(Counter)
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            for key, amounts in ticket_rollup_deltas(state.priority, state.date_created,
+                                                     state.date_completed, sign):
+                deltas[key].update(amounts)
+    return {key: delta for key, delta in deltas.items() if any(delta.values())}
+
+
+def add_to_rollup(key, delta):
+    day, priority = key
+    updates = {name: F(name) + amount for name, amount in delta.items() if amount}
+    return TicketRollup.objects.filter(day=day, priority=priority).update(**updates)
+
+
+def add_to_rollups(deltas):
+    """Apply many (day, priority) deltas with one CASE UPDATE per batch of rows"""
+    keys = list(deltas)
+    for start in range(0, len(keys), ROLLUP_BATCH_SIZE):
+        batch = keys[start:start + ROLLUP_BATCH_SIZE]
+        TicketRollup.objects.bulk_create(
+            [TicketRollup(day=day, priority=priority) for day, priority in batch], ignore_conflicts=True)
+        wanted = set(batch)
+        ids = {(day, priority): pk for pk, day, priority in TicketRollup.objects.filter(
+            day__in={day for day, _ in batch}).values_list('id', 'day', 'priority') if (day, priority) in wanted}
+        updates = {}
+        for name in ROLLUP_FIELDS:
+            whens = [When(pk=ids[key], then=Value(deltas[key][name])) for key in batch if deltas[key][name]]
+            if whens:
+                updates[name] = F(name) + Case(*whens, default=Value(0))
+        TicketRollup.objects.filter(pk__in=ids.values()).update(**updates)
+
+
+def apply_rollup_changes(changes):
+    """Fold ticket changes into the rollup rows with one UPDATE per day and priority
+
+    Days without a row yet get an empty one first; a change that only
+    touches the status or assignee updates nothing.
+    """
+    deltas = rollup_deltas(changes)
+    if len(deltas) > BULK_ROLLUP_KEYS:
+        add_to_rollups(deltas)
+        return
+    missing = [key for key, delta in deltas.items() if not add_to_rollup(key, delta)]
+    if missing:
+        TicketRollup.objects.bulk_create(
+            [TicketRollup(day=day, priority=priority) for day, priority in missing], ignore_conflicts=True)
+        for key in missing:
+            add_to_rollup(key, deltas[key])
+
+
+def live_rollups(since=None):
+    """Rollup rows computed from the tickets themselves
+
+    Arguments:
+        since -- Only compute the days from this date on; None for all
+
+    Returns:
+        dict -- (day, priority) -> {field: total}
+    """
+    tickets = Ticket.objects.order_by()
+    if since is not None:
+        tickets = tickets.filter(Q(date_created__gte=day_start(since)) | Q(date_completed__gte=since))
+    rollups = defaultdict(Counter)
+    for row in tickets.values_list('priority', 'date_created', 'date_completed').iterator(chunk_size=2000):
+        for key, amounts in ticket_rollup_deltas(*row):
+            if since is None or key[0] >= since:
+                rollups[key].update(amounts)
+    return {key: {name: totals[name] for name in ROLLUP_FIELDS} for key, totals in rollups.items()}
+
+
+def refresh_rollups(since=None):
+    """Replace the rollup rows from `since` on (all of them for None) with live ones
+
+    Returns:
+        int -- Number of rollup rows written
+    """
+    rollups = live_rollups(since)
+    stale = TicketRollup.objects.all() if since is None else TicketRollup.objects.filter(day__gte=since)
+    with transaction.atomic():
+        stale.delete()
+        TicketRollup.objects.bulk_create(
+            TicketRollup(day=day, priority=priority, **values) for (day, priority), values in rollups.items())
+    return len(rollups)
+
+
+def stored_rollups():
+    return {(row.pop('day'), row.pop('priority')): row
+            for row in TicketRollup.objects.values('day', 'priority', *ROLLUP_FIELDS)}
+
+
+def verify_rollups():
+    """Compare stored rollup rows with the live fold over the tickets
+
+    Returns:
+        dict -- (day, priority) -> (stored, live) for every row that disagrees
+    """
+    live = live_rollups()
+    stored = stored_rollups()
+    empty = dict.fromkeys(ROLLUP_FIELDS, 0)
+    return {key: (stored.get(key, empty), live.get(key, empty)) for key in set(live) | set(stored)
+            if stored.get(key, empty) != live.get(key, empty)}
+
+
+def report_range(query_params):
+    """(start, end) dates from ?start= and ?end=, the last 30 days by default"""
+    try:
+        end = datetime.date.fromisoformat(query_params['end']) if 'end' in query_params \
+            else timezone.localdate()
+        start = datetime.date.fromisoformat(query_params['start']) if 'start' in query_params \
+            else end - datetime.timedelta(days=DEFAULT_REPORT_DAYS - 1)
+    except ValueError as error:
+        raise ParseError('start and end must be dates like 2024-01-31') from error
+    if start > end:
+        raise ParseError('start must not be after end')
+    if (end - start).days >= MAX_REPORT_DAYS:
+        raise ParseError(f'Reports cover at most {MAX_REPORT_DAYS} days')
+    return start, end
+
+
+def mean_days(completion_days, completed):
+    return round(completion_days / completed, 2) if completed else None
+
+
+def build_report(start, end, backlog, rows):
+    """The report for start..end from the backlog before start and the rows in range
+
+    Arguments:
+        backlog -- {priority: unfinished tickets at the end of the day before start}
+        rows -- (day, priority) -> {field: total} for days in range
+    """
+    backlog = Counter(backlog)
+    days = []
+    totals = Counter()
+    day = start
+    while day <= end:
+        today = Counter()
+        for priority in PRIORITIES:
+            values = rows.get((day, priority))
+            if values:
+                today.update(values)
+                backlog[priority] += values['created'] - values['completed']
+        totals.update(today)
+        days.append({
+            'date': day.isoformat(),
+            'created': today['created'],
+            'completed': today['completed'],
+            'mean_completion_days': mean_days(today['completion_days'], today['completed']),
+            'backlog': {priority: backlog[priority] for priority in PRIORITIES},
+        })
+        day += datetime.timedelta(days=1)
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'totals': {'created': totals['created'], 'completed': totals['completed'],
+                   'mean_completion_days': mean_days(totals['completion_days'], totals['completed'])},
+        'days': days,
+    }
+
+
+def rollup_report(start, end):
+    """Report from the rollup table: one grouped query and one range scan"""
+    before = TicketRollup.objects.filter(day__lt=start).order_by().values('priority').annotate(
+        backlog=Sum('created') - Sum('completed'))
+    rows = TicketRollup.objects.filter(day__range=(start, end)).values('day', 'priority', *ROLLUP_FIELDS)
+    return build_report(start, end, {row['priority']: row['backlog'] for row in before},
+                        {(row.pop('day'), row.pop('priority')): row for row in rows})
+
+
+def live_report(start, end):
+    """Report folded from every ticket row, as clients computed it before rollups"""
+    backlog = Counter()
+    rows = {}
+    for (day, priority), values in live_rollups().items():
+        if day < start:
+            backlog[priority] += values['created'] - values['completed']
+        elif day <= end:
+            rows[(day, priority)] = values
+    return build_report(start, end, backlog, rows)
+
+
+def ticket_report(start, end):
+    """Daily created/completed counts, mean days to completion and backlog by priority"""
+    if rollups_enabled():
+        return rollup_report(start, end)
+    return live_report(start, end)
@@ -0,0 +1,180 @@
+"""Cache of serialized ticket list responses, invalidated by write signals"""
+import hashlib
+import threading
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.http import urlencode
+from rest_framework.response import Response
+
+# Scope bumped by writes that show up in every list, e.g. an employee rename
+ALL_SCOPES = 'all'
+
+
+class ResponseCache:
+    """Serialized response data keyed by scope, renderer and normalized query string
+
+    Every scope has a generation token stored in the same cache and
+    folded into each entry's key. Invalidating a scope replaces its
+    token, so stale entries are never read again and age out through the
+    backend's own eviction. Tokens are random rather than counters, so a
+    token lost to eviction can't come back and revive old entries.
+    """
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.RESPONSE_CACHE
+        return cls(options['ALIAS'], options['TIMEOUT'])
+
+    @staticmethod
+    def generation_key(scope):
+        return f'response-generation:{scope}'
+
+    def generations(self, *scopes):
+        keys = [self.generation_key(scope) for scope in scopes]
+        stored = self.cache.get_many(keys)
+        tokens = []
+        for key in keys:
+            token = stored.get(key)
+            if token is None:
+                token = uuid.uuid4().hex
+                if not self.cache.add(key, token, None):
+                    token = self.cache.get(key, token)
+            tokens.append(token)
+        return tokens
+
+    def entry_key(self, scope, request):
+        """Entry key; the renderer is part of it, as encoded JSON bodies only suit JSON requests"""
+        params = request.query_params
+        query = urlencode(sorted((name, sorted(values)) for name, values in params.lists()), doseq=True)
+        renderer = f'{request.accepted_renderer.format}|{request.accepted_media_type}'
+        version = ':'.join(self.generations(ALL_SCOPES, scope))
+        digest = hashlib.sha1(f'{scope}|{version}|{renderer}|{query}'.encode()).hexdigest()
+        return f'response-entry:{digest}'
+
+    def fetch(self, scope, request, build_response):
+        """Serve a cached response for (scope, request), or build and store it
+
+        Arguments:
+            scope -- Whose view of the data this is, e.g. 'staff' or 'customer:3'
+            request -- The DRF Request, after content negotiation
+            build_response -- Called on a miss; only 200 responses are stored
+        """
+        key, entry = self.lookup(scope, request)
+        if entry is not None:
+            return self.respond(entry)
+        return self.store(key, build_response())
+
+    async def afetch(self, scope, request, build_response):
+        """fetch() for async views; build_response is a coroutine function
+
+        The cache calls themselves stay synchronous, since they never
+        touch the database.
+        """
+        key, entry = self.lookup(scope, request)
+        if entry is not None:
+            return self.respond(entry)
+        return self.store(key, await build_response())
+
+    def lookup(self, scope, request):
+        """Entry key and cached entry; no key for requests that aren't cached"""
+        if 'stream' in request.query_params:
+            return None, None
+        key = self.entry_key(scope, request)
+        entry = self.cache.get(key)
+        self.count('hits' if entry is not None else 'misses')
+        return key, entry
+
+    def store(self, key, response):
+        """Cache a DRF Response's data, or the body of an already encoded one"""
+        if key is None or response.status_code != 200 or response.streaming:
+            return response
+        if isinstance(response, Response):
+            self.cache.set(key, ('data', response.data), self.timeout)
+        else:
+            self.cache.set(key, ('body', response.content, response['Content-Type']), self.timeout)
+        return response
+
+    @staticmethod
+    def respond(entry):
+        if entry[0] == 'data':
+            return Response(entry[1])
+        return HttpResponse(entry[1], content_type=entry[2])
+
+    def invalidate(self, *scopes):
+        """Drop every entry for the given scopes"""
+        self.cache.set_many({self.generation_key(scope): uuid.uuid4().hex for scope in scopes}, None)
+        self.count('invalidations', len(scopes))
+
+    def count(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+_response_cache = None
+
+
+def response_cache():
+    """The process-wide ResponseCache, or None when it is disabled"""
+    global _response_cache  # pylint: disable=global-statement
+    if not settings.RESPONSE_CACHE['ENABLED']:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache.from_settings()
+    return _response_cache
+
+
+@receiver(setting_changed)
+def reset_response_cache(setting, **kwargs):
+    global _response_cache  # pylint: disable=global-statement
+    if setting in ('RESPONSE_CACHE', 'CACHES'):
+        _response_cache = None
+
+
+def cached_response(scope, request, build_response):
+    cache = response_cache()
+    if cache is None:
+        return build_response()
+    return cache.fetch(scope, request, build_response)
+
+
+async def acached_response(scope, request, build_response):
+    cache = response_cache()
+    if cache is None:
+        return await build_response()
+    return await cache.afetch(scope, request, build_response)
+
+
+def invalidate_responses(*scopes):
+    """Invalidate scopes now and again once the current transaction commits
+
+    The second pass covers requests that read the old rows and cached
+    them under the new generation while the write was uncommitted.
+    """
+    cache = response_cache()
+    if cache is None or not scopes:
+        return
+    cache.invalidate(*scopes)
+    transaction.on_commit(lambda: cache.invalidate(*scopes))
@@ -0,0 +1,93 @@
+"""Full-text search over ticket descriptions
+
+SQLite keeps an FTS5 table in step with repairsapi_ticket through
+triggers; PostgreSQL uses a GIN index on to_tsvector('english',
+description). Both are created by migration 0007, which keeps its own
+copy of this SQL. Other databases fall back to unranked icontains
+matching.
+"""
+import re
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from repairsapi.models import TicketSearchEntry
+
+SEARCH_CONFIG = 'english'
+MAX_TERMS = 10
+
+# Order of search results: best rank first, ties by id
+RANKED_ORDERING = ('rank', 'id')
+
+FTS_TABLE = TicketSearchEntry._meta.db_table
+SQLITE_SEARCH_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        description, content='repairsapi_ticket', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON repairsapi_ticket BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, description) VALUES (new.id, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON repairsapi_ticket BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description) VALUES ('delete', old.id, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF description ON repairsapi_ticket BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description) VALUES ('delete', old.id, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, description) VALUES (new.id, new.description);
+    END""",
+]
+SQLITE_TRIGGERS = [f'{FTS_TABLE}_insert', f'{FTS_TABLE}_delete', f'{FTS_TABLE}_update']
+
+
+def search_vector():
+    from django.contrib.postgres.search import SearchVector  # pylint: disable=import-outside-toplevel
+    return SearchVector('description', config=SEARCH_CONFIG)
+
+
+def install_sqlite_search(connection):
+    """Create the FTS5 table and triggers that are missing, then backfill
+
+    Safe to run again: a migration that rebuilds repairsapi_ticket drops
+    its triggers, so this also runs after every migrate (see signals) and
+    rebuilds the index when any trigger had to be put back.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                       SQLITE_TRIGGERS)
+        missing = cursor.fetchone()[0] < len(SQLITE_TRIGGERS)
+        for statement in SQLITE_SEARCH_SQL:
+            cursor.execute(statement)
+        if missing:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_terms(text):
+    """Words of a search box query; punctuation and operators are dropped"""
+    return re.findall(r'\w+', text or '')[:MAX_TERMS]
+
+
+def search_tickets(queryset, text):
+    """Tickets whose description matches every word of `text`, ranked
+
+    Each word also matches as a prefix, so partial words work while
+    typing. The queryset gets a `rank` annotation (lower is better) and
+    is ordered by RANKED_ORDERING.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(search_entry__description__match=match).annotate(
+            rank=F('search_entry__rank'))
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank  # pylint: disable=import-outside-toplevel
+        query = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw',
+                            config=SEARCH_CONFIG)
+        queryset = queryset.annotate(search=search_vector()).filter(search=query).annotate(
+            rank=-SearchRank(search_vector(), query))
+    else:
+        condition = Q()
+        for term in terms:
+            condition &= Q(description__icontains=term)
+        queryset = queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
+    return queryset.order_by(*RANKED_ORDERING)
@@ -0,0 +1,147 @@
+"""Signal receivers that keep derived ticket data in step with writes"""
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from repairsapi.authentication import principal_cache
+from repairsapi.models import (Customer, Employee, EmployeeWorkload, Ticket, TicketCounter,
+                               send_ticket_changes, tickets_changed)
+from repairsapi import events, jobs, reports, search, stats, workload
+from repairsapi.notifications import NOTIFIED_KINDS
+from repairsapi.response_cache import ALL_SCOPES, invalidate_responses
+
+
+@receiver(pre_save, sender=Ticket)
+def remember_stored_state(sender, instance, **kwargs):
+    """Load the stored state of tickets that weren't read from the database"""
+    if instance.pk is None or getattr(instance, '_loaded_state', None) is not None:
+        return
+    stored = Ticket.objects.filter(pk=instance.pk).first()
+    instance._loaded_state = stored.snapshot() if stored else None
+
+
+@receiver(post_save, sender=Ticket)
+def ticket_saved(sender, instance, created, **kwargs):
+    before = None if created else instance._loaded_state
+    after = instance.snapshot()
+    if after is None:
+        after = Ticket.objects.get(pk=instance.pk).snapshot()
+    instance._loaded_state = after
+    send_ticket_changes([(before, after)])
+
+
+@receiver(post_delete, sender=Ticket)
+def ticket_deleted(sender, instance, **kwargs):
+    before = getattr(instance, '_loaded_state', None) or instance.snapshot()
+    if before is not None:
+        send_ticket_changes([(before, None)])
+
+
+@receiver(tickets_changed)
+def update_ticket_counters(sender, changes, **kwargs):
+    if stats.counters_enabled():
+        stats.apply_counter_changes(changes)
+
+
+@receiver(tickets_changed)
+def update_workload_counters(sender, changes, **kwargs):
+    if workload.workload_counters_enabled():
+        workload.apply_workload_changes(changes)
+
+
+@receiver(tickets_changed)
+def update_ticket_rollups(sender, changes, **kwargs):
+    if reports.rollups_enabled():
+        reports.apply_rollup_changes(changes)
+
+
+@receiver(tickets_changed)
+def invalidate_ticket_responses(sender, changes, **kwargs):
+    customer_ids = {state.customer_id for change in changes for state in change if state is not None}
+    invalidate_responses('staff', *(f'customer:{customer_id}' for customer_id in customer_ids))
+
+
+@receiver(tickets_changed)
+def publish_ticket_events(sender, changes, **kwargs):
+    broker = events.event_broker()
+    if broker is not None:
+        broker.publish(events.ticket_events(changes))
+
+
+@receiver(tickets_changed)
+def queue_ticket_notifications(sender, changes, **kwargs):
+    """Email customers about assignments and completions after the write commits"""
+    payloads = []
+    for before, after in changes:
+        kind = events.event_kind(before, after)
+        if kind in NOTIFIED_KINDS:
+            payloads.append({'ticket': after.id, 'kind': kind})
+    if payloads:
+        jobs.enqueue_many('ticket_notification', payloads)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_customer_responses(sender, instance, **kwargs):
+    invalidate_responses('staff', f'customer:{instance.pk}')
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee_responses(sender, instance, **kwargs):
+    invalidate_responses(ALL_SCOPES)
+
+
+@receiver(post_delete, sender=Customer)
+def drop_customer_counters(sender, instance, **kwargs):
+    TicketCounter.objects.filter(scope=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Employee)
+def drop_employee_workload(sender, instance, **kwargs):
+    EmployeeWorkload.objects.filter(employee=instance.pk).delete()
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token_principal(sender, instance, **kwargs):
+    principal_cache().invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_principals(sender, instance, **kwargs):
+    principal_cache().invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_account_principals(sender, instance, **kwargs):
+    principal_cache().invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def touch_user_accounts(sender, instance, created, update_fields=None, **kwargs):
+    """Names live on User, so move updated_at on the rows that render them"""
+    if created:
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login', 'password'}:
+        return
+    now = timezone.now()
+    Customer.objects.filter(user_id=instance.pk).update(updated_at=now)
+    Employee.objects.filter(user_id=instance.pk).update(updated_at=now)
+    invalidate_responses(ALL_SCOPES)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    """Put back FTS5 triggers lost when a migration rebuilt repairsapi_ticket"""
+    connection = connections[using]
+    if sender.name != 'repairsapi' or connection.vendor != 'sqlite':
+        return
+    if search.FTS_TABLE in connection.introspection.table_names():
+        search.install_sqlite_search(connection)
@@ -0,0 +1,203 @@
+"""Ticket statistics: single-query aggregates and materialized counters"""
+from collections import Counter, defaultdict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+from repairsapi.models import Ticket, TicketCounter
+
+
+# Each bucket is (filter for the live aggregate, test for a TicketState)
+STAT_BUCKETS = {
+    'total': (Q(), lambda state: True),
+    'open': (Q(status=Ticket.STATUS_OPEN),
+             lambda state: state.status == Ticket.STATUS_OPEN),
+    'in_progress': (Q(status=Ticket.STATUS_IN_PROGRESS),
+                    lambda state: state.status == Ticket.STATUS_IN_PROGRESS),
+    'completed': (Q(status=Ticket.STATUS_COMPLETED),
+                  lambda state: state.status == Ticket.STATUS_COMPLETED),
+    'urgent': (Q(priority=Ticket.PRIORITY_URGENT, status__in=Ticket.ACTIVE_STATUSES),
+               lambda state: state.priority == Ticket.PRIORITY_URGENT
+               and state.status in Ticket.ACTIVE_STATUSES),
+    'high_priority': (Q(priority=Ticket.PRIORITY_HIGH, status__in=Ticket.ACTIVE_STATUSES),
+                      lambda state: state.priority == Ticket.PRIORITY_HIGH
+                      and state.status in Ticket.ACTIVE_STATUSES),
+    'emergency': (Q(emergency=True, status__in=Ticket.ACTIVE_STATUSES),
+                  lambda state: state.emergency and state.status in Ticket.ACTIVE_STATUSES),
+}
+
+
+def counters_enabled():
+    return getattr(settings, 'TICKET_COUNTERS', False)
+
+
+def bucket_aggregates():
+    """Conditional COUNT expressions for every bucket, keyed by name"""
+    return {name: Count('id', filter=condition) for name, (condition, _) in STAT_BUCKETS.items()}
+
+
+def aggregate_stats(queryset):
+    """Compute every bucket for a queryset in one query"""
+    return queryset.aggregate(**bucket_aggregates())
+
+
+def scope_queryset(scope):
+    if scope == TicketCounter.GLOBAL_SCOPE:
+        return Ticket.objects.all()
+    return Ticket.objects.filter(customer_id=scope)
+
+
+def hold_ticket_writes(using):
+    """Keep other transactions from writing tickets until this one ends
+
+    On PostgreSQL a SHARE lock on the ticket table waits for transactions
+    that have written tickets to commit and holds back new ones. SQLite
+    transactions are IMMEDIATE (see settings), so the atomic block
+    around this already holds the database's write lock.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {connection.ops.quote_name(Ticket._meta.db_table)} IN SHARE MODE')
+
+
+def fill_counter_rows(model, key_field, keys, fields, live):
+    """Stored rows of a delta-maintained counter table, filling missing ones
+
+    Ticket writes only UPDATE rows that exist, in the transaction of the
+    ticket write. A row inserted from an aggregate that missed a write
+    committed before the insert would stay off by that write for good, so
+    the aggregate and the insert run while ticket writes are held.
+
+    Arguments:
+        model -- The counter model, e.g. TicketCounter
+        key_field -- Its key field, e.g. 'scope'
+        keys -- Keys to return
+        fields -- Counter fields to return
+        live -- Called with the missing keys; returns key -> {field: count}
+
+    Returns:
+        dict -- key -> {field: count}
+    """
+    using = model.objects.db
+    rows = {row.pop(key_field): row
+            for row in model.objects.filter(**{f'{key_field}__in': keys}).values(key_field, *fields)}
+    if len(rows) == len(set(keys)):
+        return rows
+    with transaction.atomic(using=using):
+        hold_ticket_writes(using)
+        # Filled by someone else while this waited
+        rows.update({row.pop(key_field): row for row in model.objects.filter(
+            **{f'{key_field}__in': [key for key in keys if key not in rows]}).values(key_field, *fields)})
+        missing = [key for key in keys if key not in rows]
+        if missing:
+            filled = live(missing)
+            # Two fillers can hold ticket writes at once; both computed the same counts
+            model.objects.bulk_create([model(**{key_field: key}, **filled[key]) for key in missing],
+                                      ignore_conflicts=True)
+            rows.update({key: filled[key] for key in missing})
+    return rows
+
+
+def live_scope_stats(scopes):
+    return {scope: aggregate_stats(scope_queryset(scope)) for scope in scopes}
+
+
+def ticket_stats(scope):
+    """Dashboard statistics for a scope (0 for every ticket, else a customer id)
+
+    Reads the materialized counter row when counters are enabled, filling
+    it from the live aggregate the first time a scope is asked for.
+    """
+    if not counters_enabled():
+        return aggregate_stats(scope_queryset(scope))
+    return fill_counter_rows(TicketCounter, 'scope', [scope], STAT_BUCKETS, live_scope_stats)[scope]
+
+
+async def aticket_stats(scope):
+    """ticket_stats() on the async ORM; a missing row is filled in a thread"""
+    if not counters_enabled():
+        return await scope_queryset(scope).aaggregate(**bucket_aggregates())
+
+    row = await TicketCounter.objects.filter(scope=scope).values(*STAT_BUCKETS).afirst()
+    if row is None:
+        row = await sync_to_async(ticket_stats)(scope)
+    return row
+
+
+def counter_deltas(changes):
+    """Per-scope bucket deltas for a list of (before, after) TicketStates
+
+    `before` is None for a created ticket and `after` is None for a
+    deleted one.
+    """
+    deltas = defaultdict(Counter)
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            for name, (_, applies) in STAT_BUCKETS.items():
+                if applies(state):
+                    deltas[TicketCounter.GLOBAL_SCOPE][name] += sign
+                    deltas[state.customer_id][name] += sign
+    return deltas
+
+
+def apply_counter_changes(changes):
+    """Fold ticket changes into the counter rows with one UPDATE per scope
+
+    Scopes without a row yet are left alone; ticket_stats() fills them
+    from the live aggregate while ticket writes are held, so the row
+    includes every change committed before it.
+    """
+    for scope, delta in counter_deltas(changes).items():
+        updates = {name: F(name) + amount for name, amount in delta.items() if amount}
+        if updates:
+            TicketCounter.objects.filter(scope=scope).update(**updates)
+
+
+def live_counters():
+    """Aggregate every scope from the tickets table in one grouped query"""
+    counters = {}
+    totals = Counter()
+    rows = Ticket.objects.order_by().values('customer_id').annotate(**bucket_aggregates())
+    for row in rows:
+        scope = row.pop('customer_id')
+        counters[scope] = row
+        totals.update(row)
+    counters[TicketCounter.GLOBAL_SCOPE] = {name: totals[name] for name in STAT_BUCKETS}
+    return counters
+
+
+def rebuild_counters():
+    """Replace every counter row with the live aggregate
+
+    Returns:
+        int -- Number of counter rows written
+    """
+    with transaction.atomic():
+        hold_ticket_writes(TicketCounter.objects.db)
+        counters = live_counters()
+        TicketCounter.objects.all().delete()
+        TicketCounter.objects.bulk_create(
+            TicketCounter(scope=scope, **values) for scope, values in counters.items())
+    return len(counters)
+
+
+def verify_counters():
+    """Compare stored counter rows with the live aggregate
+
+    Returns:
+        dict -- scope -> (stored, live) for every scope that disagrees
+    """
+    live = live_counters()
+    stored = {row.pop('scope'): row for row in TicketCounter.objects.values('scope', *STAT_BUCKETS)}
+    empty = {name: 0 for name in STAT_BUCKETS}
+    mismatches = {}
+    for scope in set(live) | set(stored):
+        expected = live.get(scope, empty)
+        actual = stored.get(scope)
+        # Scopes are filled lazily, so a missing row is not drift
+        if actual is not None and actual != expected:
+            mismatches[scope] = (actual, expected)
+    return mismatches
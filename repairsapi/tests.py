@@ -1,3 +1,1741 @@
-from django.test import TestCase
+import csv
+import datetime
+import gc
+import gzip
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+from types import SimpleNamespace
+from unittest import skipIf, skipUnless
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from io import StringIO
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import include, path
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from honeyrae import gunicorn_wsgi
+from honeyrae.urls import router
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from repairsapi.fast_serializers import fast_serializer
+from repairsapi.authentication import PrincipalCache, PrincipalData, principal_cache
+from repairsapi.events import event_broker
+from repairsapi.export import EXPORT_COLUMNS
+from repairsapi.hashing import HashingPool, hashing_pool
+from repairsapi.metrics import registry
+from repairsapi.jobs import claim_jobs, enqueue, job
+from repairsapi.models import (Customer, Employee, EmployeeWorkload, Job, StaleTicket, Ticket, TicketCounter,
+                               TicketEvent, TicketRollup, tickets_changed)
+from repairsapi.projection import parse_selection, projected_serializer
+from repairsapi.reports import live_report, rollup_report, verify_rollups
+from repairsapi.response_cache import response_cache
+from repairsapi.stats import STAT_BUCKETS, aggregate_stats, fill_counter_rows, live_scope_stats, verify_counters
+from repairsapi.views import async_urls
+from repairsapi.views.customer_view import CustomerSerializer
+from repairsapi.views.employee_view import EmployeeSerializer
+from repairsapi.views.ticket_view import TicketSerializer, TicketView
+from repairsapi.workload import live_workloads, verify_workloads
 
-# Create your tests here.
+
+# URLconf with the async read routes, as served when ASYNC_VIEWS is on
+urlpatterns = [path('', include(async_urls(router.urls)))]
+
+
+def make_customer(username, address='1 Main St'):
+    user = User.objects.create_user(username=username, first_name='Cus', last_name=username)
+    return Customer.objects.create(user=user, address=address)
+
+
+def make_employee(username, specialty='Phones'):
+    user = User.objects.create_user(username=username, first_name='Emp', last_name=username,
+                                    is_staff=True)
+    return Employee.objects.create(user=user, specialty=specialty)
+
+
+def authenticated_client(user):
+    client = APIClient()
+    token, _ = Token.objects.get_or_create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+class QueryPlanTests(TestCase):
+    """List endpoints issue the same number of queries for any row count"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.customer_client = authenticated_client(self.customer.user)
+
+    def add_tickets(self, count):
+        for index in range(count):
+            customer = make_customer(f'customer{Customer.objects.count()}')
+            employee = make_employee(f'employee{Employee.objects.count()}')
+            Ticket.objects.create(customer=customer, employee=employee if index % 2 else None,
+                                  description=f'Broken thing {index}')
+            Ticket.objects.create(customer=self.customer, description=f'Mine {index}')
+
+    def assert_constant_queries(self, client, url):
+        # Authenticate once so the token principal is cached; the other
+        # query reads the ETag version stamp
+        client.get(url)
+        self.add_tickets(1)
+        with self.assertNumQueries(2):
+            small = client.get(url)
+        self.add_tickets(10)
+        with self.assertNumQueries(2):
+            large = client.get(url)
+        self.assertEqual(small.status_code, 200)
+        self.assertGreater(len(large.json()), len(small.json()))
+
+    def test_staff_ticket_list(self):
+        self.assert_constant_queries(self.staff_client, '/tickets')
+
+    def test_customer_ticket_list(self):
+        self.assert_constant_queries(self.customer_client, '/tickets')
+
+    def test_customer_and_employee_lists(self):
+        self.assert_constant_queries(self.staff_client, '/customers')
+        self.assert_constant_queries(self.staff_client, '/employees')
+
+    def test_ticket_retrieve_joins_customer_and_employee(self):
+        self.add_tickets(2)
+        ticket = Ticket.objects.filter(employee__isnull=False).first()
+        # Token, version stamp, and the ticket with its customer and employee
+        with self.assertNumQueries(3):
+            response = self.staff_client.get(f'/tickets/{ticket.id}')
+        self.assertEqual(response.json()['employee']['full_name'], ticket.employee.full_name)
+
+    def test_planned_output_matches_unplanned(self):
+        self.add_tickets(3)
+        unplanned = [TicketSerializer(ticket).data for ticket in Ticket.objects.all()]
+        planned = TicketSerializer(Ticket.objects.all(), many=True).data
+        self.assertEqual(unplanned, planned)
+
+
+class PaginationTests(TestCase):
+    """Keyset pagination and NDJSON streaming on list endpoints"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.client = authenticated_client(self.employee.user)
+        for index in range(7):
+            Ticket.objects.create(customer=self.customer, description=f'Ticket {index}')
+
+    def test_cursor_pages_cover_every_ticket_once(self):
+        seen = []
+        url = '/tickets?page_size=3'
+        while url:
+            body = self.client.get(url).json()
+            self.assertLessEqual(len(body['results']), 3)
+            seen.extend(ticket['id'] for ticket in body['results'])
+            url = body['next']
+        expected = list(Ticket.objects.order_by('-date_created', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_unpaginated_list_is_unchanged(self):
+        self.assertEqual(len(self.client.get('/tickets').json()), 7)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/tickets?cursor=nope').status_code, 404)
+
+    def test_ndjson_stream(self):
+        response = self.client.get('/customers?stream=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines],
+                         list(Customer.objects.order_by('id').values_list('id', flat=True)))
+
+
+class TicketStatsTests(TestCase):
+    """Dashboard statistics from the aggregate query and the counter table"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.other = make_customer('other')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.customer_client = authenticated_client(self.customer.user)
+        Ticket.objects.create(customer=self.customer, description='a', priority='urgent')
+        Ticket.objects.create(customer=self.customer, description='b', employee=self.employee,
+                              emergency=True)
+        Ticket.objects.create(customer=self.other, description='c', priority='high',
+                              date_completed='2024-01-02')
+
+    def shuffle_tickets(self):
+        ticket = Ticket.objects.get(description='a')
+        ticket.employee = self.employee
+        ticket.save()
+        ticket = Ticket.objects.get(description='b')
+        ticket.date_completed = '2024-02-01'
+        ticket.save()
+        Ticket.objects.get(description='c').delete()
+        Ticket.objects.create(customer=self.other, description='d', priority='high')
+
+    def test_stats_is_one_query(self):
+        with self.assertNumQueries(3):
+            response = self.customer_client.get('/tickets/stats')
+        self.assertEqual(response.json(), {
+            'total': 2, 'open': 1, 'in_progress': 1, 'completed': 0,
+            'urgent': 1, 'high_priority': 0, 'emergency': 1,
+        })
+
+    @override_settings(TICKET_COUNTERS=True)
+    def test_counters_follow_writes(self):
+        call_command('ticket_counters', 'rebuild', stdout=StringIO())
+        self.shuffle_tickets()
+        self.assertEqual(verify_counters(), {})
+        with self.assertNumQueries(3):
+            response = self.staff_client.get('/tickets/stats')
+        self.assertEqual(response.json(), aggregate_stats(Ticket.objects.all()))
+
+    @override_settings(TICKET_COUNTERS=True)
+    def test_missing_scope_is_filled_lazily(self):
+        self.customer_client.get('/tickets/stats')
+        self.shuffle_tickets()
+        counters = TicketCounter.objects.values(*STAT_BUCKETS).get(scope=self.customer.id)
+        self.assertEqual(counters, aggregate_stats(Ticket.objects.filter(customer=self.customer)))
+
+    def test_fill_only_aggregates_missing_rows(self):
+        TicketCounter.objects.create(scope=self.customer.id, total=7)
+        asked = []
+
+        def live(scopes):
+            asked.extend(scopes)
+            return live_scope_stats(scopes)
+
+        rows = fill_counter_rows(TicketCounter, 'scope', [self.customer.id, self.other.id], STAT_BUCKETS, live)
+        self.assertEqual(asked, [self.other.id])
+        self.assertEqual(rows[self.customer.id]['total'], 7)
+        self.assertEqual(TicketCounter.objects.values(*STAT_BUCKETS).get(scope=self.other.id), rows[self.other.id])
+
+    @override_settings(TICKET_COUNTERS=True)
+    def test_verify_reports_drift(self):
+        call_command('ticket_counters', 'rebuild', stdout=StringIO())
+        TicketCounter.objects.filter(scope=self.customer.id).update(urgent=5)
+        with self.assertRaises(CommandError):
+            call_command('ticket_counters', 'verify', stdout=StringIO())
+
+
+class TicketStatusTests(TestCase):
+    """The stored status column follows date_completed and employee"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.ticket = Ticket.objects.create(customer=self.customer, description='a')
+
+    def stored_status(self):
+        return Ticket.objects.values_list('status', flat=True).get(pk=self.ticket.pk)
+
+    def test_save(self):
+        self.assertEqual(self.stored_status(), Ticket.STATUS_OPEN)
+        self.ticket.employee = self.employee
+        self.ticket.save(update_fields=['employee'])
+        self.assertEqual(self.stored_status(), Ticket.STATUS_IN_PROGRESS)
+        self.ticket.date_completed = '2024-01-01'
+        self.ticket.save()
+        self.assertEqual(self.stored_status(), Ticket.STATUS_COMPLETED)
+
+    def test_queryset_update(self):
+        tickets = Ticket.objects.filter(pk=self.ticket.pk)
+        tickets.update(employee=self.employee)
+        self.assertEqual(self.stored_status(), Ticket.STATUS_IN_PROGRESS)
+        tickets.update(date_completed='2024-01-01', employee=None)
+        self.assertEqual(self.stored_status(), Ticket.STATUS_COMPLETED)
+        tickets.update(date_completed=None)
+        self.assertEqual(self.stored_status(), Ticket.STATUS_OPEN)
+
+    def test_update_works_out_new_states_without_reading_back(self):
+        sent = []
+
+        def record(sender, changes, **kwargs):
+            sent.extend(changes)
+
+        tickets_changed.connect(record)
+        try:
+            tickets = Ticket.objects.filter(pk=self.ticket.pk)
+            with CaptureQueriesContext(connection) as queries:
+                tickets.update(employee=self.employee, date_completed='2024-01-02')
+                tickets.update(date_completed=None)
+                tickets.update(priority=F('priority'))
+        finally:
+            tickets_changed.disconnect(record)
+        snapshot = 'SELECT "repairsapi_ticket"."id" AS "id", "repairsapi_ticket"."customer_id"'
+        # One snapshot before each update, and a read back after the F() one
+        self.assertEqual(sum(query['sql'].startswith(snapshot) for query in queries), 4)
+        self.assertEqual([(after.status, after.employee_id, after.date_completed) for _, after in sent[:2]],
+                         [(Ticket.STATUS_COMPLETED, self.employee.id, datetime.date(2024, 1, 2)),
+                          (Ticket.STATUS_IN_PROGRESS, self.employee.id, None)])
+        self.assertEqual(sent[2], (sent[1][1], sent[1][1]))
+
+    def test_bulk_paths(self):
+        created = Ticket.objects.bulk_create([
+            Ticket(customer=self.customer, description='b', employee=self.employee)])
+        self.assertEqual(Ticket.objects.get(pk=created[0].pk).status, Ticket.STATUS_IN_PROGRESS)
+        self.ticket.date_completed = '2024-01-01'
+        Ticket.objects.bulk_update([self.ticket], ['date_completed'])
+        self.assertEqual(self.stored_status(), Ticket.STATUS_COMPLETED)
+
+    def test_status_filter(self):
+        client = authenticated_client(self.employee.user)
+        Ticket.objects.create(customer=self.customer, description='b', employee=self.employee)
+        body = client.get('/tickets?status=in-progress').json()
+        self.assertEqual([ticket['description'] for ticket in body], ['b'])
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Token principals are cached and dropped when the account changes"""
+
+    def setUp(self):
+        principal_cache().clear()
+        self.customer = make_customer('owner')
+        self.client = authenticated_client(self.customer.user)
+
+    def test_token_is_looked_up_once(self):
+        with self.assertNumQueries(3):
+            self.client.get('/tickets/stats')
+        with self.assertNumQueries(2):
+            self.client.get('/tickets/stats')
+
+    def test_principal_exposes_account_ids(self):
+        data = principal_cache().get(self.customer.user.auth_token.key)
+        self.assertIsNone(data)
+        self.client.get('/tickets')
+        data = principal_cache().get(self.customer.user.auth_token.key)
+        self.assertEqual((data.customer_id, data.employee_id), (self.customer.id, None))
+
+    def test_user_change_invalidates(self):
+        self.client.get('/tickets')
+        user = self.customer.user
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get('/tickets').status_code, 401)
+
+    def test_token_delete_invalidates(self):
+        self.client.get('/tickets')
+        Token.objects.filter(user=self.customer.user).delete()
+        self.assertEqual(self.client.get('/tickets').status_code, 401)
+
+    def test_lru_and_ttl_bounds(self):
+        cache = PrincipalCache(max_entries=2, ttl=60)
+        for user_id in range(3):
+            cache.set(f'key{user_id}', PrincipalData(user_id, 'u', False, None, None))
+        self.assertIsNone(cache.get('key0'))
+        self.assertIsNotNone(cache.get('key2'))
+        expired = PrincipalCache(max_entries=2, ttl=-1)
+        expired.set('key', PrincipalData(1, 'u', False, None, None))
+        self.assertIsNone(expired.get('key'))
+
+    def test_other_workers_see_invalidation_once_local_copy_expires(self):
+        writer = PrincipalCache(max_entries=10, ttl=60, shared_cache='default', shared_ttl=60)
+        other = PrincipalCache(max_entries=10, ttl=-1, shared_cache='default', shared_ttl=60)
+        writer.set('key', PrincipalData(1, 'u', True, None, None))
+        self.assertTrue(other.get('key').is_staff)
+        writer.invalidate('key')
+        self.assertIsNone(other.get('key'))
+
+    def test_invalidation_during_a_load_wins(self):
+        reader = PrincipalCache(max_entries=10, ttl=60, shared_cache='default', shared_ttl=60)
+        other = PrincipalCache(max_entries=10, ttl=60, shared_cache='default', shared_ttl=60)
+        staff = PrincipalData(1, 'u', True, None, None)
+        data, stamp = reader.lookup('key')
+        self.assertIsNone(data)
+        # The staff flag is revoked by another worker, then the load finishes
+        other.invalidate('key')
+        reader.set('key', staff, stamp)
+        self.assertIsNone(other.get('key'))
+
+        # And by this worker
+        data, stamp = reader.lookup('another-key')
+        reader.invalidate('another-key')
+        reader.set('another-key', staff, stamp)
+        self.assertIsNone(reader.get('another-key'))
+
+    def test_invalidation_is_repeated_on_commit(self):
+        cache = PrincipalCache(max_entries=10, ttl=60, shared_cache='default', shared_ttl=60)
+        with self.captureOnCommitCallbacks() as callbacks:
+            cache.invalidate('key')
+            # Loaded from the rows the uncommitted write hasn't replaced yet
+            cache.set('key', PrincipalData(1, 'u', True, None, None))
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(PrincipalCache(max_entries=10, ttl=60, shared_cache='default').get('key'))
+        self.assertIsNone(cache.get('key'))
+
+
+class BulkTicketTests(TestCase):
+    """POST /tickets/bulk validates everything, then applies it in one go"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.tickets = Ticket.objects.bulk_create(
+            [Ticket(customer=self.customer, description=f'Ticket {i}') for i in range(20)])
+
+    def test_batch_applies_in_few_queries(self):
+        operations = [{'op': 'assign', 'id': ticket.id, 'employee': self.employee.id}
+                      for ticket in self.tickets[:15]]
+        operations += [{'op': 'complete', 'id': ticket.id, 'date_completed': '2024-03-01'}
+                       for ticket in self.tickets[:5]]
+        operations += [{'op': 'delete', 'id': ticket.id} for ticket in self.tickets[15:]]
+        operations += [{'op': 'create', 'customer': self.customer.id, 'description': 'New'}]
+        self.staff_client.get('/tickets/stats')
+
+        # One workload UPDATE per employee touched (and the unassigned row),
+        # one rollup UPDATE per day and priority (plus an INSERT and a retry
+        # for the completion day, which has no row yet)
+        with self.assertNumQueries(17):
+            response = self.staff_client.post('/tickets/bulk', operations, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('error', str(response.json()))
+        self.assertEqual(Ticket.objects.filter(status=Ticket.STATUS_IN_PROGRESS).count(), 10)
+        self.assertEqual(Ticket.objects.filter(status=Ticket.STATUS_COMPLETED).count(), 5)
+        self.assertEqual(Ticket.objects.count(), 16)
+
+    def test_invalid_batch_writes_nothing(self):
+        response = self.staff_client.post('/tickets/bulk', {'operations': [
+            {'op': 'assign', 'id': self.tickets[0].id, 'employee': self.employee.id},
+            {'op': 'assign', 'id': self.tickets[1].id, 'employee': 9999},
+            {'op': 'explode'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = [result.get('error') for result in response.json()['results']]
+        self.assertEqual(errors[0], None)
+        self.assertEqual(errors[1], 'Employee not found')
+        self.assertFalse(Ticket.objects.filter(employee__isnull=False).exists())
+
+    def test_customers_can_only_create(self):
+        client = authenticated_client(self.customer.user)
+        response = client.post('/tickets/bulk', [
+            {'op': 'create', 'description': 'Mine'},
+            {'op': 'delete', 'id': self.tickets[0].id},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post('/tickets/bulk', [{'op': 'create', 'description': 'Mine'}], format='json')
+        created = Ticket.objects.get(pk=response.json()['results'][0]['id'])
+        self.assertEqual(created.customer_id, self.customer.id)
+
+    def test_emergency_must_be_a_boolean(self):
+        operations = [{'op': 'create', 'customer': self.customer.id, 'description': name, 'emergency': value}
+                      for name, value in [('a', 'false'), ('b', '0'), ('c', True), ('d', 'later')]]
+        response = self.staff_client.post('/tickets/bulk', operations, format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = [result.get('error') for result in response.json()['results']]
+        self.assertEqual(errors, [None, None, None, 'emergency must be true or false'])
+
+        response = self.staff_client.post('/tickets/bulk', operations[:3], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict(Ticket.objects.filter(description__in='abc').values_list('description', 'emergency')),
+                         {'a': False, 'b': False, 'c': True})
+
+    @override_settings(TICKET_COUNTERS=True)
+    def test_counters_follow_bulk_writes(self):
+        call_command('ticket_counters', 'rebuild', stdout=StringIO())
+        self.staff_client.post('/tickets/bulk', [
+            {'op': 'assign', 'id': self.tickets[0].id, 'employee': self.employee.id},
+            {'op': 'complete', 'id': self.tickets[1].id},
+            {'op': 'delete', 'id': self.tickets[2].id},
+            {'op': 'create', 'customer': self.customer.id, 'description': 'New', 'priority': 'urgent'},
+        ], format='json')
+        self.assertEqual(verify_counters(), {})
+
+
+class ConditionalGetTests(TestCase):
+    """GET responses carry validators and answer 304 when nothing changed"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.ticket = Ticket.objects.create(customer=self.customer, employee=self.employee,
+                                            description='Broken screen')
+
+    def revalidate(self, client, path):
+        first = client.get(path)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+        return first['ETag'], client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_list_is_not_modified(self):
+        etag, _ = self.revalidate(self.staff_client, '/tickets')
+        with self.assertNumQueries(1):
+            response = self.staff_client.get('/tickets', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_every_get_endpoint_revalidates(self):
+        for path in (f'/tickets/{self.ticket.id}', '/tickets/stats', '/customers',
+                     f'/customers/{self.customer.id}', '/employees',
+                     f'/employees/{self.employee.id}'):
+            with self.subTest(path=path):
+                self.assertEqual(self.revalidate(self.staff_client, path)[1].status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        etag, _ = self.revalidate(self.staff_client, '/tickets')
+        self.ticket.date_completed = '2024-01-02'
+        self.ticket.save()
+        response = self.staff_client.get('/tickets', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_delete_changes_the_etag(self):
+        Ticket.objects.create(customer=self.customer, description='Spare')
+        etag, _ = self.revalidate(self.staff_client, '/tickets')
+        Ticket.objects.filter(description='Spare').delete()
+        self.assertEqual(self.staff_client.get('/tickets', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_employee_rename_invalidates_ticket_list(self):
+        etag, _ = self.revalidate(self.staff_client, '/tickets')
+        self.employee.user.first_name = 'Renamed'
+        self.employee.user.save()
+        response = self.staff_client.get('/tickets', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Renamed', response.content.decode())
+
+    def test_scopes_do_not_share_etags(self):
+        staff_etag, _ = self.revalidate(self.staff_client, '/tickets')
+        customer_client = authenticated_client(self.customer.user)
+        response = customer_client.get('/tickets', HTTP_IF_NONE_MATCH=staff_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Authorization', response['Vary'])
+
+
+@override_settings(RESPONSE_CACHE={**settings.RESPONSE_CACHE, 'ENABLED': True})
+class ResponseCacheTests(TestCase):
+    """Ticket lists are served from the response cache until a write"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.ticket = Ticket.objects.create(customer=self.customer, employee=self.employee,
+                                            description='Broken screen', priority='high')
+        self.staff_client.get('/tickets/stats')
+
+    def test_repeat_list_is_a_hit(self):
+        first = self.staff_client.get('/tickets?status=in-progress&priority=high')
+        hits = response_cache().stats()['hits']
+        # Only the ETag version stamp is read; the list comes from the cache
+        with self.assertNumQueries(1):
+            second = self.staff_client.get('/tickets?priority=high&status=in-progress')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(response_cache().stats()['hits'], hits + 1)
+
+    def test_ticket_write_invalidates(self):
+        self.staff_client.get('/tickets')
+        Ticket.objects.create(customer=self.customer, description='Leaky tap')
+        self.assertEqual(len(self.staff_client.get('/tickets').json()), 2)
+        Ticket.objects.filter(description='Leaky tap').update(priority='urgent')
+        priorities = {ticket['priority'] for ticket in self.staff_client.get('/tickets').json()}
+        self.assertIn('urgent', priorities)
+
+    def test_employee_rename_invalidates(self):
+        customer_client = authenticated_client(self.customer.user)
+        customer_client.get('/tickets')
+        self.employee.user.last_name = 'Renamed'
+        self.employee.user.save()
+        ticket = customer_client.get('/tickets').json()[0]
+        self.assertEqual(ticket['employee']['full_name'], 'Emp Renamed')
+
+    def test_scopes_are_separate(self):
+        make_customer('other').submitted_tickets.create(description='Not yours')
+        self.staff_client.get('/tickets')
+        customer_tickets = authenticated_client(self.customer.user).get('/tickets').json()
+        self.assertEqual([ticket['id'] for ticket in customer_tickets], [self.ticket.id])
+
+    @skipIf(settings.API_ONLY, 'The browsable API is off in API-only mode')
+    def test_renderers_have_separate_entries(self):
+        self.staff_client.get('/tickets')
+        response = self.staff_client.get('/tickets', HTTP_ACCEPT='text/html')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertEqual(self.staff_client.get('/tickets?format=json').json()[0]['id'], self.ticket.id)
+
+    def test_cached_pages_link_relative_to_any_host(self):
+        Ticket.objects.create(customer=self.customer, description='Leaky tap')
+        first = self.staff_client.get('/tickets?page_size=1', HTTP_HOST='one.example.com').json()
+        second = self.staff_client.get('/tickets?page_size=1', HTTP_HOST='two.example.com').json()
+        self.assertEqual(second, first)
+        self.assertTrue(first['next'].startswith('/tickets?'))
+
+    def test_cache_stats_is_staff_only(self):
+        self.assertEqual(authenticated_client(self.customer.user).get('/tickets/cache-stats').status_code, 403)
+        response = self.staff_client.get('/tickets/cache-stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['enabled'])
+        self.assertIn('hit_ratio', response.json())
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class AuthEndpointTests(TestCase):
+    """Login and registration hash in the pool and write in one transaction"""
+
+    registration = {
+        'account_type': 'customer', 'username': 'newbie', 'email': 'newbie@example.com',
+        'first_name': 'New', 'last_name': 'Bie', 'password': 'correct horse', 'address': '2 Elm St',
+    }
+
+    def register(self, **changes):
+        return APIClient().post('/register', {**self.registration, **changes}, format='json')
+
+    def login(self, username, password):
+        return APIClient().post('/login', {'username': username, 'password': password},
+                                format='json').json()
+
+    def test_register_then_login(self):
+        with self.assertNumQueries(6):
+            # uniqueness check, then user, customer and token inside a savepoint
+            response = self.register()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.get(username='newbie').password.startswith('pbkdf2_sha256$1000$'))
+        login = self.login('newbie', 'correct horse')
+        self.assertEqual(login, {'valid': True, 'token': response.json()['token'], 'staff': False})
+        self.assertEqual(self.login('newbie', 'wrong'), {'valid': False})
+        self.assertEqual(self.login('nobody', 'correct horse'), {'valid': False})
+
+    def test_duplicate_username_and_email(self):
+        self.register()
+        response = self.register(email='other@example.com')
+        self.assertEqual(response.json()['message'], 'An account with that username already exists')
+        response = self.register(username='other')
+        self.assertEqual(response.json()['message'], 'An account with that email address already exists')
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_employee_registration_is_staff(self):
+        response = self.register(account_type='employee', specialty='Phones')
+        self.assertTrue(response.json()['staff'])
+        self.assertTrue(Employee.objects.get(user__username='newbie').user.is_staff)
+
+    def test_login_upgrades_hash_cost(self):
+        self.register()
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertTrue(self.login('newbie', 'correct horse')['valid'])
+        self.assertTrue(User.objects.get(username='newbie').password.startswith('pbkdf2_sha256$2000$'))
+
+    def test_full_pool_answers_503(self):
+        with self.settings(AUTH_HASHING={'WORKERS': 1, 'QUEUE': 0, 'TIMEOUT': 0.01}):
+            pool = hashing_pool()
+            pool.slots.acquire()
+            try:
+                response = APIClient().post('/login', {'username': 'a', 'password': 'b'}, format='json')
+            finally:
+                pool.slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_pool_runs_work(self):
+        pool = HashingPool(workers=2, queue=0, timeout=1)
+        self.assertEqual(pool.run(sum, [1, 2, 3]), 6)
+        pool.shutdown()
+
+    def test_login_sends_auth_signals(self):
+        self.register()
+        failures = []
+
+        def record_failure(sender, credentials, **kwargs):
+            failures.append(credentials)
+
+        user_login_failed.connect(record_failure)
+        try:
+            self.login('newbie', 'wrong')
+        finally:
+            user_login_failed.disconnect(record_failure)
+        self.assertEqual(failures, [{'username': 'newbie', 'password': '********************'}])
+
+        self.assertTrue(self.login('newbie', 'correct horse')['valid'])
+        self.assertIsNone(User.objects.get(username='newbie').last_login)
+        with override_settings(LOGIN_SIGNAL=True):
+            self.assertTrue(self.login('newbie', 'correct horse')['valid'])
+        self.assertIsNotNone(User.objects.get(username='newbie').last_login)
+
+    def test_threaded_workers_leave_threads_for_other_requests(self):
+        self.assertEqual(gunicorn_wsgi.worker_class, 'gthread')
+        self.assertLess(settings.AUTH_HASHING['WORKERS'] + settings.AUTH_HASHING['QUEUE'], gunicorn_wsgi.threads)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': False, 'ALIAS': 'responses', 'TIMEOUT': 0})
+class AsyncViewTests(TestCase):
+    """The async ViewSets answer reads exactly like the DRF views"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.customer_client = authenticated_client(self.customer.user)
+        self.ticket = Ticket.objects.create(customer=self.customer, employee=self.employee,
+                                            description='Broken screen', emergency=True)
+        Ticket.objects.create(customer=make_customer('other'), description='Not yours')
+
+    def test_reads_match_sync_views(self):
+        paths = ['/tickets', '/tickets?status=in-progress', '/tickets?page_size=1',
+                 f'/tickets/{self.ticket.id}', '/tickets/9999', '/tickets/stats',
+                 '/customers', f'/customers/{self.customer.id}', '/employees',
+                 f'/employees/{self.employee.id}', '/tickets?stream=ndjson']
+        for client in (self.staff_client, self.customer_client):
+            for url in paths:
+                with self.subTest(url=url):
+                    expected = client.get(url)
+                    with self.settings(ROOT_URLCONF='repairsapi.tests'):
+                        actual = client.get(url)
+                    self.assertEqual(actual.status_code, expected.status_code)
+                    self.assertEqual(actual.get('ETag'), expected.get('ETag'))
+                    self.assertEqual(b''.join(actual) if actual.streaming else actual.content,
+                                     b''.join(expected) if expected.streaming else expected.content)
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    def test_writes_go_to_drf_views(self):
+        response = self.customer_client.post('/tickets', {'description': 'Dead pixel'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.staff_client.delete(f'/tickets/{response.json()["id"]}')
+        self.assertEqual(response.status_code, 204)
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    def test_requires_token(self):
+        response = APIClient().get('/tickets')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        response = APIClient().get('/tickets', HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    async def test_async_client(self):
+        headers = {'Authorization': f'Token {await self.staff_token()}'}
+        response = await self.async_client.get('/tickets', headers=headers)
+        self.assertEqual(len(response.json()), 2)
+        response = await self.async_client.get(
+            '/tickets', headers={**headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def staff_token(self):
+        token = await Token.objects.aget(user_id=self.employee.user_id)
+        return token.key
+
+
+class FastSerializerTests(TestCase):
+    """The values_list() fast path writes the same bytes as DRF"""
+
+    def setUp(self):
+        self.employee = make_employee('tech', specialty='Phones "and" tablets')
+        self.employee.user.first_name = 'Zoë'
+        self.employee.user.save()
+        self.customer = make_customer('owner', address='1 Main St\u2028Apt 2')
+        self.staff_client = authenticated_client(self.employee.user)
+        Ticket.objects.create(customer=self.customer, description='Ünïcode ✓ and "quotes"\n',
+                              emergency=True, priority='urgent')
+        Ticket.objects.create(customer=self.customer, employee=self.employee,
+                              description='Assigned', date_completed='2024-02-29')
+        Ticket.objects.create(customer=make_customer('other'), employee=self.employee,
+                              description='Line\u2029separator')
+
+    def test_matches_drf_rendering(self):
+        for serializer_class in (TicketSerializer, CustomerSerializer, EmployeeSerializer):
+            with self.subTest(serializer=serializer_class.__name__):
+                queryset = serializer_class.Meta.model.objects.all()
+                expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+                fast = fast_serializer(serializer_class)
+                self.assertEqual(fast.render_list(fast.values(queryset)[0]), expected)
+
+    def test_endpoints_use_fast_path(self):
+        expected = JSONRenderer().render(TicketSerializer(Ticket.objects.all(), many=True).data)
+        # Token, version stamp, rows
+        with self.assertNumQueries(3):
+            response = self.staff_client.get('/tickets')
+        self.assertEqual(response.content, expected)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        page = self.staff_client.get('/tickets?page_size=2').json()
+        rest = self.staff_client.get(page['next']).json()
+        self.assertEqual(page['results'] + rest['results'], json.loads(expected))
+
+    def test_ndjson_lines_match(self):
+        lines = b''.join(self.staff_client.get('/tickets?stream=ndjson').streaming_content)
+        expected = [TicketSerializer(ticket).data for ticket in Ticket.objects.order_by('-date_created', '-id')]
+        self.assertEqual([json.loads(line) for line in lines.splitlines()], json.loads(json.dumps(expected)))
+
+    @skipIf(settings.API_ONLY, 'API_ONLY turns the browsable API off')
+    def test_browsable_api_still_renders(self):
+        response = self.staff_client.get('/tickets', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<html', response.content)
+
+    def test_unsupported_fields_fall_back(self):
+        class MethodSerializer(serializers.ModelSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Ticket
+                fields = ('id', 'label')
+
+            def get_label(self, ticket):
+                return str(ticket.id)
+
+        self.assertIsNone(fast_serializer(MethodSerializer))
+
+
+class TicketSearchTests(TestCase):
+    """GET /tickets?q= over the full-text index"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.other = make_customer('other')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.broken = Ticket.objects.create(customer=self.customer, description='Broken screen on my phone')
+        self.screens = Ticket.objects.create(customer=self.customer,
+                                             description='Screen flickers, screen goes dark, new screen needed')
+        self.laptop = Ticket.objects.create(customer=self.other, description='Laptop battery will not charge')
+
+    def search(self, client, query):
+        return [ticket['id'] for ticket in client.get('/tickets', {'q': query}).json()['results']]
+
+    def test_ranked_matches(self):
+        self.assertEqual(self.search(self.staff_client, 'screen'), [self.screens.id, self.broken.id])
+        self.assertEqual(self.search(self.staff_client, 'broken screens'), [self.broken.id])
+        # Prefix and stemmed matches
+        self.assertEqual(self.search(self.staff_client, 'batt'), [self.laptop.id])
+        self.assertEqual(self.search(self.staff_client, 'charging'), [self.laptop.id])
+        self.assertEqual(self.search(self.staff_client, '" OR *'), [])
+
+    def test_index_follows_writes(self):
+        self.laptop.description = 'Cracked screen'
+        self.laptop.save()
+        self.broken.delete()
+        Ticket.objects.filter(pk=self.screens.pk).update(description='Keyboard sticks')
+        Ticket.objects.create(customer=self.other, description='Another cracked screen')
+        self.assertEqual(len(self.search(self.staff_client, 'cracked screen')), 2)
+        self.assertEqual(self.search(self.staff_client, 'battery'), [])
+        self.assertEqual(self.search(self.staff_client, 'keyboard'), [self.screens.id])
+
+    def test_customers_search_their_own_tickets(self):
+        client = authenticated_client(self.other.user)
+        self.assertEqual(self.search(client, 'screen'), [])
+        self.assertEqual(self.search(client, 'laptop'), [self.laptop.id])
+
+    def test_pages_follow_rank(self):
+        for index in range(4):
+            Ticket.objects.create(customer=self.customer, description=f'Screen repair {index}')
+        expected = self.search(self.staff_client, 'screen')
+        seen = []
+        url = '/tickets?q=screen&page_size=2'
+        while url:
+            body = self.staff_client.get(url).json()
+            seen.extend(ticket['id'] for ticket in body['results'])
+            url = body['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 6)
+
+
+class RequestMetricsTests(TestCase):
+    """Per-route histograms at /metrics and the slow-request log"""
+
+    def setUp(self):
+        registry.reset()
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        Ticket.objects.create(customer=self.customer, description='Broken screen')
+
+    def metrics(self):
+        response = self.staff_client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_records_each_route(self):
+        body = self.staff_client.get('/tickets').content
+        self.staff_client.get('/tickets/stats')
+        samples = self.metrics()
+        labels = '{route="ticket-list",method="GET"}'
+        self.assertEqual(samples[f'honeyrae_request_duration_seconds_count{labels}'], 1)
+        # Token, version stamp, rows
+        self.assertEqual(samples[f'honeyrae_db_queries_sum{labels}'], 3)
+        self.assertGreater(samples[f'honeyrae_db_duration_seconds_sum{labels}'], 0)
+        self.assertGreater(samples[f'honeyrae_serialization_seconds_sum{labels}'], 0)
+        self.assertEqual(samples[f'honeyrae_response_bytes_sum{labels}'], len(body))
+        self.assertEqual(samples['honeyrae_request_duration_seconds_bucket'
+                                 '{route="ticket-list",method="GET",le="+Inf"}'], 1)
+        self.assertEqual(samples['honeyrae_responses_total{route="ticket-stats",method="GET",status="200"}'], 1)
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    def test_async_views_are_recorded(self):
+        self.staff_client.get('/tickets')
+        with self.settings(ROOT_URLCONF='honeyrae.urls'):
+            samples = self.metrics()
+        self.assertEqual(samples['honeyrae_db_queries_sum{route="ticket-list",method="GET"}'], 3)
+        self.assertGreater(samples['honeyrae_serialization_seconds_sum{route="ticket-list",method="GET"}'], 0)
+
+    def test_staff_only(self):
+        response = authenticated_client(self.customer.user).get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': True, 'SLOW_REQUEST_SECONDS': 0.0})
+    def test_slow_request_log(self):
+        with self.assertLogs('repairsapi.slow_requests', 'WARNING') as logs:
+            self.staff_client.get('/tickets')
+        self.assertIn('GET /tickets (ticket-list)', logs.output[0])
+        self.assertIn('FROM "repairsapi_ticket"', logs.output[0])
+
+
+class GenerateDataTests(TestCase):
+    """manage.py generate_data"""
+
+    def test_generates_consistent_rows(self):
+        call_command('generate_data', customers=20, employees=4, tickets=300, batch_size=64, seed=7,
+                     tokens=True, password='secret-pass', stdout=StringIO())
+        self.assertEqual(Customer.objects.count(), 20)
+        self.assertEqual(Employee.objects.filter(user__is_staff=True).count(), 4)
+        self.assertEqual(Token.objects.count(), 24)
+        self.assertEqual(Ticket.objects.count(), 300)
+        statuses = set(Ticket.objects.values_list('status', flat=True))
+        self.assertEqual(statuses, {Ticket.STATUS_OPEN, Ticket.STATUS_IN_PROGRESS, Ticket.STATUS_COMPLETED})
+        self.assertFalse(Ticket.objects.filter(status=Ticket.STATUS_OPEN, employee__isnull=False).exists())
+        self.assertFalse(Ticket.objects.filter(date_completed__isnull=False).exclude(
+            status=Ticket.STATUS_COMPLETED).exists())
+        self.assertTrue(Customer.objects.first().user.check_password('secret-pass'))
+
+    def test_runs_twice(self):
+        for _ in range(2):
+            call_command('generate_data', customers=3, employees=1, tickets=10, seed=1, stdout=StringIO())
+        self.assertEqual(Customer.objects.count(), 6)
+
+
+class DatabaseTuningTests(TestCase):
+    """Connection settings from SQLITE_PRAGMAS and DATABASES"""
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_pragmas(self):
+        connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+        self.assertEqual(connection.settings_dict['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_pragmas_are_not_counted_as_queries(self):
+        connection.close()
+        with self.assertNumQueries(1):
+            Ticket.objects.count()
+
+
+def server_sent_events(response):
+    """(event, id, data) for each message of a text/event-stream response"""
+    messages = []
+    for block in b''.join(response).decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'id' in fields or 'event' in fields:
+            messages.append((fields.get('event'), fields.get('id'), json.loads(fields.get('data', 'null'))))
+    return messages
+
+
+@override_settings(EVENT_FEED={**settings.EVENT_FEED, 'ENABLED': True,
+                               'BROKER': 'repairsapi.events.MemoryBroker'})
+class TicketEventFeedTests(TestCase):
+    """GET /tickets/events streams ticket changes to staff and owners"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.other = make_customer('other')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.customer_client = authenticated_client(self.customer.user)
+
+    def feed(self, client, last_event_id=None, url='/tickets/events?timeout=0'):
+        headers = {} if last_event_id is None else {'HTTP_LAST_EVENT_ID': last_event_id}
+        response = client.get(url, HTTP_ACCEPT='text/event-stream', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return server_sent_events(response)
+
+    def change_tickets(self):
+        ticket = self.customer_client.post('/tickets', {'description': 'Cracked screen'}, format='json').json()
+        self.staff_client.put(f'/tickets/{ticket["id"]}', {'employee': self.employee.id}, format='json')
+        self.staff_client.put(f'/tickets/{ticket["id"]}', {'employee': self.employee.id, 'priority': 'high'},
+                              format='json')
+        self.staff_client.put(f'/tickets/{ticket["id"]}', {
+            'employee': self.employee.id, 'date_completed': '2024-01-02'}, format='json')
+        Ticket.objects.create(customer=self.other, description='Not yours')
+        self.staff_client.delete(f'/tickets/{ticket["id"]}')
+        return ticket['id']
+
+    def follow(self, client):
+        """Events of change_tickets() as seen by client, resuming from a fresh stream's id"""
+        (_, start, _), = self.feed(client)
+        with self.captureOnCommitCallbacks(execute=True):
+            ticket_id = self.change_tickets()
+        return ticket_id, self.feed(client, start)
+
+    def test_staff_see_every_change(self):
+        ticket_id, events = self.follow(self.staff_client)
+        self.assertEqual([event for event, _, _ in events][1:], [
+            'ticket.created', 'ticket.assigned', 'ticket.updated', 'ticket.completed', 'ticket.created',
+            'ticket.deleted'])
+        _, first_id, created = events[1]
+        self.assertEqual(created['id'], first_id)
+        self.assertEqual((created['ticket'], created['customer'], created['status']),
+                         (ticket_id, self.customer.id, Ticket.STATUS_OPEN))
+        self.assertEqual(events[4][2]['date_completed'], '2024-01-02')
+
+        # Resuming from the last event has nothing new
+        self.assertEqual(self.feed(self.staff_client, events[-1][1]), [(None, events[-1][1], None)])
+
+    def test_customers_see_their_own_tickets(self):
+        ticket_id, events = self.follow(self.customer_client)
+        self.assertEqual([event for event, _, _ in events][1:], [
+            'ticket.created', 'ticket.assigned', 'ticket.updated', 'ticket.completed', 'ticket.deleted'])
+        self.assertEqual({data['ticket'] for _, _, data in events[1:]}, {ticket_id})
+
+    def test_unknown_event_id_asks_for_resync(self):
+        events = self.feed(self.staff_client, 'gone-12')
+        self.assertEqual(events[0][0], 'resync')
+        self.assertEqual(self.feed(self.staff_client, last_event_id=events[1][1]), [(None, events[1][1], None)])
+
+    def test_rolled_back_changes_are_not_sent(self):
+        (_, start, _), = self.feed(self.staff_client)
+        with self.captureOnCommitCallbacks(execute=False):
+            Ticket.objects.create(customer=self.customer, description='Never committed')
+        self.assertEqual(self.feed(self.staff_client, start), [(None, start, None)])
+
+    @override_settings(EVENT_FEED={**settings.EVENT_FEED, 'ENABLED': True,
+                                   'BROKER': 'repairsapi.events.OutboxBroker'})
+    def test_outbox_broker(self):
+        (_, start, _), = self.feed(self.customer_client)
+        self.change_tickets()
+        self.assertEqual(TicketEvent.objects.count(), 6)
+        events = self.feed(self.customer_client, url=f'/tickets/events?timeout=0&last_event_id={start}')
+        self.assertEqual([event for event, _, _ in events][1:], [
+            'ticket.created', 'ticket.assigned', 'ticket.updated', 'ticket.completed', 'ticket.deleted'])
+        self.assertEqual(self.feed(self.customer_client, str(TicketEvent.objects.first().id - 2))[0][0], 'resync')
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    def test_async_route(self):
+        (_, start, _), = self.feed(self.staff_client)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.create(customer=self.customer, description='Async')
+        events = self.feed(self.staff_client, start)
+        self.assertEqual([event for event, _, _ in events], [None, 'ticket.created'])
+
+    def test_requires_token(self):
+        response = APIClient().get('/tickets/events', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 401)
+
+    def test_sync_streams_close_before_the_worker_timeout(self):
+        feed = TicketView().event_feed(SimpleNamespace(
+            auth=SimpleNamespace(user=self.employee.user), headers={}, query_params={'timeout': '300'}),
+            settings.EVENT_FEED['SYNC_MAX_STREAM_SECONDS'])
+        self.assertLess(feed.seconds, gunicorn_wsgi.timeout)
+
+    def test_memory_broker_refuses_several_workers(self):
+        with override_settings(EVENT_FEED={**settings.EVENT_FEED, 'ENABLED': True, 'WORKERS': 2,
+                                           'BROKER': 'repairsapi.events.MemoryBroker'}):
+            with self.assertRaises(ImproperlyConfigured):
+                event_broker()
+
+    @override_settings(EVENT_FEED={**settings.EVENT_FEED, 'ENABLED': False})
+    def test_turned_off(self):
+        response = self.staff_client.get('/tickets/events')
+        self.assertEqual(response.status_code, 404)
+
+
+# Raises until a test clears `failures`
+flaky_job_failures = []
+
+
+@job('test_flaky')
+def run_flaky_job(note):
+    if flaky_job_failures:
+        raise RuntimeError(flaky_job_failures.pop())
+
+
+@override_settings(JOBS={**settings.JOBS, 'ENABLED': True})
+class BackgroundJobTests(TestCase):
+    """Writes queue jobs in their transaction and run_jobs works through them"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.customer.user.email = 'owner@example.com'
+        self.customer.user.save()
+        self.staff_client = authenticated_client(self.employee.user)
+
+    def run_jobs(self):
+        call_command('run_jobs', '--once', stdout=StringIO())
+
+    def test_registration_sends_welcome_email(self):
+        response = APIClient().post('/register', {
+            'account_type': 'customer', 'username': 'newbie', 'email': 'newbie@example.com',
+            'first_name': 'New', 'last_name': 'Bie', 'password': 'secret', 'address': '2 Elm St'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Job.objects.values_list('kind', flat=True)), ['welcome_email'])
+        self.assertEqual(mail.outbox, [])
+
+        self.run_jobs()
+        self.assertEqual(mail.outbox[0].to, ['newbie@example.com'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_ticket_assignment_and_completion_notify_customer(self):
+        ticket = Ticket.objects.create(customer=self.customer, description='Cracked screen')
+        self.assertFalse(Job.objects.exists())
+        self.staff_client.put(f'/tickets/{ticket.id}', {'employee': self.employee.id}, format='json')
+        self.staff_client.put(f'/tickets/{ticket.id}', {
+            'employee': self.employee.id, 'date_completed': '2024-01-02'}, format='json')
+        self.assertEqual(Job.objects.count(), 2)
+
+        self.run_jobs()
+        self.assertEqual([message.subject for message in mail.outbox],
+                         [f'Ticket #{ticket.id} was assigned', f'Ticket #{ticket.id} is complete'])
+        self.assertIn('Emp tech is on it', mail.outbox[0].body)
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        flaky_job_failures[:] = ['printer on fire']
+        queued = enqueue('test_flaky', note='hi')
+        with self.assertLogs('repairsapi.jobs', 'WARNING'):
+            self.run_jobs()
+        queued.refresh_from_db()
+        self.assertEqual(queued.attempts, 1)
+        self.assertIn('printer on fire', queued.last_error)
+        self.assertGreater(queued.run_after, timezone.now())
+        self.assertIsNone(queued.claimed_by)
+
+        # Not due yet
+        self.run_jobs()
+        self.assertTrue(Job.objects.filter(pk=queued.pk).exists())
+
+        Job.objects.update(run_after=timezone.now())
+        self.run_jobs()
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOBS={**settings.JOBS, 'ENABLED': True, 'MAX_ATTEMPTS': 1})
+    def test_jobs_fail_after_max_attempts(self):
+        flaky_job_failures[:] = ['one', 'two']
+        queued = enqueue('test_flaky', note='hi')
+        with self.assertLogs('repairsapi.jobs', 'ERROR'):
+            self.run_jobs()
+        queued.refresh_from_db()
+        self.assertIsNotNone(queued.failed_at)
+        flaky_job_failures.clear()
+
+        samples = self.staff_client.get('/metrics').content.decode()
+        self.assertIn('honeyrae_jobs_failed 1\n', samples)
+        self.assertIn('honeyrae_jobs_pending 0\n', samples)
+
+    def test_claims_skip_leased_jobs(self):
+        first, second = enqueue('test_flaky', note='a'), enqueue('test_flaky', note='b')
+        self.assertEqual(claim_jobs('one', 1, 60), [first])
+        self.assertEqual(claim_jobs('two', 10, 60), [second])
+        self.assertEqual(claim_jobs('three', 10, 60), [])
+
+        # An expired lease frees the job for another worker
+        Job.objects.filter(pk=first.pk).update(claimed_until=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(claim_jobs('three', 10, 60), [first])
+
+    @override_settings(JOBS={**settings.JOBS, 'ENABLED': False})
+    def test_disabled(self):
+        self.assertIsNone(enqueue('test_flaky', note='hi'))
+        self.assertFalse(Job.objects.exists())
+
+
+class FieldProjectionTests(TestCase):
+    """?fields= and ?expand= narrow ticket responses and their queries"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.ticket = Ticket.objects.create(customer=self.customer, employee=self.employee,
+                                            description='Broken screen', priority='high')
+        Ticket.objects.create(customer=self.customer, description='Unassigned')
+        # Cache the token principal
+        self.staff_client.get('/tickets/stats')
+
+    def rows_query(self, url):
+        """The response and the SQL that read its rows"""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.staff_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, captured.captured_queries[-1]['sql']
+
+    def test_board_fields_read_no_joins(self):
+        response, sql = self.rows_query('/tickets?fields=id,status,priority,description')
+        self.assertEqual(response.json()[-1], {
+            'id': self.ticket.id, 'description': 'Broken screen', 'priority': 'high', 'status': 'in_progress'})
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('date_completed', sql)
+
+    def test_relations_collapse_to_ids_unless_expanded(self):
+        response, sql = self.rows_query('/tickets?fields=id,customer,employee&expand=')
+        self.assertEqual(response.json()[-1], {'id': self.ticket.id, 'employee': self.employee.id,
+                                               'customer': self.customer.id})
+        self.assertEqual(response.json()[0]['employee'], None)
+        self.assertNotIn('JOIN', sql)
+
+        response, sql = self.rows_query('/tickets?fields=id,customer,employee&expand=employee')
+        self.assertEqual(response.json()[-1]['employee']['full_name'], 'Emp tech')
+        self.assertEqual(response.json()[-1]['customer'], self.customer.id)
+        self.assertNotIn('repairsapi_customer', sql)
+
+    def test_nested_fields(self):
+        response = self.staff_client.get(f'/tickets/{self.ticket.id}?fields=id,customer.full_name')
+        self.assertEqual(response.json(), {'id': self.ticket.id, 'customer': {'full_name': 'Cus owner'}})
+
+    def test_default_shape_is_unchanged(self):
+        self.assertEqual(self.staff_client.get('/tickets?fields=&page_size=5').json()['results'],
+                         self.staff_client.get('/tickets?page_size=5').json()['results'])
+
+    def test_fast_path_matches_drf(self):
+        for fields, expand in [('id,status,customer', ''), ('id,employee.specialty', None), (None, 'customer')]:
+            with self.subTest(fields=fields, expand=expand):
+                serializer_class = projected_serializer(
+                    TicketSerializer, *parse_selection(TicketSerializer, fields, expand))
+                queryset = Ticket.objects.all()
+                fast = fast_serializer(serializer_class)
+                self.assertEqual(fast.render_list(fast.values(queryset)[0]),
+                                 JSONRenderer().render(serializer_class(queryset, many=True).data))
+
+    def test_unknown_fields_are_rejected(self):
+        for query in ('fields=id,nope', 'fields=status.x', 'fields=customer.nope', 'expand=status'):
+            with self.subTest(query=query):
+                self.assertEqual(self.staff_client.get(f'/tickets?{query}').status_code, 400)
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    def test_async_views(self):
+        response = self.staff_client.get('/tickets?fields=id,customer&expand=')
+        self.assertEqual(response.json()[-1], {'id': self.ticket.id, 'customer': self.customer.id})
+        self.assertEqual(self.staff_client.get('/tickets?fields=nope').status_code, 400)
+
+
+class EmployeeWorkloadTests(TestCase):
+    """Per-employee workload counters and assignment suggestions"""
+
+    def setUp(self):
+        self.phones = make_employee('phones', specialty='Phones')
+        self.laptops = make_employee('laptops', specialty='Laptops')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.phones.user)
+        Ticket.objects.create(customer=self.customer, employee=self.phones, description='a', priority='urgent')
+        Ticket.objects.create(customer=self.customer, employee=self.phones, description='b', emergency=True)
+        Ticket.objects.create(customer=self.customer, employee=self.laptops, description='c', priority='high')
+        Ticket.objects.create(customer=self.customer, description='d')
+
+    def workload(self, query=''):
+        response = self.staff_client.get(f'/employees/workload{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_by_priority(self):
+        data = self.workload()
+        self.assertEqual(data['unassigned'], {'active': 1, 'low': 0, 'medium': 1, 'high': 0, 'urgent': 0,
+                                              'emergency': 0})
+        phones = data['employees'][0]
+        self.assertEqual((phones['id'], phones['full_name']), (self.phones.id, 'Emp phones'))
+        self.assertEqual(phones['workload'], {'active': 2, 'low': 0, 'medium': 1, 'high': 0, 'urgent': 1,
+                                              'emergency': 1})
+        self.assertEqual(phones['load'], 2 + 5 + 3)
+        self.assertEqual(EmployeeWorkload.objects.count(), 3)
+
+    def test_rows_follow_reassignment_completion_and_deletion(self):
+        self.workload()
+        ticket = Ticket.objects.get(description='a')
+        ticket.employee = self.laptops
+        ticket.save()
+        ticket = Ticket.objects.get(description='b')
+        ticket.date_completed = '2024-02-01'
+        ticket.save()
+        ticket = Ticket.objects.get(description='c')
+        ticket.priority = 'low'
+        ticket.save()
+        Ticket.objects.get(description='d').delete()
+        Ticket.objects.create(customer=self.customer, employee=self.phones, description='e')
+
+        self.assertEqual(verify_workloads(), {})
+        stored = {row.pop('employee'): row for row in EmployeeWorkload.objects.values(
+            'employee', 'active', 'low', 'medium', 'high', 'urgent', 'emergency')}
+        self.assertEqual(stored, live_workloads([0, self.phones.id, self.laptops.id]))
+        self.assertEqual(stored[self.laptops.id]['active'], 2)
+
+    def test_missing_rows_are_filled_next_to_stored_ones(self):
+        EmployeeWorkload.objects.create(employee=self.phones.id, active=9)
+        data = self.workload()
+        self.assertEqual(data['employees'][0]['workload']['active'], 9)
+        # Only the row that was already there disagrees with the tickets
+        self.assertEqual(list(verify_workloads()), [self.phones.id])
+
+    def test_deleting_an_employee_drops_their_row(self):
+        self.workload()
+        self.laptops.delete()
+        self.assertFalse(EmployeeWorkload.objects.filter(employee=self.laptops.id).exists())
+        self.assertEqual(verify_workloads(), {})
+
+    def test_verify_command_reports_drift(self):
+        call_command('ticket_counters', 'rebuild', stdout=StringIO())
+        EmployeeWorkload.objects.filter(employee=self.phones.id).update(urgent=7)
+        with self.assertRaises(CommandError):
+            call_command('ticket_counters', 'verify', stdout=StringIO())
+
+    def test_suggestions_prefer_specialty_then_load(self):
+        ticket = Ticket.objects.create(customer=self.customer, description='Cracked laptop hinge')
+        suggestions = self.workload(f'?ticket={ticket.id}')['suggestions']
+        self.assertEqual([item['employee'] for item in suggestions], [self.laptops.id, self.phones.id])
+        self.assertTrue(suggestions[0]['specialty_match'])
+
+        ticket = Ticket.objects.create(customer=self.customer, description='Will not boot')
+        suggestions = self.workload(f'?ticket={ticket.id}')['suggestions']
+        self.assertEqual([item['employee'] for item in suggestions], [self.laptops.id, self.phones.id])
+        self.assertEqual([item['load'] for item in suggestions], [3, 10])
+
+    def test_unknown_ticket_and_customers_are_refused(self):
+        self.assertEqual(self.staff_client.get('/employees/workload?ticket=999').status_code, 404)
+        self.assertEqual(self.staff_client.get('/employees/workload?ticket=x').status_code, 404)
+        customer_client = authenticated_client(self.customer.user)
+        self.assertEqual(customer_client.get('/employees/workload').status_code, 403)
+
+    @override_settings(WORKLOAD_COUNTERS=False)
+    def test_live_counts_without_counters(self):
+        self.assertEqual(self.workload()['employees'][1]['workload']['high'], 1)
+        self.assertFalse(EmployeeWorkload.objects.exists())
+
+
+class TicketReportTests(TestCase):
+    """Daily reports from the rollup table match the tickets"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.tickets = {}
+        for name, created, completed, priority in [('a', '2024-03-01', '2024-03-03', 'high'),
+                                                   ('b', '2024-03-01', None, 'urgent'),
+                                                   ('c', '2024-03-02', '2024-03-02', 'high'),
+                                                   ('d', '2024-02-20', '2024-03-02', 'low')]:
+            ticket = Ticket.objects.create(customer=self.customer, description=name, priority=priority,
+                                           date_completed=completed)
+            Ticket.objects.filter(pk=ticket.pk).update(
+                date_created=datetime.datetime.fromisoformat(f'{created}T10:00:00+00:00'))
+            self.tickets[name] = ticket
+
+    def report(self, query):
+        response = self.staff_client.get(f'/tickets/reports?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_daily_counts_and_backlog(self):
+        data = self.report('start=2024-03-01&end=2024-03-03')
+        self.assertEqual(data['totals'], {'created': 3, 'completed': 3, 'mean_completion_days': 4.33})
+        first, second, third = data['days']
+        self.assertEqual(first, {'date': '2024-03-01', 'created': 2, 'completed': 0, 'mean_completion_days': None,
+                                 'backlog': {'low': 1, 'medium': 0, 'high': 1, 'urgent': 1}})
+        self.assertEqual((second['created'], second['completed'], second['mean_completion_days']), (1, 2, 5.5))
+        self.assertEqual(second['backlog'], {'low': 0, 'medium': 0, 'high': 1, 'urgent': 1})
+        self.assertEqual(third['backlog'], {'low': 0, 'medium': 0, 'high': 0, 'urgent': 1})
+
+    def test_rollups_follow_writes(self):
+        ticket = Ticket.objects.get(pk=self.tickets['b'].pk)
+        ticket.priority = 'low'
+        ticket.date_completed = '2024-03-05'
+        ticket.save()
+        Ticket.objects.filter(pk=self.tickets['a'].pk).delete()
+        Ticket.objects.filter(pk=self.tickets['c'].pk).update(date_completed=None)
+        Ticket.objects.create(customer=self.customer, description='e', employee=self.employee)
+
+        self.assertEqual(verify_rollups(), {})
+        start, end = datetime.date(2024, 2, 25), datetime.date(2024, 3, 10)
+        self.assertEqual(rollup_report(start, end), live_report(start, end))
+
+    def test_report_reads_rollups_only(self):
+        self.report('start=2024-01-01&end=2024-12-31')
+        with self.assertNumQueries(2):
+            data = self.report('start=2024-01-01&end=2024-12-31')
+        self.assertEqual(len(data['days']), 366)
+
+    @override_settings(TICKET_ROLLUPS=False)
+    def test_live_report_without_rollups(self):
+        self.assertEqual(self.report('start=2024-03-02&end=2024-03-02')['days'][0]['completed'], 2)
+
+    def test_command_refreshes_recent_days_and_verifies(self):
+        TicketRollup.objects.filter(day__gte='2024-03-02').update(completed=9)
+        with self.assertRaises(CommandError):
+            call_command('ticket_rollups', '--verify', stdout=StringIO())
+        call_command('ticket_rollups', '--since', '2024-03-02', stdout=StringIO())
+        self.assertEqual(verify_rollups(), {})
+
+        TicketRollup.objects.all().delete()
+        call_command('ticket_rollups', '--all', stdout=StringIO())
+        call_command('ticket_rollups', '--verify', stdout=StringIO())
+
+    def test_migration_fills_rollups_of_existing_tickets(self):
+        migration = importlib.import_module('repairsapi.migrations.0011_ticket_rollup')
+        TicketRollup.objects.all().delete()
+        migration.backfill_rollups(django_apps, SimpleNamespace(connection=connection))
+        self.assertEqual(verify_rollups(), {})
+
+    def test_bad_ranges_and_customers_are_refused(self):
+        for query in ('start=2024-13-01', 'start=2024-03-02&end=2024-03-01', 'start=2020-01-01&end=2024-01-01'):
+            with self.subTest(query=query):
+                self.assertEqual(self.staff_client.get(f'/tickets/reports?{query}').status_code, 400)
+        customer_client = authenticated_client(self.customer.user)
+        self.assertEqual(customer_client.get('/tickets/reports').status_code, 403)
+
+
+def decode_columnar(text):
+    """Rows of a columnar export, expanding the dictionary-encoded columns"""
+    rows = []
+    for line in text.splitlines():
+        chunk = json.loads(line)
+        if 'format' in chunk:
+            continue
+        columns = [[column['dictionary'][index] for index in column['indexes']] if isinstance(column, dict)
+                   else column for column in chunk['columns']]
+        rows += [list(row) for row in zip(*columns)]
+    return rows
+
+
+@override_settings(STREAM_CHUNK_SIZE=2)
+class TicketExportTests(TestCase):
+    """Gzip-compressed CSV and columnar exports, resumable by id"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.tickets = [Ticket.objects.create(customer=self.customer, description=f'Line, "{number}"',
+                                              employee=self.employee if number % 2 else None,
+                                              priority='high' if number == 3 else 'medium')
+                        for number in range(5)]
+
+    def export(self, query=''):
+        response = self.staff_client.get(f'/tickets/export{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        return [bytes(chunk) for chunk in response.streaming_content]
+
+    def test_csv_rows_in_id_order(self):
+        rows = list(csv.reader(gzip.decompress(b''.join(self.export())).decode().splitlines()))
+        self.assertEqual(tuple(rows[0]), EXPORT_COLUMNS)
+        self.assertEqual([int(row[0]) for row in rows[1:]], [ticket.id for ticket in self.tickets])
+        first, second = rows[1], rows[2]
+        self.assertEqual(first[1:6], [str(self.customer.id), 'Cus owner', '', '', 'Line, "0"'])
+        self.assertEqual(second[3:5], [str(self.employee.id), 'Emp tech'])
+
+    def test_cut_off_export_resumes_after_last_id(self):
+        full = gzip.decompress(b''.join(self.export())).decode()
+        # The header and two chunks of two rows arrived before the cut
+        partial = zlib.decompressobj(31).decompress(b''.join(self.export()[:2])).decode()
+        last_id = int(partial.splitlines()[-1].split(',')[0])
+        self.assertEqual(last_id, self.tickets[3].id)
+        resumed = self.export(f'?after={last_id}')
+        self.assertEqual(partial + gzip.decompress(b''.join(resumed)).decode(), full)
+
+    def test_columnar_matches_csv(self):
+        text = gzip.decompress(b''.join(self.export())).decode()
+        buffer = StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_COLUMNS)
+        writer.writerows(decode_columnar(gzip.decompress(b''.join(self.export('?output=columnar'))).decode()))
+        self.assertEqual(buffer.getvalue(), text)
+
+    def test_command_appends_a_resumed_part(self):
+        with tempfile.TemporaryDirectory() as directory:
+            full, resumed = os.path.join(directory, 'full.csv.gz'), os.path.join(directory, 'resumed.csv.gz')
+            call_command('export_tickets', full, stderr=StringIO())
+            with gzip.open(full, 'rt') as exported:
+                text = exported.read()
+            # A first run that stopped after the header and three tickets
+            with gzip.open(resumed, 'wt') as partial:
+                partial.write(''.join(text.splitlines(keepends=True)[:4]))
+            call_command('export_tickets', resumed, '--after', str(self.tickets[2].id), '--append',
+                         '--format', 'csv', stderr=StringIO())
+            with gzip.open(resumed, 'rt') as exported:
+                self.assertEqual(exported.read(), text)
+
+    @override_settings(ROOT_URLCONF='repairsapi.tests')
+    def test_async_route_streams_chunks(self):
+        response = self.staff_client.get('/tickets/export?output=columnar')
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tickets-after-0.jsonl.gz"')
+        text = gzip.decompress(b''.join(response)).decode()
+        self.assertEqual([row[0] for row in decode_columnar(text)], [ticket.id for ticket in self.tickets])
+        self.assertEqual(self.staff_client.get('/tickets/export?after=x').status_code, 400)
+
+    def test_bad_requests_and_customers_are_refused(self):
+        for query in ('?output=xml', '?after=x'):
+            with self.subTest(query=query):
+                self.assertEqual(self.staff_client.get(f'/tickets/export{query}').status_code, 400)
+        customer_client = authenticated_client(self.customer.user)
+        self.assertEqual(customer_client.get('/tickets/export').status_code, 403)
+
+
+class BulkImportTests(TestCase):
+    """CSV and NDJSON imports write valid rows in batches and report the rest"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.staff_client = authenticated_client(self.employee.user)
+
+    def post(self, kind, body, content_type='text/csv', query=''):
+        return self.staff_client.post(f'/import/{kind}{query}', data=body, content_type=content_type)
+
+    @override_settings(IMPORT_BATCH_SIZE=2)
+    def test_customers_from_csv_with_errors(self):
+        password = make_password('secret')
+        body = ('username,email,first_name,last_name,address,password_hash\n'
+                f'alice,alice@example.com,Alice,A,"1 Main St, Apt 2",{password}\n'
+                'bob,bob@example.com,Bob,B,2 Main St,\n'
+                'tech,other@example.com,Dup,D,3 Main St,\n'
+                'carol,not-an-email,Carol,C,4 Main St,\n'
+                'dave,alice@example.com,Dave,D,5 Main St,\n'
+                'erin,erin@example.com,Erin,E,,\n')
+        response = self.post('customers', body, query='?tokens=true')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report['rows'], report['created'], report['failed']), (6, 2, 4))
+        self.assertEqual([error['line'] for error in report['errors']], [4, 5, 6, 7])
+        self.assertIn('username already exists', report['errors'][0]['error'])
+        self.assertIn('email already exists', report['errors'][2]['error'])
+        self.assertEqual(report['errors'][3]['error'], 'address is required')
+
+        alice = Customer.objects.get(user__username='alice')
+        self.assertEqual(alice.address, '1 Main St, Apt 2')
+        self.assertTrue(alice.user.check_password('secret'))
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+        self.assertEqual(Token.objects.filter(user__username__in=['alice', 'bob']).count(), 2)
+
+    def test_employees_are_staff(self):
+        body = json.dumps({'username': 'newtech', 'email': 'n@example.com', 'first_name': 'N',
+                           'last_name': 'T', 'specialty': 'Phones'}) + '\n\nnot json\n'
+        report = self.post('employees', body, 'application/x-ndjson').json()
+        self.assertEqual((report['created'], report['errors']), (1, [{'line': 3, 'error': 'Line is not valid JSON'}]))
+        self.assertTrue(Employee.objects.get(user__username='newtech').user.is_staff)
+
+    def test_tickets_keep_dates_and_follow_derived_data(self):
+        make_customer('owner')
+        lines = [
+            {'customer': 'owner', 'description': 'Old one', 'priority': 'high', 'date_created': '2023-05-01T09:30:00',
+             'date_completed': '2023-05-03', 'employee': 'tech'},
+            {'customer': 'owner', 'description': 'Open one', 'emergency': 'yes'},
+            {'customer': 'nobody', 'description': 'x'},
+            {'customer': 'owner', 'description': 'x', 'employee': 'ghost'},
+            {'customer': 'owner', 'description': 'x', 'date_created': '2023-02-30'},
+            {'customer': 'owner', 'description': 'x', 'priority': 'whenever'},
+        ]
+        body = ''.join(json.dumps(line) + '\n' for line in lines)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.post('tickets', body, 'application/x-ndjson').json()
+        self.assertEqual((report['created'], report['failed']), (2, 4))
+        self.assertEqual([error['error'] for error in report['errors']], [
+            "Customer 'nobody' not found", "Employee 'ghost' not found",
+            'date_created must be an ISO 8601 date and time', "Invalid priority 'whenever'"])
+
+        old = Ticket.objects.get(description='Old one')
+        self.assertEqual(old.date_created.isoformat(), '2023-05-01T09:30:00+00:00')
+        self.assertEqual(old.status, Ticket.STATUS_COMPLETED)
+        self.assertTrue(Ticket.objects.get(description='Open one').emergency)
+        self.assertEqual(verify_rollups(), {})
+        self.assertEqual(verify_workloads(), {})
+
+    def test_old_tickets_over_many_days_update_rollups_in_bulk(self):
+        make_customer('owner')
+        TicketRollup.objects.create(day=datetime.date(2023, 1, 1), priority='medium', created=-1)
+        body = ''.join(json.dumps({'customer': 'owner', 'description': 'x', 'priority': priority,
+                                   'date_created': f'2023-01-{day:02d}T12:00:00+00:00',
+                                   'date_completed': f'2023-02-{day:02d}'}) + '\n'
+                       for day in range(1, 29) for priority in ('low', 'medium'))
+        with CaptureQueriesContext(connection) as queries:
+            report = self.post('tickets', body, 'application/x-ndjson').json()
+        self.assertEqual(report['created'], 56)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(TicketRollup.objects.get(day='2023-01-01', priority='medium').created, 0)
+        TicketRollup.objects.filter(day='2023-01-01', priority='medium').update(created=1)
+        self.assertEqual(verify_rollups(), {})
+
+    def test_command_reads_csv_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'employees.csv')
+            with open(path, 'w', encoding='utf-8') as output:
+                output.write('username,email,first_name,last_name,specialty\n'
+                             'fixer,f@example.com,F,X,Laptops\n'
+                             'tech,t@example.com,T,X,Laptops\n')
+            with self.assertRaises(CommandError):
+                call_command('import_data', 'employees', path, stdout=StringIO(), stderr=StringIO())
+        self.assertTrue(Employee.objects.filter(user__username='fixer').exists())
+
+    def test_refuses_customers_and_unknown_kinds(self):
+        customer_client = authenticated_client(make_customer('owner').user)
+        self.assertEqual(customer_client.post('/import/tickets', data='', content_type='text/csv').status_code, 403)
+        self.assertEqual(self.post('widgets', '').status_code, 404)
+        self.assertEqual(self.post('tickets', '', 'application/xml').status_code, 415)
+
+
+class TicketVersionTests(TestCase):
+    """Ticket writes bump `version`; writes based on an old version are refused"""
+
+    def setUp(self):
+        self.employee = make_employee('tech')
+        self.other = make_employee('other')
+        self.customer = make_customer('owner')
+        self.staff_client = authenticated_client(self.employee.user)
+        self.ticket = Ticket.objects.create(customer=self.customer, description='Broken screen')
+
+    def put(self, body):
+        return self.staff_client.put(f'/tickets/{self.ticket.id}', body, format='json')
+
+    def test_stale_put_is_refused_with_the_current_ticket(self):
+        read = self.staff_client.get(f'/tickets/{self.ticket.id}').json()
+        self.assertEqual(read['version'], 1)
+        first = self.put({'employee': self.employee.id, 'version': read['version']})
+        self.assertEqual((first.status_code, first.json()['version']), (200, 2))
+
+        second = self.put({'employee': self.other.id, 'priority': 'high', 'version': read['version']})
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second.json()['ticket']['employee']['id'], self.employee.id)
+        ticket = Ticket.objects.get(pk=self.ticket.pk)
+        self.assertEqual((ticket.employee_id, ticket.priority, ticket.version), (self.employee.id, 'medium', 2))
+
+        self.assertEqual(self.put({'employee': self.other.id, 'version': 2}).status_code, 200)
+        self.assertEqual(self.put({'version': 'latest'}).status_code, 400)
+        self.assertEqual(self.staff_client.put('/tickets/9999', {'version': 1}, format='json').status_code, 404)
+
+    def test_form_puts_send_the_version_as_a_string(self):
+        url = f'/tickets/{self.ticket.id}'
+        response = self.staff_client.put(url, {'employee': self.employee.id, 'version': '1'}, format='multipart')
+        self.assertEqual((response.status_code, response.json()['version']), (200, 2))
+        self.assertEqual(self.staff_client.put(url, {'version': '1'}, format='multipart').status_code, 409)
+        self.assertEqual(self.staff_client.put(url, {'version': '2.5'}, format='multipart').status_code, 400)
+
+    def test_put_writes_only_the_fields_sent(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put({'employee': self.employee.id, 'priority': 'urgent'})
+        self.assertEqual(response.status_code, 200)
+        update, = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "repairsapi_ticket"')]
+        self.assertIn('"priority"', update)
+        self.assertNotIn('"description"', update)
+        self.assertEqual(self.put({'priority': 'someday'}).status_code, 400)
+        self.assertEqual(self.put({'date_completed': '2024-02-30'}).status_code, 400)
+
+    def test_saves_and_bulk_writes_check_and_bump_the_version(self):
+        first = Ticket.objects.get(pk=self.ticket.pk)
+        second = Ticket.objects.get(pk=self.ticket.pk)
+        first.priority = 'high'
+        first.save()
+        second.description = 'Lost edit'
+        with self.assertRaises(StaleTicket), transaction.atomic():
+            second.save()
+        self.assertEqual(second.version, 1)
+        first.emergency = True
+        first.save(update_fields=['emergency'])
+
+        Ticket.objects.filter(pk=self.ticket.pk).update(priority='low')
+        self.staff_client.post('/tickets/bulk', [{'op': 'assign', 'id': self.ticket.id,
+                                                  'employee': self.employee.id}], format='json')
+        ticket = Ticket.objects.get(pk=self.ticket.pk)
+        self.assertEqual((ticket.description, ticket.version), ('Broken screen', 5))
+
+
+class ParallelTicketUpdateTests(TransactionTestCase):
+    """Concurrent updaters holding the same version: exactly one of them wins"""
+
+    def test_parallel_puts_with_the_same_version(self):
+        # Connections to a shared-cache in-memory database fail with "table
+        # is locked" instead of waiting for each other
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Needs a test database that takes concurrent writers')
+        employees = [make_employee(f'tech{number}') for number in range(6)]
+        ticket = Ticket.objects.create(customer=make_customer('owner'), description='Broken screen')
+        clients = [authenticated_client(employee.user) for employee in employees]
+        start = threading.Barrier(len(clients))
+        statuses = []
+
+        def assign(client, employee):
+            start.wait()
+            try:
+                response = client.put(f'/tickets/{ticket.id}', {'employee': employee.id, 'version': 1},
+                                      format='json')
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=assign, args=pair) for pair in zip(clients, employees)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] + [409] * (len(clients) - 1))
+        ticket = Ticket.objects.get(pk=ticket.pk)
+        self.assertEqual(ticket.version, 2)
+        self.assertEqual(verify_workloads(), {})
+
+
+API_MIDDLEWARE = [middleware for middleware in settings.MIDDLEWARE if middleware not in settings.BROWSER_MIDDLEWARE]
+
+
+class ApiOnlyProfileTests(TestCase):
+    """API_ONLY workers boot without the browser apps and serve token requests the same"""
+
+    def test_boots_without_browser_apps(self):
+        script = ('import json, sys, honeyrae.wsgi\n'
+                  'from django.conf import settings\n'
+                  'from django.urls import get_resolver\n'
+                  "print(json.dumps({'apps': settings.INSTALLED_APPS, 'middleware': list(settings.MIDDLEWARE),\n"
+                  "                  'urls': [str(url.pattern) for url in get_resolver().url_patterns],\n"
+                  "                  'heroku': 'django_on_heroku' in sys.modules}))\n")
+        child = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                               check=True, env=dict(os.environ, API_ONLY='True', SECRET_KEY='x',
+                                                    DJANGO_SETTINGS_MODULE='honeyrae.settings'))
+        loaded = json.loads(child.stdout)
+        self.assertFalse(set(settings.BROWSER_APPS) & set(loaded['apps']))
+        self.assertEqual(loaded['middleware'], API_MIDDLEWARE)
+        self.assertIn('login', loaded['urls'])
+        self.assertNotIn('admin/', loaded['urls'])
+        self.assertFalse(loaded['heroku'])
+
+    @override_settings(MIDDLEWARE=API_MIDDLEWARE)
+    def test_token_requests_without_browser_middleware(self):
+        employee = make_employee('tech')
+        employee.user.set_password('secret')
+        employee.user.save()
+        Token.objects.create(user=employee.user)
+        customer = make_customer('owner')
+        ticket = Ticket.objects.create(customer=customer, description='Broken screen')
+
+        login = APIClient().post('/login', {'username': 'tech', 'password': 'secret'}, format='json').json()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {login['token']}")
+        self.assertEqual(client.get('/tickets').json()[0]['id'], ticket.id)
+        response = client.put(f'/tickets/{ticket.id}', {'employee': employee.id, 'version': 1}, format='json')
+        self.assertEqual(response.json()['status'], Ticket.STATUS_IN_PROGRESS)
+        self.assertEqual(APIClient().get('/tickets').status_code, 401)
+
+    def test_preload_hooks_freeze_the_loaded_app(self):
+        server = SimpleNamespace(cfg=SimpleNamespace(preload_app=True))
+        try:
+            gunicorn_wsgi.when_ready(server)
+            self.assertGreater(gc.get_freeze_count(), 0)
+            gunicorn_wsgi.post_fork(server, None)
+            self.assertTrue(gc.isenabled())
+        finally:
+            gc.unfreeze()
@@ -1,4 +1,7 @@
+from .async_views import async_urls
 from .auth import login_user, register_user
 from .customer_view import CustomerView
 from .employee_view import EmployeeView
+from .import_view import import_records
+from .metrics_view import request_metrics
 from .ticket_view import TicketView
@@ -0,0 +1,212 @@
+"""Async read paths for ASGI deployments
+
+With ASYNC_VIEWS on, GET requests to the ticket, customer and employee
+routes are answered by the ViewSets here, which use Django's async ORM,
+so a worker's event loop keeps serving other requests while queries are
+in flight. Every other method still goes to the DRF ViewSets, run in a
+thread.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import URLPattern
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from repairsapi.authentication import CachedTokenAuthentication
+from repairsapi.conditional import aconditional_get
+from repairsapi.events import event_stream_response
+from repairsapi.export import export_response
+from repairsapi.metrics import serializing
+from repairsapi.models import Customer, Employee, Ticket
+from repairsapi.pagination import alist_response
+from repairsapi.projection import request_serializer
+from repairsapi.response_cache import acached_response
+from repairsapi.stats import aticket_stats, bucket_aggregates
+from .customer_view import CustomerSerializer
+from .employee_view import EmployeeSerializer
+from .ticket_view import TicketSerializer, TicketView
+
+
+class AsyncViewSet:
+    """Base for the async read-only ViewSets
+
+    Requests are authenticated like the DRF views, through the token
+    principal cache, and Responses are rendered with DRF's JSONRenderer
+    so the bytes on the wire match the sync views.
+    """
+    authentication = CachedTokenAuthentication()
+    renderer = JSONRenderer()
+
+    async def dispatch(self, request, action, **kwargs):
+        request = Request(request, authenticators=())
+        request.accepted_renderer = self.renderer
+        request.accepted_media_type = self.renderer.media_type
+        try:
+            authenticated = await self.authentication.aauthenticate(request)
+            if authenticated is None:
+                raise NotAuthenticated()
+            request.user, request.auth = authenticated
+            response = await getattr(self, action)(request, **kwargs)
+        except APIException as ex:
+            response = Response({'detail': ex.detail}, status=ex.status_code)
+            if isinstance(ex, (NotAuthenticated, AuthenticationFailed)):
+                response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+        return self.render(response)
+
+    def render(self, response):
+        if not isinstance(response, Response):
+            return response
+        response.accepted_renderer = self.renderer
+        response.accepted_media_type = self.renderer.media_type
+        response.renderer_context = {}
+        patch_vary_headers(response, ['Accept'])
+        with serializing():
+            return response.render()
+
+
+class AsyncTicketView(AsyncViewSet):
+    """GET /tickets, /tickets/<pk>, /tickets/stats, /tickets/events and /tickets/export on the async ORM"""
+
+    async def list(self, request):
+        view = TicketView()
+        scope, tickets, customers = view.scope(request)
+        service_tickets, ordering = view.search(request, view.filter_tickets(request, tickets))
+        serializer_class = request_serializer(request, TicketSerializer)
+
+        return await aconditional_get(
+            request, scope, [tickets, customers, Employee.objects.all()],
+            lambda: acached_response(
+                scope, request,
+                lambda: alist_response(request, service_tickets, serializer_class, ordering,
+                                       paginate='q' in request.query_params)))
+
+    async def retrieve(self, request, pk=None):
+        serializer_class = request_serializer(request, TicketSerializer)
+
+        async def build_response():
+            try:
+                ticket = await serializer_class.plan().aget(pk=pk)
+            except Ticket.DoesNotExist:
+                return Response({'message': 'Ticket not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(serializer_class(ticket).data, status=status.HTTP_200_OK)
+
+        return await aconditional_get(
+            request, 'ticket',
+            [Ticket.objects.filter(pk=pk), Customer.objects.filter(submitted_tickets=pk),
+             Employee.objects.filter(assigned_tickets=pk)],
+            build_response)
+
+    async def stats(self, request):
+        view = TicketView()
+        scope, tickets, _ = view.scope(request)
+
+        async def build_response():
+            stats_scope = view.stats_scope(request)
+            if stats_scope is None:
+                stats = await Ticket.objects.none().aaggregate(**bucket_aggregates())
+            else:
+                stats = await aticket_stats(stats_scope)
+            return Response(stats, status=status.HTTP_200_OK)
+
+        return await aconditional_get(request, scope, [tickets], build_response)
+
+    async def events(self, request):
+        """The event stream, waiting on the event loop rather than a thread"""
+        feed = await sync_to_async(TicketView().event_feed)(
+            request, settings.EVENT_FEED['MAX_STREAM_SECONDS'])
+        if isinstance(feed, Response):
+            return feed
+        return event_stream_response(feed.astream())
+
+    async def export(self, request):
+        """The gzip export, read a chunk at a time instead of collected in memory"""
+        export = TicketView().ticket_export(request)
+        if isinstance(export, Response):
+            return export
+        return export_response(export, export.achunks())
+
+
+class AsyncAccountView(AsyncViewSet):
+    """GET list and detail for a Customer or Employee route"""
+    model = None
+    serializer_class = None
+    scope = None
+
+    async def list(self, request):
+        queryset = self.model.objects.all()
+        return await aconditional_get(
+            request, f'{self.scope}s', [queryset],
+            lambda: alist_response(request, queryset, self.serializer_class, ('id',)))
+
+    async def retrieve(self, request, pk=None):
+        async def build_response():
+            try:
+                instance = await self.serializer_class.plan().aget(pk=pk)
+            except self.model.DoesNotExist:
+                return Response({'message': f'{self.model.__name__} not found'},
+                                status=status.HTTP_404_NOT_FOUND)
+            return Response(self.serializer_class(instance).data, status=status.HTTP_200_OK)
+
+        return await aconditional_get(
+            request, self.scope, [self.model.objects.filter(pk=pk)], build_response)
+
+
+class AsyncCustomerView(AsyncAccountView):
+    model = Customer
+    serializer_class = CustomerSerializer
+    scope = 'customer'
+
+
+class AsyncEmployeeView(AsyncAccountView):
+    model = Employee
+    serializer_class = EmployeeSerializer
+    scope = 'employee'
+
+
+# Router URL names served by the async ViewSets, and the action for each
+ASYNC_ROUTES = {
+    'ticket-list': (AsyncTicketView, 'list'),
+    'ticket-detail': (AsyncTicketView, 'retrieve'),
+    'ticket-stats': (AsyncTicketView, 'stats'),
+    'ticket-events': (AsyncTicketView, 'events'),
+    'ticket-export': (AsyncTicketView, 'export'),
+    'customer-list': (AsyncCustomerView, 'list'),
+    'customer-detail': (AsyncCustomerView, 'retrieve'),
+    'employee-list': (AsyncEmployeeView, 'list'),
+    'employee-detail': (AsyncEmployeeView, 'retrieve'),
+}
+
+
+def async_view(view_class, action, sync_view):
+    """View serving GET with view_class.action and anything else with sync_view"""
+    viewset = view_class()
+    threaded_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method != 'GET' or kwargs.get('format') not in (None, 'json'):
+            return await threaded_view(request, *args, **kwargs)
+        kwargs.pop('format', None)
+        return await viewset.dispatch(request, action, **kwargs)
+
+    # The DRF views handle CSRF themselves, as the sync routes do
+    view.csrf_exempt = True
+    return view
+
+
+def async_urls(patterns):
+    """Swap the router's ticket, customer and employee routes for async views
+
+    Arguments:
+        patterns -- URL patterns from the DRF router
+    """
+    routed = []
+    for pattern in patterns:
+        route = ASYNC_ROUTES.get(pattern.name)
+        if route is not None:
+            pattern = URLPattern(pattern.pattern, async_view(*route, pattern.callback),
+                                 pattern.default_args, pattern.name)
+        routed.append(pattern)
+    return routed
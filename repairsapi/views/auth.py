@@ -1,14 +1,27 @@
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.contrib.auth.signals import user_logged_in
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from rest_framework.authtoken.models import Token
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from repairsapi.hashing import HashingOverloaded, hash_password
+from repairsapi.jobs import enqueue
 from repairsapi.models import Customer, Employee
 
 
+def overloaded_response():
+    return Response(
+        {'message': 'Too many sign-ins in progress, please try again shortly'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': '1'}
+    )
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login_user(request):
@@ -20,18 +33,21 @@ def login_user(request):
     username = request.data.get('username', '')
     password = request.data.get('password', '')
 
-    # Use the built-in authenticate method to verify
-    # authenticate returns the user object or None if no user is found
-    authenticated_user = authenticate(username=username, password=password)
+    # The backend checks the password in the hashing pool, so a login
+    # burst can't tie up every request thread
+    try:
+        user = authenticate(request, username=username, password=password)
+    except HashingOverloaded:
+        return overloaded_response()
 
     # If authentication was successful, respond with their token
-    if authenticated_user is not None:
-        token = Token.objects.get(user=authenticated_user)
-
+    if user is not None:
+        if settings.LOGIN_SIGNAL:
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
         data = {
             'valid': True,
-            'token': token.key,
-            'staff': authenticated_user.is_staff
+            'token': user.auth_token.key,
+            'staff': user.is_staff
         }
         return Response(data)
     else:
@@ -89,54 +105,54 @@ def register_user(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    # Check if username already exists
-    if User.objects.filter(username=username).exists():
+    username = User.normalize_username(username)
+    email = User.objects.normalize_email(email)
+
+    # Check username and email in one query
+    taken = User.objects.filter(Q(username=username) | Q(email=email)).values_list('username', flat=True)[:2]
+    if username in taken:
         return Response(
             {'message': 'An account with that username already exists'},
             status=status.HTTP_400_BAD_REQUEST
         )
-
-    # Check if email already exists
-    if User.objects.filter(email=email).exists():
+    if taken:
         return Response(
             {'message': 'An account with that email address already exists'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
     try:
-        # Create a new user by invoking the `create_user` helper method
-        # on Django's built-in User model
-        new_user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            first_name=first_name,
-            last_name=last_name
-        )
+        password = hash_password(password)
+    except HashingOverloaded:
+        return overloaded_response()
+
+    # Create the user, their customer or employee row and their token
+    # together, so a failure part way leaves nothing behind
+    try:
+        with transaction.atomic():
+            new_user = User.objects.create(
+                username=username,
+                email=email,
+                password=password,
+                first_name=first_name,
+                last_name=last_name,
+                is_staff=account_type == 'employee'
+            )
+
+            if account_type == 'customer':
+                Customer.objects.create(address=address, user=new_user)
+            else:
+                Employee.objects.create(specialty=specialty, user=new_user)
+
+            # Use the REST Framework's token generator on the new user account
+            token = Token.objects.create(user=new_user)
+            enqueue('welcome_email', user=new_user.pk)
     except IntegrityError:
         return Response(
             {'message': 'An account with that username or email already exists'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    account = None
-
-    if account_type == 'customer':
-        account = Customer.objects.create(
-            address=request.data['address'],
-            user=new_user
-        )
-    elif account_type == 'employee':
-        new_user.is_staff = True
-        new_user.save()
-
-        account = Employee.objects.create(
-            specialty=request.data['specialty'],
-            user=new_user
-        )
-
-    # Use the REST Framework's token generator on the new user account
-    token = Token.objects.create(user=account.user)
     # Return the token to the client
     data = { 'token': token.key, 'staff': new_user.is_staff }
-    return Response(data)
\ No newline at end of file
+    return Response(data)
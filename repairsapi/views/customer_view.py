@@ -3,7 +3,10 @@ from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
+from repairsapi.conditional import conditional_get
 from repairsapi.models import Customer
+from repairsapi.pagination import list_response
+from repairsapi.query_plan import PlannedModelSerializer
 
 
 class CustomerView(ViewSet):
@@ -12,13 +15,17 @@ class CustomerView(ViewSet):
     def list(self, request):
         """Handle GET requests to get all customers
 
+        Supports the same `page_size`/`cursor`, `stream=ndjson` and
+        If-None-Match handling as the tickets list.
+
         Returns:
             Response -- JSON serialized list of customers
         """
 
         customers = Customer.objects.all()
-        serialized = CustomerSerializer(customers, many=True)
-        return Response(serialized.data, status=status.HTTP_200_OK)
+        return conditional_get(
+            request, 'customers', [customers],
+            lambda: list_response(request, customers, CustomerSerializer, ('id',)))
 
     def retrieve(self, request, pk=None):
         """Handle GET requests for single customer
@@ -27,12 +34,13 @@ class CustomerView(ViewSet):
             Response -- JSON serialized customer record
         """
 
-        customer = Customer.objects.get(pk=pk)
-        serialized = CustomerSerializer(customer)
-        return Response(serialized.data, status=status.HTTP_200_OK)
+        return conditional_get(
+            request, 'customer', [Customer.objects.filter(pk=pk)],
+            lambda: Response(CustomerSerializer(CustomerSerializer.plan().get(pk=pk)).data,
+                             status=status.HTTP_200_OK))
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(PlannedModelSerializer):
     """JSON serializer for customers"""
     class Meta:
         model = Customer
@@ -1,11 +1,18 @@
 """View module for handling requests for employee data"""
+import logging
 from django.http import HttpResponseServerError
 from django.contrib.auth.models import User
+from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
-from repairsapi.models import Employee
+from repairsapi.conditional import conditional_get
+from repairsapi.models import Employee, EmployeeWorkload, Ticket
+from repairsapi.pagination import list_response
+from repairsapi.query_plan import PlannedModelSerializer
+from repairsapi.workload import employee_workloads, load_score, suggest_assignees
 
+logger = logging.getLogger(__name__)
 
 
 class EmployeeView(ViewSet):
@@ -14,13 +21,17 @@ class EmployeeView(ViewSet):
     def list(self, request):
         """Handle GET requests to get all employees
 
+        Supports the same `page_size`/`cursor`, `stream=ndjson` and
+        If-None-Match handling as the tickets list.
+
         Returns:
             Response -- JSON serialized list of employees
         """
 
         employees = Employee.objects.all()
-        serialized = EmployeeSerializer(employees, many=True)
-        return Response(serialized.data, status=status.HTTP_200_OK)
+        return conditional_get(
+            request, 'employees', [employees],
+            lambda: list_response(request, employees, EmployeeSerializer, ('id',)))
 
     def retrieve(self, request, pk=None):
         """Handle GET requests for single employee
@@ -29,9 +40,10 @@ class EmployeeView(ViewSet):
             Response -- JSON serialized employee record
         """
 
-        employee = Employee.objects.get(pk=pk)
-        serialized = EmployeeSerializer(employee)
-        return Response(serialized.data, status=status.HTTP_200_OK)
+        return conditional_get(
+            request, 'employee', [Employee.objects.filter(pk=pk)],
+            lambda: Response(EmployeeSerializer(EmployeeSerializer.plan().get(pk=pk)).data,
+                             status=status.HTTP_200_OK))
 
     def create(self, request):
         """Handle POST requests for Employee
@@ -40,7 +52,7 @@ class EmployeeView(ViewSet):
             Response: JSON serialized representation of newly created Employee
         """
 
-        print(request.data)
+        logger.debug('Employee create: %s', request.data)
         user = User.objects.create_user(
             username=request.data['username'],
             email=request.data['email'],
@@ -58,20 +70,15 @@ class EmployeeView(ViewSet):
 
     def update(self, request, pk=None):
         """Handle put request for single employee"""
-        print(request.data)
         ticket = Employee.objects.get(pk=pk)
         employee = request.data['id']
         specialty = request.data['specialty']
-
-        print('employee update')
-        print(employee)
-        print(specialty)
+        logger.debug('Employee update: employee=%s specialty=%s', employee, specialty)
 
         if employee == 0:
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         
         assigned_employee = Employee.objects.get(pk=employee)
-        print(assigned_employee)
         
         assigned_employee.specialty = specialty
         
@@ -85,10 +92,42 @@ class EmployeeView(ViewSet):
         
         return Response(None, status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['get'])
+    def workload(self, request):
+        """Unfinished tickets of each employee by priority, for staff
 
-
-
-class EmployeeSerializer(serializers.ModelSerializer):
+        With `?ticket=<id>`, also ranks the employees for that ticket:
+        specialty matches first, then the least loaded.
+        """
+        if not request.auth.user.is_staff:
+            return Response({'message': 'Only staff can view employee workloads'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        ticket = None
+        if 'ticket' in request.query_params:
+            try:
+                ticket = Ticket.objects.only('id', 'description').get(pk=request.query_params['ticket'])
+            except (Ticket.DoesNotExist, ValueError):
+                return Response({'message': 'Ticket not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        employees = list(Employee.objects.order_by('id').values_list(
+            'id', 'specialty', 'user__first_name', 'user__last_name'))
+        workloads = employee_workloads([EmployeeWorkload.UNASSIGNED, *(row[0] for row in employees)])
+        data = {
+            'unassigned': workloads[EmployeeWorkload.UNASSIGNED],
+            'employees': [{'id': pk, 'full_name': f'{first_name} {last_name}', 'specialty': specialty,
+                           'workload': workloads[pk], 'load': load_score(workloads[pk])}
+                          for pk, specialty, first_name, last_name in employees],
+        }
+        if ticket is not None:
+            data['suggestions'] = suggest_assignees(
+                ticket, [(pk, specialty) for pk, specialty, _, _ in employees], workloads)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+
+
+class EmployeeSerializer(PlannedModelSerializer):
     """JSON serializer for employees"""
     class Meta:
         model = Employee
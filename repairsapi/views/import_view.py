@@ -0,0 +1,50 @@
+"""View module for bulk imports of customers, employees and tickets"""
+import codecs
+import logging
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from repairsapi.imports import IMPORT_KINDS, BulkImport, read_records
+
+logger = logging.getLogger(__name__)
+
+# Content-Type -> import format
+IMPORT_MEDIA_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+@api_view(['POST'])
+def import_records(request, kind):
+    '''Bulk import customers, employees or tickets from the request body
+
+    Send CSV (`Content-Type: text/csv`, with a header row) or NDJSON
+    (`application/x-ndjson`). The body is read a line at a time and
+    written a batch at a time; rows that fail validation are skipped
+    and listed by line number in the response. Add `tokens=true` to
+    create API tokens for imported customers and employees.
+    '''
+    if not request.auth.user.is_staff:
+        return Response({'message': 'Only staff can import data'}, status=status.HTTP_403_FORBIDDEN)
+    if kind not in IMPORT_KINDS:
+        return Response({'message': f"Import kind must be one of {', '.join(IMPORT_KINDS)}"},
+                        status=status.HTTP_404_NOT_FOUND)
+    media_type = request.content_type.split(';')[0].strip()
+    if media_type not in IMPORT_MEDIA_TYPES:
+        return Response({'message': f"Send the records as {' or '.join(IMPORT_MEDIA_TYPES)}"},
+                        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    bulk_import = BulkImport(kind, tokens=request.query_params.get('tokens') == 'true')
+    lines = codecs.iterdecode(request.stream or [], 'utf-8-sig')
+    try:
+        bulk_import.run(read_records(lines, IMPORT_MEDIA_TYPES[media_type]))
+    except UnicodeDecodeError:
+        # Batches before the bad line are already committed
+        return Response({'message': 'The body is not valid UTF-8', **bulk_import.report()},
+                        status=status.HTTP_400_BAD_REQUEST)
+    report = bulk_import.report()
+    logger.info('Imported %d of %d %s (%.0f rows/s)', report['created'], report['rows'], kind,
+                report['rows_per_second'])
+    return Response(report, status=status.HTTP_200_OK)
@@ -0,0 +1,21 @@
+"""View module for the Prometheus metrics endpoint"""
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from repairsapi.jobs import render_queue_metrics
+from repairsapi.metrics import registry
+
+
+@api_view(['GET'])
+def request_metrics(request):
+    '''Per-route request histograms of this worker and the background job
+    queue, in the Prometheus text format
+
+    Scrape with a staff token, e.g. `authorization: {type: Token,
+    credentials: <key>}` in the Prometheus job.
+    '''
+    if not request.auth.user.is_staff:
+        return Response({'message': 'Only staff can view metrics'}, status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(registry.render() + render_queue_metrics(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
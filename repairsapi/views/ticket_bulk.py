@@ -0,0 +1,166 @@
+"""Batched ticket writes for POST /tickets/bulk"""
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from repairsapi.imports import InvalidRecord, flag
+from repairsapi.models import Customer, Employee, Ticket, batched_ticket_changes
+
+MAX_OPERATIONS = 1000
+STAFF_OPERATIONS = ('assign', 'complete', 'delete')
+OPERATIONS = ('create',) + STAFF_OPERATIONS
+PRIORITIES = {choice for choice, _ in Ticket.PRIORITY_CHOICES}
+
+
+def _int_ids(values):
+    return {value for value in values if isinstance(value, int) and not isinstance(value, bool)}
+
+
+def _known(value, ids):
+    return isinstance(value, int) and value in ids
+
+
+def _existing_ids(model, ids):
+    ids = _int_ids(ids)
+    return set(model.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+
+
+def _employee_id(value):
+    """Normalize the assign payload; 0 and null both mean unassign"""
+    return None if value in (0, None) else value
+
+
+def run_bulk_operations(principal, operations):
+    """Validate a list of ticket operations, then apply them all at once
+
+    Each operation is a dict with an `op` key:
+        {"op": "create", "description": ..., "priority": ..., "emergency": ...,
+         "customer": <id, staff only>}
+        {"op": "assign", "id": <ticket>, "employee": <id, or 0/null to unassign>}
+        {"op": "complete", "id": <ticket>, "date_completed": "YYYY-MM-DD" (default today)}
+        {"op": "delete", "id": <ticket>}
+
+    Nothing is written unless every operation is valid. Lookups take one
+    query per referenced model, and the writes run in one transaction as
+    a bulk_create, a bulk_update and a single DELETE.
+
+    Returns:
+        tuple -- (HTTP status code, response body)
+    """
+    if isinstance(operations, dict):
+        operations = operations.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return status.HTTP_400_BAD_REQUEST, {'message': 'Provide a non-empty list of operations'}
+    if len(operations) > MAX_OPERATIONS:
+        return status.HTTP_400_BAD_REQUEST, {
+            'message': f'At most {MAX_OPERATIONS} operations can be sent at once'}
+
+    is_staff = principal.is_staff
+    ticket_ids, employee_ids, customer_ids = set(), set(), set()
+    for operation in operations:
+        if not isinstance(operation, dict):
+            continue
+        if operation.get('op') in STAFF_OPERATIONS:
+            ticket_ids.add(operation.get('id'))
+        if operation.get('op') == 'assign' and _employee_id(operation.get('employee')) is not None:
+            employee_ids.add(operation.get('employee'))
+        if operation.get('op') == 'create' and is_staff:
+            customer_ids.add(operation.get('customer'))
+
+    ticket_ids = _int_ids(ticket_ids)
+    tickets = Ticket.objects.in_bulk(ticket_ids) if ticket_ids else {}
+    employees = _existing_ids(Employee, employee_ids)
+    customers = _existing_ids(Customer, customer_ids)
+
+    results = []
+    new_tickets = []
+    changed = {}
+    changed_fields = set()
+    deleted = set()
+    today = timezone.localdate()
+
+    for index, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        result = {'index': index, 'op': op}
+        results.append(result)
+
+        if op not in OPERATIONS:
+            result['error'] = f'op must be one of {", ".join(OPERATIONS)}'
+            continue
+        if op in STAFF_OPERATIONS and not is_staff:
+            result['error'] = f'Only staff can {op} tickets'
+            continue
+
+        if op == 'create':
+            description = operation.get('description')
+            description = description.strip() if isinstance(description, str) else ''
+            priority = operation.get('priority', Ticket.PRIORITY_MEDIUM)
+            customer_id = operation.get('customer') if is_staff else principal.customer_id
+            try:
+                emergency = flag(operation, 'emergency')
+            except InvalidRecord as ex:
+                result['error'] = str(ex)
+                continue
+            if not description:
+                result['error'] = 'Description is required'
+            elif not isinstance(priority, str) or priority not in PRIORITIES:
+                result['error'] = f'Invalid priority {priority!r}'
+            elif customer_id is None or (is_staff and not _known(customer_id, customers)):
+                result['error'] = 'Customer not found'
+            else:
+                new_tickets.append((result, Ticket(
+                    customer_id=customer_id,
+                    description=description,
+                    priority=priority,
+                    emergency=emergency,
+                )))
+            continue
+
+        result['id'] = operation.get('id')
+        ticket = tickets.get(result['id']) if _known(result['id'], ticket_ids) else None
+        if ticket is None or ticket.pk in deleted:
+            result['error'] = 'Ticket not found'
+            continue
+
+        if op == 'assign':
+            employee_id = _employee_id(operation.get('employee'))
+            if employee_id is not None and not _known(employee_id, employees):
+                result['error'] = 'Employee not found'
+                continue
+            ticket.employee_id = employee_id
+            changed_fields.add('employee')
+            changed[ticket.pk] = ticket
+            result['result'] = 'assigned'
+        elif op == 'complete':
+            date_completed = operation.get('date_completed')
+            date_completed = parse_date(date_completed) if isinstance(date_completed, str) else today
+            if date_completed is None:
+                result['error'] = 'date_completed must be YYYY-MM-DD'
+                continue
+            ticket.date_completed = date_completed
+            changed_fields.add('date_completed')
+            changed[ticket.pk] = ticket
+            result['result'] = 'completed'
+        else:
+            deleted.add(ticket.pk)
+            changed.pop(ticket.pk, None)
+            result['result'] = 'deleted'
+
+    if any('error' in result for result in results):
+        for result in results:
+            result.pop('result', None)
+        return status.HTTP_400_BAD_REQUEST, {
+            'message': 'No operations were applied', 'results': results}
+
+    with transaction.atomic(), batched_ticket_changes():
+        if new_tickets:
+            Ticket.objects.bulk_create([ticket for _, ticket in new_tickets])
+        if changed:
+            Ticket.objects.bulk_update(list(changed.values()), sorted(changed_fields))
+        if deleted:
+            Ticket.objects.filter(pk__in=deleted).delete()
+
+    for result, ticket in new_tickets:
+        result['id'] = ticket.pk
+        result['result'] = 'created'
+    return status.HTTP_200_OK, {'results': results}
@@ -1,52 +1,119 @@
 """View module for handling requests for ticket data"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.http import HttpResponseServerError
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers, status
+from rest_framework.exceptions import ParseError
 from rest_framework.decorators import action
-from repairsapi.models import Ticket, Employee, Customer
+from rest_framework.renderers import JSONRenderer
+from repairsapi.conditional import conditional_get
+from repairsapi.events import (EventFeed, EventStreamRenderer, event_broker, event_stream_response,
+                               stream_seconds)
+from repairsapi.export import EXPORT_FORMATS, TicketExport, export_response
+from repairsapi.models import Ticket, Employee, Customer, TicketCounter
+from repairsapi.pagination import list_response
+from repairsapi.projection import request_serializer
+from repairsapi.response_cache import cached_response, response_cache
+from repairsapi.query_plan import PlannedModelSerializer
+from repairsapi.reports import report_range, ticket_report
+from repairsapi.search import RANKED_ORDERING, search_tickets
+from repairsapi.stats import aggregate_stats, ticket_stats
+from repairsapi.views.ticket_bulk import run_bulk_operations
 
 
 class TicketView(ViewSet):
     """Honey Rae API tickets view"""
 
+    # Unique version of Ticket.Meta.ordering for cursors and streams
+    ordering = ('-date_created', '-id')
+    # ?status= values accepted by list, mapped to the stored Ticket.status
+    status_filters = {
+        'done': Ticket.STATUS_COMPLETED,
+        'unclaimed': Ticket.STATUS_OPEN,
+        'in-progress': Ticket.STATUS_IN_PROGRESS,
+    }
+
+    def scope(self, request):
+        """Version scope and ticket rows visible to the caller
+
+        Returns:
+            tuple -- (scope key, tickets queryset, customers queryset)
+        """
+        if request.auth.user.is_staff:
+            return 'staff', Ticket.objects.all(), Customer.objects.all()
+        customer_id = request.auth.customer_id
+        return (f'customer:{customer_id}', Ticket.objects.filter(customer_id=customer_id),
+                Customer.objects.filter(pk=customer_id))
+
     def list(self, request):
         """Handle GET requests to get all tickets
 
+        Pass `page_size` and/or `cursor` for keyset pagination, or
+        `stream=ndjson` to stream every row as newline-delimited JSON.
+        `q` searches descriptions; matches come best first, a page at a
+        time. `fields` and `expand` narrow each row (see
+        repairsapi.projection). Answers 304 when If-None-Match carries the current ETag, and
+        otherwise serves from the response cache when it can.
+
         Returns:
             Response -- JSON serialized list of tickets
         """
-        service_tickets = []
+        scope, tickets, customers = self.scope(request)
+        service_tickets, ordering = self.search(request, self.filter_tickets(request, tickets))
+        serializer_class = request_serializer(request, TicketSerializer)
+
+        return conditional_get(
+            request, scope, [tickets, customers, Employee.objects.all()],
+            lambda: cached_response(
+                scope, request,
+                lambda: list_response(request, service_tickets, serializer_class, ordering,
+                                      paginate='q' in request.query_params)))
+
+    def search(self, request, service_tickets):
+        """Apply the `q` full-text search, ranking the matches
+
+        Returns:
+            tuple -- (tickets queryset, ordering to list them in)
+        """
+        if 'q' not in request.query_params:
+            return service_tickets, self.ordering
+        return search_tickets(service_tickets, request.query_params['q']), RANKED_ORDERING
 
+    def filter_tickets(self, request, service_tickets):
+        """Apply the staff-only status and priority query filters"""
         if request.auth.user.is_staff:
-            service_tickets = Ticket.objects.all()
 
-            if "status" in request.query_params:
-                if request.query_params['status'] == "done":
-                    service_tickets = service_tickets.filter(date_completed__isnull=False)
-                if request.query_params['status'] == "unclaimed":
-                    service_tickets = service_tickets.filter(date_completed__isnull=True, employee__isnull=True)
-                if request.query_params['status'] == "in-progress":
-                    service_tickets = service_tickets.filter(date_completed__isnull=True, employee__isnull=False)
+            if request.query_params.get('status') in self.status_filters:
+                service_tickets = service_tickets.filter(
+                    status=self.status_filters[request.query_params['status']])
 
             # Filter by priority if provided
             if "priority" in request.query_params:
                 service_tickets = service_tickets.filter(priority=request.query_params['priority'])
-        else:
-            service_tickets = Ticket.objects.filter(customer__user=request.auth.user)
 
-        serialized = TicketSerializer(service_tickets, many=True)
-        return Response(serialized.data, status=status.HTTP_200_OK)
+        return service_tickets
 
     def retrieve(self, request, pk=None):
-        """Handle GET requests for single ticket
+        """Handle GET requests for single ticket, narrowed by `fields` and `expand`
 
         Returns:
             Response -- JSON serialized ticket record
         """
+        serializer_class = request_serializer(request, TicketSerializer)
+        return conditional_get(
+            request, 'ticket',
+            [Ticket.objects.filter(pk=pk), Customer.objects.filter(submitted_tickets=pk),
+             Employee.objects.filter(assigned_tickets=pk)],
+            lambda: self.retrieve_response(pk, serializer_class))
+
+    def retrieve_response(self, pk, serializer_class=None):
+        serializer_class = serializer_class or TicketSerializer
         try:
-            ticket = Ticket.objects.get(pk=pk)
-            serialized = TicketSerializer(ticket)
+            ticket = serializer_class.plan().get(pk=pk)
+            serialized = serializer_class(ticket)
             return Response(serialized.data, status=status.HTTP_200_OK)
         except Ticket.DoesNotExist:
             return Response({'message': 'Ticket not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -74,70 +141,188 @@ class TicketView(ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        if request.auth.customer_id is None:
+            return Response(
+                {'message': 'Only customers can create tickets'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         new_ticket = Ticket()
-        new_ticket.customer = Customer.objects.get(user=request.auth.user)
+        new_ticket.customer_id = request.auth.customer_id
         new_ticket.description = description
         new_ticket.emergency = request.data.get('emergency', False)
         new_ticket.priority = request.data.get('priority', 'medium')
-        new_ticket.save()
+        # One transaction for the ticket and the jobs its signals queue
+        with transaction.atomic():
+            new_ticket.save()
 
         serialized = TicketSerializer(new_ticket)
         return Response(serialized.data, status=status.HTTP_201_CREATED)
 
     def update(self, request, pk=None):
-        """Handle PUT request for updating a ticket"""
-        try:
-            ticket = Ticket.objects.get(pk=pk)
-        except Ticket.DoesNotExist:
-            return Response({'message': 'Ticket not found'}, status=status.HTTP_404_NOT_FOUND)
+        """Handle PUT request for updating a ticket
+
+        Only the fields sent are written, in one UPDATE that also bumps
+        the ticket's `version`. Sending back the `version` the client
+        read makes the write conditional: if the ticket changed since,
+        nothing is written and the response is 409 with the current
+        ticket.
+        """
+        changes = {}
 
         # Handle employee assignment
         employee = request.data.get('employee')
         if employee == 0 or employee is None:
-            ticket.employee = None
+            changes['employee'] = None
+        elif Employee.objects.filter(pk=employee).exists():
+            changes['employee_id'] = employee
         else:
-            try:
-                assigned_employee = Employee.objects.get(pk=employee)
-                ticket.employee = assigned_employee
-            except Employee.DoesNotExist:
-                return Response({'message': 'Employee not found'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'message': 'Employee not found'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Update other fields if provided
-        if 'date_completed' in request.data:
-            ticket.date_completed = request.data['date_completed']
+        for name in ('date_completed', 'priority', 'description', 'emergency'):
+            if name in request.data:
+                try:
+                    changes[name] = Ticket._meta.get_field(name).clean(request.data[name], None)
+                except ValidationError as error:
+                    return Response({'message': f'{name}: {error.messages[0]}'},
+                                    status=status.HTTP_400_BAD_REQUEST)
 
-        if 'priority' in request.data:
-            ticket.priority = request.data['priority']
+        tickets = Ticket.objects.filter(pk=pk)
+        if 'version' in request.data:
+            # Form and multipart bodies send it as a string
+            try:
+                if isinstance(request.data['version'], bool):
+                    raise TypeError
+                version = int(request.data['version'])
+            except (TypeError, ValueError):
+                return Response({'message': 'version must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            tickets = tickets.filter(version=version)
+
+        with transaction.atomic():
+            updated = tickets.update(**changes)
+        response = self.retrieve_response(pk)
+        if not updated and response.status_code == status.HTTP_200_OK:
+            return Response({'message': 'The ticket was changed by someone else since that version',
+                             'ticket': response.data}, status=status.HTTP_409_CONFLICT)
+        return response
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Handle POST requests with a batch of ticket operations
+
+        Every operation is validated before any is applied, and then all
+        of them are applied in one transaction. See run_bulk_operations
+        for the payload format.
+
+        Returns:
+            Response -- Per-operation results
+        """
+        code, body = run_bulk_operations(request.auth, request.data)
+        return Response(body, status=code)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """Hit/miss counters of this worker's ticket list response cache"""
+        if not request.auth.user.is_staff:
+            return Response({'message': 'Only staff can view cache statistics'},
+                            status=status.HTTP_403_FORBIDDEN)
+        cache = response_cache()
+        body = {'enabled': False} if cache is None else {'enabled': True, **cache.stats()}
+        return Response(body, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def events(self, request):
+        """Stream ticket changes as Server-Sent Events
+
+        Staff get every ticket's events, customers their own tickets'.
+        The stream closes after `timeout` seconds (default and maximum
+        EVENT_FEED['SYNC_MAX_STREAM_SECONDS'] here, as the stream holds
+        the worker; 0 sends what is pending and closes) and the client
+        reconnects with Last-Event-ID, or the `last_event_id` parameter,
+        to carry on where it left off.
+        """
+        feed = self.event_feed(request, settings.EVENT_FEED['SYNC_MAX_STREAM_SECONDS'])
+        if isinstance(feed, Response):
+            return feed
+        return event_stream_response(feed.stream())
+
+    def event_feed(self, request, seconds):
+        """The caller's EventFeed streaming at most `seconds`, or a Response refusing it"""
+        broker = event_broker()
+        if broker is None:
+            return Response({'message': 'The event feed is turned off'}, status=status.HTTP_404_NOT_FOUND)
+        customer_id = None
+        if not request.auth.user.is_staff:
+            customer_id = request.auth.customer_id
+            if customer_id is None:
+                return Response({'message': 'Only staff and customers can follow ticket events'},
+                                status=status.HTTP_403_FORBIDDEN)
+        last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+        return EventFeed(broker, last_event_id, customer_id, stream_seconds(request, seconds))
 
-        if 'description' in request.data:
-            ticket.description = request.data['description']
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every ticket with customer and employee names, gzip-compressed
+
+        `output` is `csv` (the default) or `columnar`; see
+        repairsapi.export. Rows come in id order, and `after=<id>`
+        resumes an export that was cut off after that ticket.
+        """
+        export = self.ticket_export(request)
+        if isinstance(export, Response):
+            return export
+        return export_response(export, export.chunks())
 
-        if 'emergency' in request.data:
-            ticket.emergency = request.data['emergency']
+    def ticket_export(self, request):
+        """The caller's TicketExport, or a Response refusing it"""
+        if not request.auth.user.is_staff:
+            return Response({'message': 'Only staff can export tickets'}, status=status.HTTP_403_FORBIDDEN)
+        export_format = request.query_params.get('output', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ParseError(f"output must be one of {', '.join(EXPORT_FORMATS)}")
+        try:
+            after = int(request.query_params.get('after', 0))
+        except ValueError as error:
+            raise ParseError('after must be a ticket id') from error
+        return TicketExport(export_format, after)
+
+    @action(detail=False, methods=['get'])
+    def reports(self, request):
+        """Daily ticket report for staff dashboards
 
-        ticket.save()
-        serialized = TicketSerializer(ticket)
-        return Response(serialized.data, status=status.HTTP_200_OK)
+        `start` and `end` (YYYY-MM-DD, inclusive) pick the days, the
+        last 30 by default. Each day has the tickets created and
+        completed, the mean days to completion of those completed, and
+        the unfinished tickets by priority at its end.
+        """
+        if not request.auth.user.is_staff:
+            return Response({'message': 'Only staff can view ticket reports'},
+                            status=status.HTTP_403_FORBIDDEN)
+        start, end = report_range(request.query_params)
+        return Response(ticket_report(start, end), status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get ticket statistics for dashboard"""
-        if request.auth.user.is_staff:
-            all_tickets = Ticket.objects.all()
+        scope, tickets, _ = self.scope(request)
+        return conditional_get(request, scope, [tickets], lambda: self.stats_response(request))
+
+    def stats_response(self, request):
+        stats_scope = self.stats_scope(request)
+        if stats_scope is None:
+            stats = aggregate_stats(Ticket.objects.none())
         else:
-            all_tickets = Ticket.objects.filter(customer__user=request.auth.user)
-
-        stats = {
-            'total': all_tickets.count(),
-            'open': all_tickets.filter(date_completed__isnull=True, employee__isnull=True).count(),
-            'in_progress': all_tickets.filter(date_completed__isnull=True, employee__isnull=False).count(),
-            'completed': all_tickets.filter(date_completed__isnull=False).count(),
-            'urgent': all_tickets.filter(priority='urgent', date_completed__isnull=True).count(),
-            'high_priority': all_tickets.filter(priority='high', date_completed__isnull=True).count(),
-            'emergency': all_tickets.filter(emergency=True, date_completed__isnull=True).count(),
-        }
+            stats = ticket_stats(stats_scope)
+
         return Response(stats, status=status.HTTP_200_OK)
 
+    def stats_scope(self, request):
+        """Counter scope for the caller, or None when they have no tickets"""
+        if request.auth.user.is_staff:
+            return TicketCounter.GLOBAL_SCOPE
+        return request.auth.customer_id
+
 
 class TicketEmployeeSerializer(serializers.ModelSerializer):
     """JSON serializer for employee"""
@@ -153,7 +338,7 @@ class TicketCustomerSerializer(serializers.ModelSerializer):
         fields = ('id', 'user', 'address', 'full_name')
 
 
-class TicketSerializer(serializers.ModelSerializer):
+class TicketSerializer(PlannedModelSerializer):
     """JSON serializer for tickets"""
     employee = TicketEmployeeSerializer(many=False)
     customer = TicketCustomerSerializer(many=False)
@@ -162,5 +347,5 @@ class TicketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = ('id', 'description', 'emergency', 'priority', 'status',
-                  'date_created', 'date_completed', 'employee', 'customer')
+                  'date_created', 'date_completed', 'employee', 'customer', 'version')
         depth = 2
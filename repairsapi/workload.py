@@ -0,0 +1,156 @@
+"""Employee workload counters and assignment suggestions
+
+Each employee's unfinished tickets are counted by priority and
+emergency in EmployeeWorkload rows, which the ticket change signals
+adjust with one UPDATE per affected employee. Reassigning a ticket
+moves it between two rows, and completing or deleting it takes it off
+one. Missing rows are filled from the live aggregate while ticket
+writes are held, like the ticket counters in repairsapi.stats.
+"""
+import re
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from repairsapi.models import Employee, EmployeeWorkload, Ticket
+from repairsapi.stats import fill_counter_rows, hold_ticket_writes
+
+# Each bucket is (filter for the live aggregate, test for an active TicketState)
+WORKLOAD_BUCKETS = {
+    'active': (Q(), lambda state: True),
+    **{priority: (Q(priority=priority), lambda state, priority=priority: state.priority == priority)
+       for priority, _ in Ticket.PRIORITY_CHOICES},
+    'emergency': (Q(emergency=True), lambda state: state.emergency),
+}
+# How much one unfinished ticket weighs in an employee's load
+LOAD_WEIGHTS = {Ticket.PRIORITY_LOW: 1, Ticket.PRIORITY_MEDIUM: 2, Ticket.PRIORITY_HIGH: 3,
+                Ticket.PRIORITY_URGENT: 5, 'emergency': 3}
+
+
+def workload_counters_enabled():
+    return getattr(settings, 'WORKLOAD_COUNTERS', False)
+
+
+def workload_key(state):
+    return state.employee_id or EmployeeWorkload.UNASSIGNED
+
+
+def workload_deltas(changes):
+    """Per-employee bucket deltas for a list of (before, after) TicketStates"""
+    deltas = defaultdict(Counter)
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None or state.status not in Ticket.ACTIVE_STATUSES:
+                continue
+            for name, (_, applies) in WORKLOAD_BUCKETS.items():
+                if applies(state):
+                    deltas[workload_key(state)][name] += sign
+    return deltas
+
+
+def apply_workload_changes(changes):
+    """Fold ticket changes into the workload rows with one UPDATE per employee
+
+    Employees without a row yet are left alone; employee_workloads()
+    fills them from the live aggregate while ticket writes are held, so
+    the row includes every change committed before it.
+    """
+    for employee, delta in workload_deltas(changes).items():
+        updates = {name: F(name) + amount for name, amount in delta.items() if amount}
+        if updates:
+            EmployeeWorkload.objects.filter(employee=employee).update(**updates)
+
+
+def live_workloads(employee_ids=None):
+    """Aggregate the unfinished tickets of employees in one grouped query
+
+    Arguments:
+        employee_ids -- Employees to count (0 for unassigned); None for all
+    """
+    tickets = Ticket.objects.filter(status__in=Ticket.ACTIVE_STATUSES)
+    if employee_ids is not None:
+        chosen = Q(employee_id__in=[pk for pk in employee_ids if pk])
+        if EmployeeWorkload.UNASSIGNED in employee_ids:
+            chosen |= Q(employee__isnull=True)
+        tickets = tickets.filter(chosen)
+    rows = tickets.order_by().values('employee_id').annotate(
+        **{name: Count('id', filter=condition) for name, (condition, _) in WORKLOAD_BUCKETS.items()})
+    empty = dict.fromkeys(WORKLOAD_BUCKETS, 0)
+    workloads = {pk: dict(empty) for pk in employee_ids or ()}
+    for row in rows:
+        workloads[row.pop('employee_id') or EmployeeWorkload.UNASSIGNED] = row
+    return workloads
+
+
+def employee_workloads(employee_ids):
+    """Workload counts of each employee id (0 for unassigned tickets)
+
+    Reads the workload rows when counters are enabled, filling missing
+    ones from the live aggregate (see stats.fill_counter_rows).
+
+    Returns:
+        dict -- employee id -> {bucket: count}
+    """
+    if not workload_counters_enabled():
+        return live_workloads(employee_ids)
+    return fill_counter_rows(EmployeeWorkload, 'employee', employee_ids, WORKLOAD_BUCKETS, live_workloads)
+
+
+def rebuild_workloads():
+    """Replace every workload row with the live aggregate
+
+    Returns:
+        int -- Number of workload rows written
+    """
+    with transaction.atomic():
+        hold_ticket_writes(EmployeeWorkload.objects.db)
+        employee_ids = [EmployeeWorkload.UNASSIGNED, *Employee.objects.values_list('id', flat=True)]
+        workloads = live_workloads(employee_ids)
+        EmployeeWorkload.objects.all().delete()
+        EmployeeWorkload.objects.bulk_create(
+            EmployeeWorkload(employee=pk, **values) for pk, values in workloads.items())
+    return len(workloads)
+
+
+def verify_workloads():
+    """Compare stored workload rows with the live aggregate
+
+    Returns:
+        dict -- employee id -> (stored, live) for every row that disagrees
+    """
+    stored = {row.pop('employee'): row
+              for row in EmployeeWorkload.objects.values('employee', *WORKLOAD_BUCKETS)}
+    live = live_workloads(list(stored))
+    return {pk: (row, live[pk]) for pk, row in stored.items() if row != live[pk]}
+
+
+def load_score(workload):
+    """Weighted load: unfinished tickets counted by priority and emergency"""
+    return sum(workload[name] * weight for name, weight in LOAD_WEIGHTS.items())
+
+
+def words(text):
+    """Lower-case words of text with a plural 's' dropped"""
+    return {word[:-1] if word.endswith('s') and len(word) > 3 else word
+            for word in re.findall(r'[a-z]+', text.lower())}
+
+
+def suggest_assignees(ticket, employees, workloads):
+    """Employees ranked for a ticket: specialty matches first, then least loaded
+
+    A specialty matches when one of its words (e.g. 'Phones') appears in
+    the ticket description.
+
+    Arguments:
+        ticket -- The Ticket to assign
+        employees -- (id, specialty) pairs to choose from
+        workloads -- employee_workloads() for those employees
+
+    Returns:
+        list -- {'employee', 'specialty_match', 'load'} dicts, best first
+    """
+    described = words(ticket.description)
+    suggestions = [{'employee': pk, 'specialty_match': bool(words(specialty) & described),
+                    'load': load_score(workloads[pk])} for pk, specialty in employees]
+    suggestions.sort(key=lambda item: (not item['specialty_match'], item['load'], item['employee']))
+    return suggestions